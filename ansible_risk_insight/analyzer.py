@@ -16,16 +16,27 @@
 
 import argparse
 import json
+import hashlib
 import logging
 from typing import List
 from ansible_risk_insight import annotators
-from .models import TaskCallsInTree
+from .models import TaskCallsInTree, TaskCall
+from .stats import ExecutionStats
+from .annotators.variable_resolver import VARIABLE_ANNOTATION_TYPE
 
 
-def load_annotators():
+# `categories` is a set of the risk annotation categories needed by the rules (None means all).
+# the annotators which cannot produce any of them are not loaded
+def load_annotators(categories: set = None):
     _annotators = []
     for annotator in annotators.__all__:
-        _annotators.append(getattr(annotators, annotator)())
+        ax = getattr(annotators, annotator)()
+        if categories is not None:
+            if len(categories) == 0:
+                continue
+            if len(ax.categories) > 0 and not categories & set(ax.categories):
+                continue
+        _annotators.append(ax)
     return _annotators
 
 
@@ -42,9 +53,36 @@ def load_taskcalls_in_trees(path: str) -> List[TaskCallsInTree]:
     return taskcalls_in_trees
 
 
-def analyze(taskcalls_in_trees: List[TaskCallsInTree]):
+# the same task spec is called from many trees (e.g. a role task used by many playbooks),
+# so the annotations are computed once per task spec and its resolved variables
+def make_annotation_cache_key(annotator, taskcall: TaskCall):
+    var_annos = taskcall.get_annotation_by_type(VARIABLE_ANNOTATION_TYPE)
+    var_data = [
+        [
+            va.resolved_module_options,
+            va.resolved_variables,
+            va.mutable_vars_per_mo,
+        ]
+        for va in var_annos
+    ]
+    try:
+        var_data_str = json.dumps(var_data, sort_keys=True, default=str)
+    except Exception:
+        var_data_str = repr(var_data)
+    var_data_hash = hashlib.sha256(var_data_str.encode("utf-8")).hexdigest()
+    return (annotator.name, taskcall.spec.key, taskcall.spec.resolved_name, var_data_hash)
+
+
+# `annotation_cache` can be given to share the annotations across the calls (e.g. analyzing tree by tree)
+def analyze(taskcalls_in_trees: List[TaskCallsInTree], stats: ExecutionStats = None, categories: set = None, annotation_cache: dict = None):
     # risk annotator
-    _annotators = load_annotators()
+    _annotators = load_annotators(categories)
+    if len(_annotators) == 0:
+        logging.debug("analyze() skipped because no annotator is needed")
+        return taskcalls_in_trees
+    if annotation_cache is None:
+        annotation_cache = {}
+    cache_hit = 0
 
     num = len(taskcalls_in_trees)
     for i, taskcalls_in_tree in enumerate(taskcalls_in_trees):
@@ -60,9 +98,19 @@ def analyze(taskcalls_in_trees: List[TaskCallsInTree]):
                     break
             if annotator is None:
                 continue
-            annotations = annotator.run(taskcall)
+            cache_key = make_annotation_cache_key(annotator, taskcall)
+            annotations = annotation_cache.get(cache_key, None)
+            if annotations is None:
+                if stats is not None:
+                    annotations = stats.measure(annotator.name, annotator.run, taskcall, hit_func=lambda r: len(r) > 0)
+                else:
+                    annotations = annotator.run(taskcall)
+                annotation_cache[cache_key] = annotations
+            else:
+                cache_hit += 1
             taskcalls_in_trees[i].taskcalls[j].annotations.extend(annotations)
         logging.debug("analyze() {}/{} done".format(i + 1, num))
+    logging.debug("analyze() reused annotations for {} taskcalls".format(cache_hit))
     return taskcalls_in_trees
 
 
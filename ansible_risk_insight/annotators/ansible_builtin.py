@@ -24,6 +24,18 @@ from .risk_annotator_base import RiskAnnotator, AnnotatorCategory
 class AnsibleBuiltinRiskAnnotator(RiskAnnotator):
     name: str = "ansible.builtin"
     enabled: bool = True
+    categories: list = [
+        AnnotatorCategory.NONE,
+        AnnotatorCategory.CMD_EXEC,
+        AnnotatorCategory.INBOUND,
+        AnnotatorCategory.OUTBOUND,
+        AnnotatorCategory.FILE_CHANGE,
+        AnnotatorCategory.SYSTEM_CHANGE,
+        AnnotatorCategory.NETWORK_CHANGE,
+        AnnotatorCategory.CONFIG_CHANGE,
+        AnnotatorCategory.PACKAGE_INSTALL,
+        AnnotatorCategory.PRIVILEGE_ESCALATION,
+    ]
 
     def match(self, taskcall: TaskCall) -> bool:
         resolved_name = taskcall.spec.resolved_name
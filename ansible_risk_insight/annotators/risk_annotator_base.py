@@ -39,6 +39,8 @@ class RiskAnnotator(Annotator):
     type: str = RISK_ANNOTATION_TYPE
     name: str = ""
     enabled: bool = False
+    # risk annotation categories this annotator can produce. if empty, it is always run
+    categories: list = []
 
     def match(self, taskcall: TaskCall) -> bool:
         raise ValueError("this is a base class method")
@@ -23,6 +23,7 @@ from .risk_annotator_base import RiskAnnotator, AnnotatorCategory
 class SampleCustomAnnotator(RiskAnnotator):
     name: str = "sample"
     enabled: bool = False
+    categories: list = [AnnotatorCategory.PACKAGE_INSTALL]
 
     # whether this task should be analyzed by this or not
     def match(self, taskcall: TaskCall) -> bool:
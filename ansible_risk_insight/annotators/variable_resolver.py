@@ -25,7 +25,7 @@ from ..models import (
     Annotation,
     VariableAnnotation,
 )
-from ..context import Context, resolve_module_options
+from ..context import Context, resolve_module_options, default_loop_expansion_limit
 from .annotator_base import Annotator
 
 
@@ -46,6 +46,7 @@ class VariableAnnotator(Annotator):
             resolved_module_options=resolved[0],
             resolved_variables=resolved[1],
             mutable_vars_per_mo=resolved[2],
+            loop_summary=resolved[3],
         )
         annotations = [va]
         return annotations
@@ -120,10 +121,18 @@ def tree_to_task_list(tree, node_objects):
     return tasks
 
 
-def resolve_variables(tree: ObjectList, additional: ObjectList) -> List[TaskCall]:
+# if `with_variables` is False, only the taskcalls are collected without variable annotations
+def resolve_variables(
+    tree: ObjectList,
+    additional: ObjectList,
+    loop_expansion_limit: int = default_loop_expansion_limit,
+    with_variables: bool = True,
+) -> List[TaskCall]:
+    if not with_variables:
+        return [call_obj for call_obj in tree.items if isinstance(call_obj, TaskCall)]
     tree_root_key = tree.items[0].spec.key if len(tree.items) > 0 else ""
     inventories = get_inventories(tree_root_key, additional)
-    context = Context(inventories=inventories)
+    context = Context(inventories=inventories, loop_expansion_limit=loop_expansion_limit)
     depth_dict = {}
     resolved_taskcalls = []
     for call_obj in tree.items:
@@ -14,10 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import codecs
 import os
 import re
 
+from . import vfs
+
 
 valid_playbook_re = re.compile(r"^\s*?-?\s*?(?:hosts|include|import_playbook):\s*?.*?$")
 
@@ -33,7 +34,7 @@ def could_be_playbook(fpath):
     # show up.
     matched = False
     try:
-        with codecs.open(fpath, "r", encoding="utf-8", errors="ignore") as f:
+        with vfs.open(fpath, "r", encoding="utf-8", errors="ignore") as f:
             for n, line in enumerate(f):
                 if valid_playbook_re.match(line):
                     matched = True
@@ -52,8 +53,8 @@ def could_be_playbook(fpath):
 # awx/main/models/projects.py#L206-L217 in ansible/awx
 def search_playbooks(root_path):
     results = []
-    if root_path and os.path.exists(root_path):
-        for dirpath, dirnames, filenames in os.walk(root_path, followlinks=False):
+    if root_path and vfs.exists(root_path):
+        for dirpath, dirnames, filenames in vfs.walk(root_path, followlinks=False):
             if skip_directory(dirpath):
                 continue
             for filename in filenames:
@@ -14,9 +14,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import sys
 import argparse
 
 from ..scanner import ARIScanner, config
+from ..rules.base import _severity_level_mapping
 from ..utils import (
     is_url,
     is_local_path,
@@ -25,6 +27,15 @@ from ..utils import (
     split_name_and_version,
 )
 
+# exit code when a finding at or above the --fail-on severity is found
+gate_failure_exit_code = 3
+
+
+def split_comma_separated(txt):
+    if not txt:
+        return []
+    return [part.strip() for part in txt.split(",") if part.strip() != ""]
+
 
 class ARICLI:
     args = None
@@ -44,9 +55,24 @@ class ARICLI:
         parser.add_argument("--collection-name", nargs="?", help="if provided, use it as a collection name")
         parser.add_argument("--role-name", nargs="?", help="if provided, use it as a role name")
         parser.add_argument("--source", help="source server name in ansible config file (if empty, use public ansible galaxy)")
+        parser.add_argument(
+            "--mirror-dir",
+            help="offline mode; resolve collections and roles from this local Galaxy mirror dir (default=ARI_OFFLINE_MIRROR)",
+        )
+        parser.add_argument("--commit", help="for a local git repository project, scan this commit (sha or ref) without checking it out")
         parser.add_argument("--pretty", action="store_true", help="show results in a pretty format")
         parser.add_argument("--without-ram", action="store_true", help="if true, RAM data is not used for this scan")
         parser.add_argument("--show-all", action="store_true", help="if true, show findings even if missing dependencies are found")
+        parser.add_argument("--rule-stats", action="store_true", help="if true, show call counts, hit counts and time of each annotator and rule")
+        parser.add_argument(
+            "--fail-on",
+            choices=list(_severity_level_mapping.keys()),
+            help=f"stop at the first finding at or above this severity and exit with code {gate_failure_exit_code} (for CI gating)",
+        )
+        parser.add_argument("--rules", help="comma separated rule names to run instead of the default enabled rules")
+        parser.add_argument("--skip-rules", help="comma separated rule names to skip")
+        parser.add_argument("--min-severity", choices=list(_severity_level_mapping.keys()), help="run only the rules at or above this severity")
+        parser.add_argument("--tags", help="comma separated tags; run only the rules which have any of them")
         parser.add_argument("-o", "--out-dir", help="output directory for findings")
         args = parser.parse_args()
         self.args = args
@@ -94,12 +120,22 @@ class ARICLI:
             do_save=args.save,
             without_ram=args.without_ram,
             source_repository=args.source,
+            mirror_dir=args.mirror_dir or "",
+            git_commit=args.commit or "",
             out_dir=args.out_dir,
             show_all=args.show_all,
             pretty=args.pretty,
+            rule_stats=args.rule_stats,
+            fail_on=args.fail_on or "",
+            rules=split_comma_separated(args.rules),
+            skip_rules=split_comma_separated(args.skip_rules),
+            min_severity=args.min_severity or "",
+            rule_tags=split_comma_separated(args.tags),
         )
         print("Start preparing dependencies")
         root_install = not args.skip_install
         c.prepare_dependencies(root_install=root_install)
         print("Start scanning")
         c.load()
+        if c.is_gate_failed():
+            sys.exit(gate_failure_exit_code)
@@ -17,6 +17,8 @@
 import os
 import re
 import copy
+import json
+import functools
 from dataclasses import dataclass, field
 from pathlib import Path
 from .models import (
@@ -33,9 +35,14 @@ from .models import (
 )
 
 p = Path(__file__).resolve().parent
-ansible_special_variables = open(p / "ansible_variables.txt", "r").read().splitlines()
+ansible_special_variables = set(open(p / "ansible_variables.txt", "r").read().splitlines())
 _special_var_value = "__ansible_special_variable__"
 variable_block_re = re.compile(r"{{[^}]+}}")
+number_re = re.compile(r"[0-9].*")
+default_filters = ["default", "d"]
+variable_block_cache_size = 8192
+# max number of distinct resolved module options per loop task (0 means unlimited)
+default_loop_expansion_limit = 100
 
 
 class VariableType:
@@ -57,6 +64,13 @@ mutable_types = [
     VariableType.INVENTORY_VARS,
 ]
 
+# variable types which are determined by the name of a variable, in priority order
+tagged_types = [
+    VariableType.ROLE_VARS,
+    VariableType.ROLE_DEFAULTS,
+    VariableType.REGISTERED_VARS,
+]
+
 
 def get_object(json_path, type, name, cache={}):
     json_type = ""
@@ -169,7 +183,7 @@ def flatten(var_dict: dict = {}, _prefix: str = ""):
     flat_vars = {}
     for k, v in var_dict.items():
         if isinstance(v, dict):
-            new_prefix = f"{k}." if _prefix == "" else f"{_prefix}{k}"
+            new_prefix = f"{_prefix}{k}."
             sub_flat_vars = flatten(v, new_prefix)
             flat_vars.update(sub_flat_vars)
         else:
@@ -178,38 +192,134 @@ def flatten(var_dict: dict = {}, _prefix: str = ""):
     return flat_vars
 
 
-class VariableType:
-    NORMAL = "normal"
-    LOOP_VAR = "loop_var"
-    REGISTERED_VARS = "registered_vars"
-    ROLE_DEFAULTS = "role_defaults"
-    ROLE_VARS = "role_vars"
-    INVENTORY_VARS = "inventory_vars"
-    SPECIAL_VARS = "special_vars"
-    PARTIAL_RESOLVE = "partial_resolve"
-    FAILED_TO_RESOLVE = "failed_to_resolve"
+@dataclass
+class VariableLayer:
+    variables: dict = field(default_factory=dict)
+    flat_vars: dict = field(default_factory=dict)
+    type: str = VariableType.NORMAL
+    depth: int = 0
+    # persistent layers stay visible after leaving the subtree that defined them
+    # (role vars/defaults and registered vars), like they do in ansible-playbook
+    persistent: bool = False
 
 
-mutable_types = [
-    VariableType.NORMAL,
-    VariableType.ROLE_DEFAULTS,
-    VariableType.ROLE_VARS,
-    VariableType.INVENTORY_VARS,
-]
+# VariableScope keeps the variables of the current call chain as a stack of layers
+# and a merged index of them, so that a lookup is a single dict access
+# instead of a search over all the objects added so far.
+@dataclass
+class VariableScope:
+    layers: list = field(default_factory=list)
+    inventory_vars: dict = field(default_factory=dict)
+
+    # incremented whenever the visible variables change
+    version: int = 0
+
+    _vars: dict = field(default_factory=dict)
+    _flat_vars: dict = field(default_factory=dict)
+    _tags: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        self._tags = {t: set() for t in tagged_types}
+
+    @classmethod
+    def from_inventories(cls, inventories: list):
+        inventory_vars = {}
+        # TODO: consider group
+        inventory_for_all = [iv for iv in inventories if iv.inventory_type == InventoryType.GROUP_VARS_TYPE and iv.name == "all"]
+        # the first inventory wins, so apply them in reverse order
+        for iv in reversed(inventory_for_all):
+            inventory_vars.update(flatten(iv.variables))
+        return cls(inventory_vars=inventory_vars)
+
+    def push(self, variables: dict, type: str = VariableType.NORMAL, depth: int = 0, persistent: bool = False):
+        if not variables:
+            return
+        layer = VariableLayer(
+            variables=variables,
+            flat_vars=flatten(variables),
+            type=type,
+            depth=depth,
+            persistent=persistent,
+        )
+        self.layers.append(layer)
+        self.version += 1
+        self._vars.update(layer.variables)
+        self._flat_vars.update(layer.flat_vars)
+        if type in self._tags:
+            self._tags[type].update(layer.variables)
+
+    # remove the non-persistent layers added at `depth` or deeper
+    def pop(self, depth: int = 0):
+        popped = [ly for ly in self.layers if ly.depth >= depth and not ly.persistent]
+        if len(popped) == 0:
+            return
+        self.layers = [ly for ly in self.layers if ly.depth < depth or ly.persistent]
+        self.version += 1
+        for ly in popped:
+            for var_name in ly.variables:
+                self._reindex(var_name, "variables", self._vars)
+            for var_name in ly.flat_vars:
+                self._reindex(var_name, "flat_vars", self._flat_vars)
+            if ly.type in self._tags:
+                for var_name in ly.variables:
+                    if not any(var_name in _ly.variables for _ly in self.layers if _ly.type == ly.type):
+                        self._tags[ly.type].discard(var_name)
+
+    def _reindex(self, var_name: str, attr: str, index: dict):
+        for ly in reversed(self.layers):
+            layer_vars = getattr(ly, attr)
+            if var_name in layer_vars:
+                index[var_name] = layer_vars[var_name]
+                return
+        index.pop(var_name, None)
+
+    def get(self, var_name: str):
+        val = self._vars.get(var_name, None)
+        if val is not None:
+            return val
+        return self._flat_vars.get(var_name, None)
+
+    def get_inventory_var(self, var_name: str):
+        return self.inventory_vars.get(var_name, None)
+
+    def type_of(self, var_name: str):
+        for v_type in tagged_types:
+            if var_name in self._tags[v_type]:
+                return v_type
+        return VariableType.NORMAL
+
+    @property
+    def variables(self):
+        return self._vars
+
+    def copy(self):
+        scope = VariableScope(
+            layers=copy.copy(self.layers),
+            inventory_vars=self.inventory_vars,
+            version=self.version,
+            _vars=copy.copy(self._vars),
+            _flat_vars=copy.copy(self._flat_vars),
+        )
+        scope._tags = {t: copy.copy(names) for t, names in self._tags.items()}
+        return scope
 
 
 @dataclass
 class Context:
     keep_obj: bool = False
     chain: list = field(default_factory=list)
-    variables: dict = field(default_factory=dict)
     options: dict = field(default_factory=dict)
     inventories: list = field(default_factory=list)
-    role_defaults: list = field(default_factory=list)
-    role_vars: list = field(default_factory=list)
-    registered_vars: list = field(default_factory=list)
+    scope: VariableScope = None
+    loop_expansion_limit: int = default_loop_expansion_limit
 
-    _flat_vars: dict = field(default_factory=dict)
+    # memo of resolve_variable() results for the current scope version
+    _resolved: dict = field(default_factory=dict)
+    _resolved_version: int = -1
+
+    def __post_init__(self):
+        if self.scope is None:
+            self.scope = VariableScope.from_inventories(self.inventories)
 
     def add(self, obj, depth_lvl=0):
         _obj = None
@@ -220,101 +330,55 @@ class Context:
         elif isinstance(obj, CallObject):
             _obj = obj
             _spec = obj.spec
-        # variables
-        if isinstance(_spec, Playbook):
-            self.variables.update(_spec.variables)
-            self.update_flat_vars(_spec.variables)
-        elif isinstance(_spec, Play):
-            self.variables.update(_spec.variables)
-            self.update_flat_vars(_spec.variables)
-        elif isinstance(_spec, Role):
-            self.variables.update(_spec.default_variables)
-            self.update_flat_vars(_spec.default_variables)
-            self.variables.update(_spec.variables)
-            self.update_flat_vars(_spec.variables)
-            for var_name in _spec.default_variables:
-                self.role_defaults.append(var_name)
-            for var_name in _spec.variables:
-                self.role_vars.append(var_name)
-        elif isinstance(_spec, Collection):
-            self.variables.update(_spec.variables)
-            self.update_flat_vars(_spec.variables)
-        elif isinstance(_spec, TaskFile):
-            self.variables.update(_spec.variables)
-            self.update_flat_vars(_spec.variables)
-        elif isinstance(_spec, Task):
-            self.variables.update(_spec.variables)
-            self.update_flat_vars(_spec.variables)
-            self.variables.update(_spec.registered_variables)
-            self.update_flat_vars(_spec.registered_variables)
-            for var_name in _spec.registered_variables:
-                self.registered_vars.append(var_name)
-        else:
+        if not isinstance(_spec, (Playbook, Play, Role, Collection, TaskFile, Task)):
             # Module
             return
+        # variables of the previous siblings and their children are out of scope here
+        self.scope.pop(depth_lvl)
+        if isinstance(_spec, Role):
+            self.scope.push(_spec.default_variables, VariableType.ROLE_DEFAULTS, depth_lvl, persistent=True)
+            self.scope.push(_spec.variables, VariableType.ROLE_VARS, depth_lvl, persistent=True)
+        elif isinstance(_spec, Task):
+            self.scope.push(_spec.variables, VariableType.NORMAL, depth_lvl)
+            self.scope.push(_spec.registered_variables, VariableType.REGISTERED_VARS, depth_lvl, persistent=True)
+        else:
+            # Playbook, Play, Collection and TaskFile
+            self.scope.push(_spec.variables, VariableType.NORMAL, depth_lvl)
         self.options.update(_spec.options)
         chain_node = {"key": _obj.key, "depth": depth_lvl}
         if self.keep_obj:
             chain_node["obj"] = _obj
         self.chain.append(chain_node)
 
+    @property
+    def variables(self):
+        return self.scope.variables
+
     def resolve_variable(self, var_name, resolve_history=[]):
         if var_name in resolve_history:
             return None, VariableType.FAILED_TO_RESOLVE
+        # only top-level lookups are memoized because a nested lookup
+        # can give a different result depending on the resolve history
+        if len(resolve_history) > 0:
+            return self._resolve_variable(var_name, resolve_history)
+        if self._resolved_version != self.scope.version:
+            self._resolved = {}
+            self._resolved_version = self.scope.version
+        if var_name not in self._resolved:
+            self._resolved[var_name] = self._resolve_variable(var_name, resolve_history)
+        return self._resolved[var_name]
+
+    def _resolve_variable(self, var_name, resolve_history=[]):
         _resolve_history = [rn for rn in resolve_history] + [var_name]
 
-        v_type = VariableType.NORMAL
-        if var_name in self.role_vars:
-            v_type = VariableType.ROLE_VARS
-        elif var_name in self.role_defaults:
-            v_type = VariableType.ROLE_DEFAULTS
-        elif var_name in self.registered_vars:
-            v_type = VariableType.REGISTERED_VARS
-
-        val = self.variables.get(var_name, None)
+        val = self.scope.get(var_name)
         if val is not None:
-            if isinstance(val, str):
-                return (
-                    self.resolve_single_variable(val, _resolve_history),
-                    v_type,
-                )
-            elif isinstance(val, list):
-                resolved_val_list = [self.resolve_single_variable(vi, _resolve_history) for vi in val]
-                return resolved_val_list, v_type
-            else:
-                return val, v_type
+            v_type = self.scope.type_of(var_name)
+            return self._resolve_value(val, _resolve_history), v_type
 
-        val = self._flat_vars.get(var_name, None)
+        val = self.scope.get_inventory_var(var_name)
         if val is not None:
-            if isinstance(val, str):
-                return (
-                    self.resolve_single_variable(val, _resolve_history),
-                    v_type,
-                )
-            elif isinstance(val, list):
-                resolved_val_list = [self.resolve_single_variable(vi, _resolve_history) for vi in val]
-                return resolved_val_list, v_type
-            else:
-                return val, v_type
-
-        # TODO: consider group
-        inventory_for_all = [iv for iv in self.inventories if iv.inventory_type == InventoryType.GROUP_VARS_TYPE and iv.name == "all"]
-        for iv in inventory_for_all:
-            iv_var_dict = flatten(iv.variables)
-            val = iv_var_dict.get(var_name, None)
-
-            if val is not None:
-                v_type = VariableType.INVENTORY_VARS
-                if isinstance(val, str):
-                    return (
-                        self.resolve_single_variable(val, _resolve_history),
-                        v_type,
-                    )
-                elif isinstance(val, list):
-                    resolved_val_list = [self.resolve_single_variable(vi, _resolve_history) for vi in val]
-                    return resolved_val_list, v_type
-                else:
-                    return val, v_type
+            return self._resolve_value(val, _resolve_history), VariableType.INVENTORY_VARS
 
         if var_name in ansible_special_variables:
             return _special_var_value, VariableType.SPECIAL_VARS
@@ -352,6 +416,13 @@ class Context:
 
         return None, VariableType.FAILED_TO_RESOLVE
 
+    def _resolve_value(self, val, resolve_history):
+        if isinstance(val, str):
+            return self.resolve_single_variable(val, resolve_history)
+        elif isinstance(val, list):
+            return [self.resolve_single_variable(vi, resolve_history) for vi in val]
+        return val
+
     def resolve_single_variable(self, txt, resolve_history=[]):
         if not isinstance(txt, str):
             return txt
@@ -376,16 +447,6 @@ class Context:
         else:
             return txt
 
-    def update_flat_vars(self, new_vars: dict, _prefix: str = ""):
-        for k, v in new_vars.items():
-            if isinstance(v, dict):
-                new_prefix = f"{k}." if _prefix == "" else f"{_prefix}{k}"
-                self.update_flat_vars(v, new_prefix)
-            else:
-                flat_key = f"{_prefix}{k}"
-                self._flat_vars.update({flat_key: v})
-        return
-
     def chain_str(self):
         lines = []
         for chain_item in self.chain:
@@ -405,12 +466,10 @@ class Context:
         return Context(
             keep_obj=self.keep_obj,
             chain=copy.copy(self.chain),
-            variables=copy.copy(self.variables),
             options=copy.copy(self.options),
             inventories=copy.copy(self.inventories),
-            role_defaults=copy.copy(self.role_defaults),
-            role_vars=copy.copy(self.role_vars),
-            registered_vars=copy.copy(self.registered_vars),
+            scope=self.scope.copy(),
+            loop_expansion_limit=self.loop_expansion_limit,
         )
         # return copy.deepcopy(self)
 
@@ -472,7 +531,7 @@ def resolve_module_options(context: Context, taskcall: TaskCall):
                                 "__v_name__": var_name,
                             }
                         )
-                if isinstance(resolved_vars_in_item, dict):
+                elif isinstance(resolved_vars_in_item, dict):
                     for vi_key, vi_value in resolved_vars_in_item.items():
                         variables_in_loop.append(
                             {
@@ -542,7 +601,19 @@ def resolve_module_options(context: Context, taskcall: TaskCall):
 
     resolved_opts_in_loop = []
     mutable_vars_per_mo = {}
+    # identical resolved options are kept only once, and the items beyond the limit are dropped
+    # so that a huge loop does not explode memory and annotation time. an item beyond the limit
+    # is still kept if it has a mutable or unresolved variable which the kept items do not have
+    loop_summary = {"total": len(variables_in_loop), "deduplicated": 0, "truncated": 0}
+    found_opts = set()
+    found_signals = set()
+    limit = context.loop_expansion_limit
     for variables in variables_in_loop:
+        signals = _get_loop_item_signals(variables)
+        if limit > 0 and len(resolved_opts_in_loop) >= limit and signals <= found_signals:
+            loop_summary["truncated"] += 1
+            continue
+        found_signals.update(signals)
         resolved_opts = None
         if isinstance(taskcall.spec.module_options, dict):
             resolved_opts = {}
@@ -673,34 +744,114 @@ def resolve_module_options(context: Context, taskcall: TaskCall):
             resolved_opts = resolved_opt_val
         else:
             resolved_opts = taskcall.spec.module_options
+        opts_key = _make_options_key(resolved_opts)
+        if opts_key in found_opts:
+            loop_summary["deduplicated"] += 1
+            continue
+        found_opts.add(opts_key)
         resolved_opts_in_loop.append(resolved_opts)
-    return resolved_opts_in_loop, resolved_vars, mutable_vars_per_mo
+    return resolved_opts_in_loop, resolved_vars, mutable_vars_per_mo, loop_summary
+
+
+# the mutable or unresolved variables which a loop item brings into the module options
+def _get_loop_item_signals(variables: dict):
+    signals = set()
+    v_type = variables.get("__v_type__", "")
+    if v_type in mutable_types or v_type == VariableType.FAILED_TO_RESOLVE:
+        signals.add((v_type, variables.get("__v_name__", "")))
+    for key, value in variables.items():
+        if key.startswith("__") or not isinstance(value, str) or not variable_block_re.search(value):
+            continue
+        for var_name_dict in extract_variable_names(value):
+            signals.add((VariableType.PARTIAL_RESOLVE, var_name_dict.get("name", "")))
+    return signals
+
+
+def _make_options_key(resolved_opts):
+    try:
+        return json.dumps(resolved_opts, sort_keys=True, default=str)
+    except Exception:
+        return repr(resolved_opts)
 
 
 def extract_variable_names(txt):
     if not variable_block_re.search(txt):
         return []
+    return [dict(b, filters=list(b["filters"])) for b in _parse_variable_blocks(txt)]
+
+
+# the same templated strings such as "{{ item }}" appear many times in a tree,
+# so the parsed result is cached per raw string
+@functools.lru_cache(maxsize=variable_block_cache_size)
+def _parse_variable_blocks(txt):
     found_var_blocks = variable_block_re.findall(txt)
     blocks = []
     for b in found_var_blocks:
-        parts = b.split("|")
-        var_name = ""
-        default_var_name = ""
-        for i, p in enumerate(parts):
-            if i == 0:
-                var_name = p.replace("{{", "").replace("}}", "").replace(" ", "")
-            else:
-                if "default(" in p and ")" in p:
-                    default_var = p.replace("}}", "").replace("default(", "").replace(")", "").replace(" ", "")
-                    if not default_var.startswith('"') and not default_var.startswith("'") and not re.compile(r"[0-9].*").match(default_var):
-                        default_var_name = default_var
+        var_name = b.split("|")[0].replace("{{", "").replace("}}", "").replace(" ", "")
+        if var_name == "":
+            continue
+        filters, default_var_name = _parse_filters(b)
         tmp_b = {
             "original": b,
+            "name": var_name,
+            "filters": tuple(filters),
         }
-        if var_name == "":
-            continue
-        tmp_b["name"] = var_name
         if default_var_name != "":
             tmp_b["default"] = default_var_name
         blocks.append(tmp_b)
-    return blocks
+    return tuple(blocks)
+
+
+# jinja2 is slow to import, so it is imported when the first variable block is parsed
+@functools.lru_cache(maxsize=None)
+def _get_jinja2_env():
+    import jinja2
+
+    return jinja2.Environment()
+
+
+def _parse_filters(block):
+    from jinja2 import nodes as jinja2_nodes
+
+    try:
+        template = _get_jinja2_env().parse(block)
+        expr = template.body[0].nodes[0]
+    except Exception:
+        return _parse_filters_by_str(block)
+    filters = []
+    default_var_name = ""
+    node = expr
+    while isinstance(node, jinja2_nodes.Filter):
+        filters.insert(0, node.name)
+        if node.name in default_filters and len(node.args) > 0:
+            default_var_name = _node_to_var_name(node.args[0])
+        node = node.node
+    return filters, default_var_name
+
+
+# fallback for the blocks that are not parsable as a jinja2 expression
+def _parse_filters_by_str(block):
+    filters = []
+    default_var_name = ""
+    parts = block.split("|")
+    for p in parts[1:]:
+        filter_name = p.replace("}}", "").split("(")[0].strip()
+        if filter_name != "":
+            filters.append(filter_name)
+        if "default(" in p and ")" in p:
+            default_var = p.replace("}}", "").replace("default(", "").replace(")", "").replace(" ", "")
+            if not default_var.startswith('"') and not default_var.startswith("'") and not number_re.match(default_var):
+                default_var_name = default_var
+    return filters, default_var_name
+
+
+def _node_to_var_name(node):
+    from jinja2 import nodes as jinja2_nodes
+
+    if isinstance(node, jinja2_nodes.Name):
+        return node.name
+    if isinstance(node, jinja2_nodes.Getattr):
+        parent = _node_to_var_name(node.node)
+        if parent != "":
+            return "{}.{}".format(parent, node.attr)
+    return ""
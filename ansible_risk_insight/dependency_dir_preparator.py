@@ -15,6 +15,7 @@
 # limitations under the License.
 
 import os
+import fcntl
 import json
 import yaml
 import subprocess
@@ -25,20 +26,32 @@ import re
 import sys
 import datetime
 import tarfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field, asdict
 
 from .models import (
     LoadType,
 )
 from .dependency_finder import find_dependency
+from .galaxy_mirror import GalaxyMirror, match_version
 from .utils import (
     escape_url,
     install_galaxy_target,
+    install_collection_from_targz,
     install_github_target,
     get_installed_metadata,
-    get_hash_of_url,
+    get_hash_of_artifact,
+    get_hash_of_data,
+    get_hash_of_file,
     is_url,
     is_local_path,
+    resolve_git_commit,
+    version_to_num,
+    place_tree,
+    default_placement_mode,
+    default_clone_depth,
 )
 from .loader import (
     get_target_name,
@@ -46,6 +59,7 @@ from .loader import (
     trim_suffix,
 )
 from .safe_glob import safe_glob
+from . import vfs
 
 collection_manifest_json = "MANIFEST.json"
 collection_files_json = "FILES.json"
@@ -62,6 +76,21 @@ supported_target_types = [
 
 download_metadata_file = "download_meta.json"
 
+default_download_workers = 4
+default_download_retries = 2
+
+archive_index_file = "archive_index.json"
+archive_blob_dir = "blobs"
+extracted_archive_dir = "extracted"
+
+dependency_cache_dir = "dependency_cache"
+git_mirror_cache_dir = "git_mirrors"
+# the commits which are not in the scanned repository are fetched into the mirrors here
+git_commit_cache_dir = os.path.join(git_mirror_cache_dir, "commits")
+
+collection_download_pattern = r"Downloading (.*\.tar\.gz) to"
+role_download_patterns = ["- extracting ", "is already installed"]
+
 
 @dataclass
 class DownloadMetadata(object):
@@ -88,6 +117,198 @@ class Dependency(object):
     metadata: DownloadMetadata = field(default_factory=DownloadMetadata)
 
 
+# content-addressable store of the downloaded archives.
+# the index maps (type, name, version) to the sha256 and the metadata of the archive,
+# and the archive itself is stored once at <root_dir>/blobs/<sha256[:2]>/<sha256>.tar.gz
+@dataclass
+class ArchiveIndex(object):
+    root_dir: str = ""
+    entries: dict = field(default_factory=dict)
+    latest: dict = field(default_factory=dict)
+    # the entry keys by the download url and by the file name of the url
+    urls: dict = field(default_factory=dict)
+    filenames: dict = field(default_factory=dict)
+    loaded: bool = False
+
+    @property
+    def index_path(self):
+        return os.path.join(self.root_dir, archive_index_file)
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root_dir, archive_blob_dir, sha256[:2], "{}.tar.gz".format(sha256))
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.index_path):
+            self.migrate()
+            return
+        try:
+            self.read()
+        except Exception:
+            logging.warning("failed to load the archive index {}; rebuild it".format(self.index_path))
+            self.migrate()
+
+    def read(self):
+        with open(self.index_path, "r") as f:
+            data = json.load(f)
+        self.entries = {}
+        self.latest = data.get("latest", {})
+        self.urls = {}
+        self.filenames = {}
+        for key, entry in data.get("entries", {}).items():
+            self.set_entry(key, entry)
+
+    def set_entry(self, key, entry):
+        self.entries[key] = entry
+        url = entry.get("metadata", {}).get("download_url", "")
+        if url:
+            self.urls[url] = key
+            self.filenames[url.rstrip("/").split("/")[-1]] = key
+
+    # the index is shared by the scans of many projects, so it is updated under the lock;
+    # the index on disk is reloaded and `entries` and `latest` are merged into it
+    def save(self, entries: dict, latest: dict):
+        with open("{}.lock".format(self.index_path), "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.index_path):
+                    try:
+                        self.read()
+                    except Exception:
+                        logging.warning("failed to load the archive index {}; overwrite it".format(self.index_path))
+                for key, entry in entries.items():
+                    self.set_entry(key, entry)
+                self.latest.update(latest)
+                fd, tmp_path = tempfile.mkstemp(dir=self.root_dir, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump({"entries": self.entries, "latest": self.latest}, f)
+                os.replace(tmp_path, self.index_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    # register the archives downloaded before the index was introduced. this is done only once
+    def migrate(self):
+        if self.root_dir == "":
+            return
+        metadata_list = []
+        for metadata_file in glob.glob(os.path.join(self.root_dir, LoadType.COLLECTION, "**", download_metadata_file), recursive=True):
+            try:
+                with open(metadata_file, "r") as f:
+                    metadata = json.load(f)
+                metadata_list.extend([DownloadMetadata(**d) for d in metadata.get("collections", [])])
+            except Exception:
+                logging.warning("failed to load the download metadata {}".format(metadata_file))
+        self.add_all(metadata_list)
+
+    # `version` can be an exact version or a spec like "*" and ">=1.0.0";
+    # a spec is resolved to the newest indexed version which satisfies it
+    def find(self, type, name, version=""):
+        self.load()
+        if version == "":
+            version = self.latest.get(make_archive_key(type, name), "")
+        md = self._get_metadata(make_archive_key(type, name, version))
+        if md is not None:
+            return md
+        prefix = make_archive_key(type, name) + ":"
+        candidates = [key[len(prefix) :] for key in self.entries if key.startswith(prefix)]
+        candidates = [v for v in candidates if match_version(v, version)]
+        for _version in sorted(candidates, key=version_to_num, reverse=True):
+            md = self._get_metadata(make_archive_key(type, name, _version))
+            if md is not None:
+                return md
+        return None
+
+    # returns the path of the stored archive which was downloaded from the url
+    def find_by_url(self, url):
+        self.load()
+        for key in [self.urls.get(url, ""), self.filenames.get(url.rstrip("/").split("/")[-1], "")]:
+            md = self._get_metadata(key)
+            if md is not None:
+                return md.download_src_path
+        return ""
+
+    def _get_metadata(self, key):
+        entry = self.entries.get(key, None)
+        if entry is None:
+            return None
+        md = DownloadMetadata(**entry.get("metadata", {}))
+        if not os.path.exists(md.download_src_path):
+            return None
+        return md
+
+    # move the archives to the blob store and register them. identical archives are stored once
+    def add_all(self, metadata_list: list):
+        self.load()
+        stored = []
+        entries = {}
+        latest = {}
+        for md in metadata_list:
+            src_path = md.download_src_path
+            if not os.path.isfile(src_path):
+                stored.append(md)
+                continue
+            sha256 = get_hash_of_file(src_path)
+            blob_path = self.blob_path(sha256)
+            if os.path.abspath(src_path) != blob_path:
+                if os.path.exists(blob_path):
+                    os.remove(src_path)
+                else:
+                    os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                    os.replace(src_path, blob_path)
+            md.download_src_path = blob_path
+            entries[make_archive_key(md.type, md.name, md.version)] = {"sha256": sha256, "metadata": asdict(md)}
+            latest[make_archive_key(md.type, md.name)] = md.version
+            stored.append(md)
+        if os.path.exists(self.root_dir):
+            self.save(entries, latest)
+        else:
+            for key, entry in entries.items():
+                self.set_entry(key, entry)
+            self.latest.update(latest)
+        return stored
+
+
+@dataclass
+class DownloadJob(object):
+    type: str = ""
+    name: str = ""
+    version: str = ""
+    output_dir: str = ""
+    install_msg: str = ""
+    attempts: int = 0
+    succeeded: bool = False
+
+    @property
+    def key(self):
+        return (self.type, self.name, self.output_dir)
+
+
+# progress of the download jobs shared by the worker threads
+@dataclass
+class DownloadProgress(object):
+    total: int = 0
+    done: int = 0
+    failed: int = 0
+    silent: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def update(self, job: DownloadJob):
+        with self.lock:
+            self.done += 1
+            if not job.succeeded:
+                self.failed += 1
+            status = "downloaded" if job.succeeded else "failed to download"
+            msg = "[{}/{}] {} {} {}".format(self.done, self.total, status, job.type, job.name)
+            if job.succeeded:
+                logging.debug(msg)
+            else:
+                logging.warning("{} after {} attempts".format(msg, job.attempts))
+            if not self.silent:
+                print(msg)
+
+
 @dataclass
 class DependencyDirPreparator(object):
     root_dir: str = ""
@@ -104,9 +325,37 @@ class DependencyDirPreparator(object):
     silent: bool = False
     do_save: bool = False
     tmp_install_dir: tempfile.TemporaryDirectory = None
+    download_workers: int = default_download_workers
+    download_retries: int = default_download_retries
+    retry_interval: float = 1.0
+    archive_index: ArchiveIndex = None
+    # if True, only the files loaded by ARI (yaml, json, python etc.) are extracted from collection tarballs
+    ansible_files_only: bool = False
+    # download jobs done by prefetch_dependencies(), keyed by (type, name, output_dir)
+    download_jobs: dict = field(default_factory=dict)
+    # if set, collections and roles are resolved from this local mirror instead of Galaxy
+    mirror_dir: str = ""
+    mirror: GalaxyMirror = None
+    # options of cloning a project; see utils.install_github_target()
+    clone_depth: int = default_clone_depth
+    sparse_checkout: bool = False
+    git_mirror_enabled: bool = False
+    # "hardlink", "reflink" or "copy"; see utils.place_tree()
+    placement_mode: str = default_placement_mode
+    # if True, the resolved dependencies are saved under root_dir and reused while the declarations are unchanged
+    dependency_cache_enabled: bool = False
+    # if set, the dependencies are found in this commit of the project instead of the working tree
+    git_commit: str = ""
 
     # -- out --
     dependency_dirs: list = field(default_factory=list)
+    # the git dir which has `git_commit` and the sha of it
+    git_commit_dir: str = ""
+    git_commit_sha: str = ""
+
+    def __post_init__(self):
+        if self.mirror_dir and self.mirror is None:
+            self.mirror = GalaxyMirror(mirror_dir=self.mirror_dir)
 
     def prepare_dir(self, root_install=True, is_src_installed=False, cache_enabled=False, cache_dir=""):
         logging.debug("setup base dirs")
@@ -114,11 +363,76 @@ class DependencyDirPreparator(object):
         logging.debug("prepare target dir")
         self.prepare_root_dir(root_install, is_src_installed)
         logging.debug("search dependencies")
-        dependencies = find_dependency(self.target_type, self.target_path, self.target_dependency_dir)
+        if self.git_commit:
+            self.git_commit_dir, self.git_commit_sha = resolve_git_commit(
+                self.target_path, self.git_commit, os.path.join(self.root_dir, git_commit_cache_dir)
+            )
+            with vfs.use_git_commit(self.git_commit_dir, self.git_commit_sha, self.target_path) as fs:
+                dependencies = find_dependency(self.target_type, self.target_path, self.target_dependency_dir)
+                self.metadata.version = fs.commit.hexsha
+                self.metadata.hash = fs.commit.tree.hexsha
+        else:
+            dependencies = find_dependency(self.target_type, self.target_path, self.target_dependency_dir)
+        fingerprint = ""
+        if self.dependency_cache_enabled:
+            fingerprint = self.get_dependency_fingerprint(dependencies, cache_enabled, cache_dir)
+            dependency_dirs = self.load_dependency_cache(fingerprint)
+            if dependency_dirs is not None:
+                logging.debug("use the cached dependency dirs {}".format(fingerprint))
+                self.dependency_dirs = dependency_dirs
+                return self.dependency_dirs
         logging.debug("prepare dir for dependencies")
         self.prepare_dependency_dir(dependencies, cache_enabled, cache_dir)
+        if fingerprint:
+            self.save_dependency_cache(fingerprint)
         return self.dependency_dirs
 
+    # the dependency resolution is reused while the dependency declarations
+    # (requirements.yml, meta/main.yml, MANIFEST.json etc.) and the source of the dependencies are the same
+    def get_dependency_fingerprint(self, dependencies, cache_enabled=False, cache_dir=""):
+        key = {
+            "type": dependencies.get("type", ""),
+            "dependencies": dependencies.get("dependencies", {}),
+            "paths": dependencies.get("paths", {}),
+            "metadata": dependencies.get("metadata", {}),
+            "source_repository": self.source_repository or "",
+            "mirror_dir": self.mirror_dir,
+            "dependency_dir_path": self.dependency_dir_path,
+            "cache_dir": cache_dir if cache_enabled else "",
+        }
+        return get_hash_of_data(key)
+
+    def dependency_cache_path(self, fingerprint):
+        return os.path.join(self.root_dir, dependency_cache_dir, "{}.json".format(fingerprint))
+
+    def load_dependency_cache(self, fingerprint):
+        cache_path = self.dependency_cache_path(fingerprint)
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            with open(cache_path, "r") as f:
+                dependency_dirs = json.load(f).get("dependency_dirs", [])
+        except Exception:
+            logging.warning("failed to load the dependency cache {}".format(cache_path))
+            return None
+        # the installed dirs may be removed after the cache is saved
+        for dep in dependency_dirs:
+            if not is_installed_dir(dep.get("dir", "")):
+                logging.debug("{} is not found; prepare the dependencies again".format(dep.get("dir", "")))
+                return None
+        return dependency_dirs
+
+    def save_dependency_cache(self, fingerprint):
+        # do not save the failed resolution so that it is retried in the next scan
+        if not all([is_installed_dir(dep.get("dir", "")) for dep in self.dependency_dirs]):
+            return
+        cache_path = self.dependency_cache_path(fingerprint)
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = "{}.tmp".format(cache_path)
+        with open(tmp_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "dependency_dirs": self.dependency_dirs}, f)
+        os.replace(tmp_path, cache_path)
+
     def setup_dirs(self, cache_enabled=False, cache_dir=""):
         self.download_location = os.path.join(self.root_dir, "archives")
         self.dependency_dir_path = self.root_dir
@@ -128,6 +442,8 @@ class DependencyDirPreparator(object):
         # check cache_dir
         if cache_enabled and not os.path.exists(cache_dir):
             os.makedirs(cache_dir)
+        if cache_enabled:
+            self.archive_index = ArchiveIndex(root_dir=cache_dir)
         # check dependency_dir_path
         if not os.path.exists(self.dependency_dir_path):
             os.makedirs(self.dependency_dir_path)
@@ -156,7 +472,7 @@ class DependencyDirPreparator(object):
                 hash = ""
                 download_url, version = get_installed_metadata(self.target_type, self.target_name, self.target_path, self.target_dependency_dir)
                 if download_url != "":
-                    hash = get_hash_of_url(download_url)
+                    hash = self.get_hash(download_url)
                 self.metadata.download_url = download_url
                 self.metadata.version = version
                 self.metadata.hash = hash
@@ -174,14 +490,10 @@ class DependencyDirPreparator(object):
 
         # TODO: if requirements.yml is provided, download dependencies using it.
 
+        self.prefetch_dependencies(col_dependencies, role_dependencies, col_dependency_dirs, role_dependency_dirs, cache_enabled, cache_dir)
+
         for cdep in col_dependencies:
-            col_name = cdep
-            col_version = ""
-            if type(cdep) is dict:
-                col_name = cdep.get("name", "")
-                col_version = cdep.get("version", "")
-                if col_name == "":
-                    col_name = cdep.get("source", "")
+            col_name, col_version = parse_collection_dependency(cdep)
 
             logging.debug("prepare dir for {}:{}".format(col_name, col_version))
             downloaded_dep = Dependency(
@@ -201,20 +513,23 @@ class DependencyDirPreparator(object):
 
             if cache_enabled:
                 logging.debug("cache enabled")
+                cache_location = os.path.join(cache_dir, "collection", col_name)
                 # TODO: handle version
-                is_exist, targz_file = self.is_download_file_exist(LoadType.COLLECTION, col_name, cache_dir)
+                targz_file = ""
+                md = None
+                if not self.is_prefetched(LoadType.COLLECTION, col_name, cache_location):
+                    md = self.find_cached_archive(LoadType.COLLECTION, col_name, col_version)
                 # check cache data
-                if is_exist:
+                if md is not None:
+                    targz_file = md.download_src_path
                     logging.debug("found cache data {}".format(targz_file))
-                    metadata_file = os.path.join(targz_file.rsplit("/", 1)[0], download_metadata_file)
-                    md = self.find_target_metadata(LoadType.COLLECTION, metadata_file, col_name)
                     downloaded_dep.metadata = md
                 else:
                     # if no cache data, download
                     logging.debug("cache data not found")
-                    cache_location = os.path.join(cache_dir, "collection", col_name)
-                    install_msg = self.download_galaxy_collection(col_name, cache_location, col_version, self.source_repository)
+                    install_msg = self.get_download_result(LoadType.COLLECTION, col_name, cache_location, col_version)
                     metadata = self.extract_collections_metadata(install_msg, cache_location)
+                    metadata = self.store_archives(metadata)
                     metadata_file = self.export_data(metadata, cache_location, download_metadata_file)
                     md = self.find_target_metadata(LoadType.COLLECTION, metadata_file, col_name)
                     downloaded_dep.metadata = md
@@ -233,7 +548,7 @@ class DependencyDirPreparator(object):
                     download_url = col_galaxy_data.get("download_url", "")
                     hash = ""
                     if download_url:
-                        hash = get_hash_of_url(download_url)
+                        hash = self.get_hash(download_url)
                     version = col_galaxy_data.get("version", "")
                     downloaded_dep.metadata.source_repository = self.source_repository
                     downloaded_dep.metadata.download_url = download_url
@@ -242,19 +557,19 @@ class DependencyDirPreparator(object):
                     downloaded_dep.dir = sub_dependency_dir_path
             else:
                 logging.debug("download dependency {}".format(col_name))
-                is_exist, targz = self.is_download_file_exist(
-                    LoadType.COLLECTION, col_name, os.path.join(self.download_location, "collection", col_name)
-                )
+                sub_download_location = os.path.join(self.download_location, "collection", col_name)
+                is_exist, targz = False, ""
+                if not self.is_prefetched(LoadType.COLLECTION, col_name, sub_download_location):
+                    is_exist, targz = self.is_download_file_exist(LoadType.COLLECTION, col_name, sub_download_location)
                 if is_exist:
                     metadata_file = os.path.join(self.download_location, "collection", self.target_name, download_metadata_file)
                     self.install_galaxy_collection_from_targz(targz, sub_dependency_dir_path)
                     md = self.find_target_metadata(LoadType.COLLECTION, metadata_file, col_name)
                 else:
                     # check download_location
-                    sub_download_location = os.path.join(self.download_location, "collection", col_name)
                     if not os.path.exists(sub_download_location):
                         os.makedirs(sub_download_location)
-                    install_msg = self.download_galaxy_collection(col_name, sub_download_location, col_version, self.source_repository)
+                    install_msg = self.get_download_result(LoadType.COLLECTION, col_name, sub_download_location, col_version)
                     metadata = self.extract_collections_metadata(install_msg, sub_download_location)
                     metadata_file = self.export_data(metadata, sub_download_location, download_metadata_file)
                     md = self.find_target_metadata(LoadType.COLLECTION, metadata_file, col_name)
@@ -269,16 +584,7 @@ class DependencyDirPreparator(object):
             self.dependency_dirs.append(asdict(downloaded_dep))
 
         for rdep in role_dependencies:
-            target_version = None
-            if isinstance(rdep, dict):
-                rdep_name = rdep.get("name", None)
-                target_version = rdep.get("version", None)
-                rdep = rdep_name
-            name = rdep
-            if type(rdep) is dict:
-                name = rdep.get("name", "")
-                if name == "":
-                    name = rdep.get("src", "")
+            name, target_version = parse_role_dependency(rdep)
             logging.debug("prepare dir for {}".format(name))
             downloaded_dep = Dependency(
                 name=name,
@@ -305,13 +611,14 @@ class DependencyDirPreparator(object):
                     "src",
                     name,
                 )
-                if os.path.exists(cache_dir_path) and len(os.listdir(cache_dir_path)) != 0:
+                is_prefetched = self.is_prefetched(LoadType.ROLE, name, cache_dir_path)
+                if not is_prefetched and os.path.exists(cache_dir_path) and len(os.listdir(cache_dir_path)) != 0:
                     logging.debug("cache data found")
                     metadata_file = os.path.join(cache_dir_path, download_metadata_file)
                     md = self.find_target_metadata(LoadType.ROLE, metadata_file, self.target_name)
                 else:
                     logging.debug("cache data not found")
-                    install_msg = install_galaxy_target(name, LoadType.ROLE, cache_dir_path, self.source_repository, target_version)
+                    install_msg = self.get_download_result(LoadType.ROLE, name, cache_dir_path, target_version)
                     logging.debug("role install msg: {}".format(install_msg))
                     metadata = self.extract_roles_metadata(install_msg)
                     metadata_file = self.export_data(metadata, cache_dir_path, download_metadata_file)
@@ -323,13 +630,15 @@ class DependencyDirPreparator(object):
                 logging.debug("use the specified dependency dirs")
                 sub_dependency_dir_path = role_dependency_dirs[name]
             else:
-                is_exist, _ = self.is_download_file_exist(LoadType.ROLE, name, os.path.join(self.download_location, "role", name))
+                is_exist = False
+                if not self.is_prefetched(LoadType.ROLE, name, sub_dependency_dir_path):
+                    is_exist, _ = self.is_download_file_exist(LoadType.ROLE, name, os.path.join(self.download_location, "role", name))
                 if is_exist:
                     metadata_file = os.path.join(self.download_location, "role", name, download_metadata_file)
                     md = self.find_target_metadata(LoadType.ROLE, metadata_file, name)
                     self.move_src(md.download_src_path, sub_dependency_dir_path)
                 else:
-                    install_msg = install_galaxy_target(name, LoadType.ROLE, sub_dependency_dir_path, self.source_repository)
+                    install_msg = self.get_download_result(LoadType.ROLE, name, sub_dependency_dir_path)
                     logging.debug("role install msg: {}".format(install_msg))
                     metadata = self.extract_roles_metadata(install_msg)
                     sub_download_location = os.path.join(self.download_location, "role", name)
@@ -342,6 +651,93 @@ class DependencyDirPreparator(object):
             self.dependency_dirs.append(asdict(downloaded_dep))
         return
 
+    # make the download jobs for the dependencies which are not found in the cache or the download location.
+    # the conditions here must be the same as the ones in prepare_dependency_dir()
+    def plan_downloads(self, col_dependencies, role_dependencies, col_dependency_dirs, role_dependency_dirs, cache_enabled=False, cache_dir=""):
+        jobs = {}
+        for cdep in col_dependencies:
+            col_name, col_version = parse_collection_dependency(cdep)
+            if cache_enabled:
+                is_exist = self.find_cached_archive(LoadType.COLLECTION, col_name, col_version) is not None
+                output_dir = os.path.join(cache_dir, "collection", col_name)
+            elif col_name in col_dependency_dirs:
+                continue
+            else:
+                output_dir = os.path.join(self.download_location, "collection", col_name)
+                is_exist, _ = self.is_download_file_exist(LoadType.COLLECTION, col_name, output_dir)
+            if is_exist:
+                continue
+            job = DownloadJob(type=LoadType.COLLECTION, name=col_name, version=col_version, output_dir=output_dir)
+            jobs[job.key] = job
+
+        for rdep in role_dependencies:
+            name, target_version = parse_role_dependency(rdep)
+            if cache_enabled:
+                output_dir = os.path.join(cache_dir, "roles", "src", name)
+                if os.path.exists(output_dir) and len(os.listdir(output_dir)) != 0:
+                    continue
+            elif name in role_dependency_dirs:
+                continue
+            else:
+                is_exist, _ = self.is_download_file_exist(LoadType.ROLE, name, os.path.join(self.download_location, "role", name))
+                if is_exist:
+                    continue
+                output_dir = os.path.join(self.dependency_dir_path, "roles", "src", name)
+                target_version = ""
+            job = DownloadJob(type=LoadType.ROLE, name=name, version=target_version or "", output_dir=output_dir)
+            jobs[job.key] = job
+        return list(jobs.values())
+
+    # download the dependencies with `download_workers` threads before installing them one by one.
+    # most of the time of a download is spent in an ansible-galaxy subprocess, so threads are enough here
+    def prefetch_dependencies(
+        self, col_dependencies, role_dependencies, col_dependency_dirs, role_dependency_dirs, cache_enabled=False, cache_dir=""
+    ):
+        jobs = self.plan_downloads(col_dependencies, role_dependencies, col_dependency_dirs, role_dependency_dirs, cache_enabled, cache_dir)
+        if len(jobs) == 0:
+            return jobs
+        progress = DownloadProgress(total=len(jobs), silent=self.silent)
+        workers = max(1, min(self.download_workers, len(jobs)))
+        logging.debug("download {} dependencies with {} workers".format(len(jobs), workers))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.run_download_job, job, progress) for job in jobs]
+            for future in futures:
+                job = future.result()
+                self.download_jobs[job.key] = job
+        return jobs
+
+    def is_prefetched(self, type, name, output_dir):
+        return (type, name, output_dir) in self.download_jobs
+
+    def get_download_result(self, type, name, output_dir, version=""):
+        job = self.download_jobs.get((type, name, output_dir), None)
+        if job is None:
+            job = self.run_download_job(DownloadJob(type=type, name=name, version=version or "", output_dir=output_dir))
+        return job.install_msg
+
+    def run_download_job(self, job: DownloadJob, progress: DownloadProgress = None):
+        if not os.path.exists(job.output_dir):
+            os.makedirs(job.output_dir, exist_ok=True)
+        for i in range(self.download_retries + 1):
+            job.attempts = i + 1
+            try:
+                if job.type == LoadType.COLLECTION:
+                    job.install_msg = self.download_galaxy_collection(job.name, job.output_dir, job.version, self.source_repository)
+                else:
+                    job.install_msg = self.download_galaxy_role(job.name, job.output_dir, job.version, self.source_repository)
+                job.succeeded = is_download_succeeded(job.type, job.install_msg)
+            except Exception:
+                logging.exception("failed to download {} {}".format(job.type, job.name))
+                job.succeeded = False
+            if job.succeeded:
+                break
+            if i < self.download_retries:
+                logging.debug("retry download {} {} ({}/{})".format(job.type, job.name, i + 1, self.download_retries))
+                time.sleep(self.retry_interval * (i + 1))
+        if progress is not None:
+            progress.update(job)
+        return job
+
     def src_install(self):
         try:
             self.setup_tmp_dir()
@@ -359,7 +755,8 @@ class DependencyDirPreparator(object):
             # ansible-galaxy install
             if not self.silent:
                 print("cloning {} from github".format(self.target_name))
-            install_msg = install_github_target(self.target_name, tmp_src_dir)
+            mirror_cache_dir = os.path.join(self.root_dir, git_mirror_cache_dir) if self.git_mirror_enabled else ""
+            install_msg = install_github_target(self.target_name, tmp_src_dir, self.clone_depth, self.sparse_checkout, mirror_cache_dir)
             if not self.silent:
                 logging.debug("STDOUT: {}".format(install_msg))
             # if self.target_dependency_dir == "":
@@ -379,9 +776,7 @@ class DependencyDirPreparator(object):
             self.metadata = md
         elif self.target_type == LoadType.ROLE:
             sub_download_location = os.path.join(self.download_location, "role", self.target_name)
-            install_msg = install_galaxy_target(
-                self.target_name, self.target_type, tmp_src_dir, self.source_repository, target_version=self.target_version
-            )
+            install_msg = self.download_galaxy_role(self.target_name, tmp_src_dir, self.target_version, self.source_repository)
             logging.debug("role install msg: {}".format(install_msg))
             metadata = self.extract_roles_metadata(install_msg)
             metadata_file = self.export_data(metadata, sub_download_location, download_metadata_file)
@@ -465,6 +860,8 @@ class DependencyDirPreparator(object):
         self.index = index_data
 
     def download_galaxy_collection(self, target, output_dir, version="", source_repository=""):
+        if self.mirror is not None:
+            return self.mirror.download_collection(target, output_dir, version)
         server_option = ""
         if source_repository:
             server_option = "--server {}".format(source_repository)
@@ -482,6 +879,11 @@ class DependencyDirPreparator(object):
         logging.debug("STDOUT: {}".format(install_msg))
         return install_msg
 
+    def download_galaxy_role(self, target, output_dir, version="", source_repository=""):
+        if self.mirror is not None:
+            return self.mirror.download_role(target, output_dir, version)
+        return install_galaxy_target(target, LoadType.ROLE, output_dir, source_repository, version)
+
     def download_galaxy_collection_from_reqfile(self, requirements, output_dir, source_repository=""):
         server_option = ""
         if source_repository:
@@ -499,20 +901,25 @@ class DependencyDirPreparator(object):
 
     def install_galaxy_collection_from_targz(self, tarfile, output_dir):
         logging.debug("install collection from {}".format(tarfile))
-        proc = subprocess.run(
-            "ansible-galaxy collection install {} -p {}".format(tarfile, output_dir),
-            shell=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-        )
-        install_msg = proc.stdout
-        logging.debug("STDOUT: {}".format(install_msg))
-        # return proc.stdout
+        extracted_cache_dir = ""
+        if self.download_location != "":
+            extracted_cache_dir = os.path.join(self.download_location, extracted_archive_dir)
+        try:
+            install_dir = install_collection_from_targz(tarfile, output_dir, extracted_cache_dir, self.ansible_files_only)
+            logging.debug("installed collection to {}".format(install_dir))
+        except Exception:
+            logging.exception("failed to install collection from {}".format(tarfile))
 
     def install_galaxy_collection_from_reqfile(self, requirements, output_dir):
         logging.debug("install collection from {}".format(requirements))
         src_dir = requirements.replace(requirements_yml, "")
+        if self.mirror is not None:
+            # the tarballs are already in src_dir, so install them without ansible-galaxy
+            with open(requirements, "r") as f:
+                reqs = yaml.safe_load(f) or {}
+            for req in reqs.get("collections", []):
+                self.install_galaxy_collection_from_targz(os.path.join(src_dir, req.get("name", "")), output_dir)
+            return
         proc = subprocess.run(
             "cd {} && ansible-galaxy collection install -r {} -p {}".format(src_dir, requirements, output_dir),
             shell=True,
@@ -524,6 +931,18 @@ class DependencyDirPreparator(object):
         logging.debug("STDOUT: {}".format(install_msg))
         # return proc.stdout
 
+    def find_cached_archive(self, type, name, version=""):
+        if self.archive_index is None:
+            return None
+        return self.archive_index.find(type, name, version)
+
+    def store_archives(self, metadata):
+        if self.archive_index is None:
+            return metadata
+        metadata_list = [DownloadMetadata(**d) for d in metadata.get("collections", [])]
+        metadata["collections"] = [asdict(md) for md in self.archive_index.add_all(metadata_list)]
+        return metadata
+
     def is_download_file_exist(self, type, target, dir):
         is_exist = False
         filename = ""
@@ -589,7 +1008,7 @@ class DependencyDirPreparator(object):
                 metadata.requirements_file = "{}/{}".format(download_location, requirements_yml)
 
                 if url != "":
-                    hash = get_hash_of_url(url)
+                    hash = self.get_hash(url, fullpath)
                     metadata.hash = hash
                 logging.debug("metadata: {}".format(json.dumps(asdict(metadata))))
 
@@ -622,13 +1041,42 @@ class DependencyDirPreparator(object):
                 metadata.download_timestamp = dt_m
                 metadata.download_src_path = role_dir
                 if url != "":
-                    hash = get_hash_of_url(url)
+                    # ansible-galaxy removes the role archive after extracting it, so only the mirror has a local copy
+                    hash = self.get_hash(url)
                     metadata.hash = hash
                 logging.debug("metadata: {}".format(json.dumps(asdict(metadata))))
                 metadata_list.append(asdict(metadata))
         result = {"roles": metadata_list}
         return result
 
+    def get_hash(self, url, local_path=""):
+        if not local_path:
+            local_path = self.find_local_artifact(url)
+        # never access the network in the offline mode
+        if self.mirror is not None and not os.path.isfile(local_path):
+            logging.warning("{} is not found in the mirror; skip hashing it".format(url))
+            return ""
+        return get_hash_of_artifact(url, local_path)
+
+    # returns the path to the artifact of the url in the mirror or the download location if exists
+    def find_local_artifact(self, url):
+        if self.mirror is not None:
+            mirrored = self.mirror.find_file_by_url(url)
+            if mirrored:
+                return mirrored
+        filename = url.rstrip("/").split("/")[-1]
+        if self.download_location == "" or not filename.endswith(".tar.gz"):
+            return ""
+        # the archives registered in the archive index are moved to its blob store
+        if self.archive_index is not None:
+            stored = self.archive_index.find_by_url(url)
+            if stored:
+                return stored
+        found = glob.glob(os.path.join(glob.escape(self.download_location), "collection", "*", glob.escape(filename)))
+        if len(found) == 0:
+            return ""
+        return found[0]
+
     def find_target_metadata(self, type, metadata_file, target):
         with open(metadata_file, "r") as f:
             metadata = json.load(f)
@@ -685,10 +1133,9 @@ class DependencyDirPreparator(object):
             raise ValueError("src {} is not directory".format(src))
         if dst == "" or ".." in dst:
             raise ValueError("dst {} is invalid".format(dst))
-        # we use cp command here because shutil module is slow,
-        # but the behavior of cp command is slightly different between Mac and Linux
-        # we use a command like `cp -r <src>/* <dst>/` so the behavior will be the same
-        os.system("cp -r {}/* {}/".format(src, dst))
+        # the files are hardlinked (or reflinked) instead of copied if possible, so that many role dependencies
+        # and concurrent scans can share the cached sources. the result is the same as `cp -r <src>/* <dst>/`
+        place_tree(src, dst, self.placement_mode, skip_hidden=True)
         return
 
     def setup_tmp_dir(self):
@@ -799,6 +1246,49 @@ class DependencyDirPreparator(object):
             return author
 
 
+def parse_collection_dependency(cdep):
+    col_name = cdep
+    col_version = ""
+    if type(cdep) is dict:
+        col_name = cdep.get("name", "")
+        col_version = cdep.get("version", "")
+        if col_name == "":
+            col_name = cdep.get("source", "")
+    return col_name, col_version
+
+
+def parse_role_dependency(rdep):
+    target_version = None
+    if isinstance(rdep, dict):
+        rdep_name = rdep.get("name", None)
+        target_version = rdep.get("version", None)
+        rdep = rdep_name
+    name = rdep
+    if type(rdep) is dict:
+        name = rdep.get("name", "")
+        if name == "":
+            name = rdep.get("src", "")
+    return name, target_version
+
+
+def make_archive_key(type, name, version=None):
+    if version is None:
+        return "{}:{}".format(type, name)
+    return "{}:{}:{}".format(type, name, version)
+
+
+def is_installed_dir(path):
+    return path != "" and os.path.isdir(path) and len(os.listdir(path)) != 0
+
+
+def is_download_succeeded(type, install_msg):
+    if not install_msg:
+        return False
+    if type == LoadType.COLLECTION:
+        return len(re.findall(collection_download_pattern, install_msg)) > 0
+    return any([p in install_msg for p in role_download_patterns])
+
+
 def find_ext_dependencies(path):
     collection_meta_files = safe_glob(os.path.join(path, "**", collection_manifest_json), recursive=True)
     if len(collection_meta_files) > 0:
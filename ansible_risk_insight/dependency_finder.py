@@ -20,6 +20,7 @@ import json
 import subprocess
 import logging
 from .safe_glob import safe_glob
+from . import vfs
 
 from .models import (
     LoadType,
@@ -69,7 +70,7 @@ def find_dependency(type, target, dependency_dir):
 
 def find_role_dependency(target):
     requirements = {}
-    if not os.path.exists(target):
+    if not vfs.exists(target):
         raise ValueError("Invalid target dir: {}".format(target))
     role_meta_files = safe_glob(
         [
@@ -81,9 +82,9 @@ def find_role_dependency(target):
     main_yaml = ""
     if len(role_meta_files) > 0:
         for rf in role_meta_files:
-            if os.path.exists(rf):
+            if vfs.exists(rf):
                 main_yaml = rf
-                with open(rf, "r") as file:
+                with vfs.open(rf, "r") as file:
                     try:
                         metadata = yaml.safe_load(file)
                     except Exception as e:
@@ -103,10 +104,10 @@ def find_collection_dependency(target):
     manifest_json = ""
     if len(manifest_json_files) > 0:
         for cmf in manifest_json_files:
-            if os.path.exists(cmf):
+            if vfs.exists(cmf):
                 manifest_json = cmf
                 metadata = {}
-                with open(cmf, "r") as file:
+                with vfs.open(cmf, "r") as file:
                     metadata = json.load(file)
                     dependencies = metadata.get("collection_info", {}).get("dependencies", [])
                     requirements["collections"] = format_dependency_info(dependencies)
@@ -116,7 +117,7 @@ def find_collection_dependency(target):
 
 
 def find_project_dependency(target):
-    if os.path.exists(target):
+    if vfs.exists(target):
         # local dir
         logging.debug("load requirements from dir {}".format(target))
         return load_requirements(target)
@@ -129,9 +130,9 @@ def load_requirements(path):
     yaml_path = ""
     # project dir
     requirements_yml_path = os.path.join(path, requirements_yml)
-    if os.path.exists(requirements_yml_path):
+    if vfs.exists(requirements_yml_path):
         yaml_path = requirements_yml_path
-        with open(requirements_yml_path, "r") as file:
+        with vfs.open(requirements_yml_path, "r") as file:
             try:
                 requirements = yaml.safe_load(file)
             except Exception as e:
@@ -149,10 +150,10 @@ def load_dependency_from_galaxy(path):
     logging.debug("found meta files {}".format(galaxy_yml_files))
     if len(galaxy_yml_files) > 0:
         for g in galaxy_yml_files:
-            if os.path.exists(g):
+            if vfs.exists(g):
                 yaml_path = g
                 metadata = {}
-                with open(g, "r") as file:
+                with vfs.open(g, "r") as file:
                     metadata = yaml.safe_load(file)
                     dependencies = metadata.get("dependencies", {})
                     requirements["collections"] = format_dependency_info(dependencies)
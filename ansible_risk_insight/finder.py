@@ -21,6 +21,7 @@ import os
 import yaml
 import logging
 from .safe_glob import safe_glob
+from . import vfs
 from .awx_utils import could_be_playbook, search_playbooks
 
 
@@ -86,9 +87,9 @@ def find_module_name(data_block):
 def get_task_blocks(fpath="", task_dict_list=None):
     d = None
     if fpath != "":
-        if not os.path.exists(fpath):
+        if not vfs.exists(fpath):
             return None
-        with open(fpath, "r") as file:
+        with vfs.open(fpath, "r") as file:
             try:
                 d = yaml.safe_load(file)
             except Exception as e:
@@ -143,7 +144,7 @@ def search_module_files(path, module_dir_paths=[]):
     for module_dir_pattern in module_dir_patterns:
         search_targets.append(os.path.join(path, module_dir_pattern))
     for search_target in search_targets:
-        for dirpath, folders, files in os.walk(search_target):
+        for dirpath, folders, files in vfs.walk(search_target):
             for file in files:
                 basename, ext = os.path.splitext(file)
                 if basename == "__init__":
@@ -157,7 +158,7 @@ def find_module_dirs(role_root_dir):
     module_dirs = []
     for module_dir_pattern in module_dir_patterns:
         moddir = os.path.join(role_root_dir, module_dir_pattern)
-        if os.path.exists(moddir):
+        if vfs.exists(moddir):
             module_dirs.append(moddir)
     return module_dirs
 
@@ -179,7 +180,7 @@ def search_taskfiles_for_playbooks(path, taskfile_dir_paths=[]):
             if could_be_playbook(f):
                 continue
             d = None
-            with open(f, "r") as file:
+            with vfs.open(f, "r") as file:
                 try:
                     d = yaml.safe_load(file)
                 except Exception as e:
@@ -243,7 +244,7 @@ def find_collection_name_of_repo(path):
     if len(found_galaxy_ymls) > 0:
         galaxy_yml = found_galaxy_ymls[0]
         my_collection_info = None
-        with open(galaxy_yml, "r") as file:
+        with vfs.open(galaxy_yml, "r") as file:
             try:
                 my_collection_info = yaml.safe_load(file)
             except Exception as e:
@@ -15,7 +15,6 @@
 # limitations under the License.
 
 from dataclasses import dataclass, field
-import jsonpickle
 
 
 @dataclass
@@ -40,6 +39,8 @@ class Findings:
         return d
 
     def dump(self, fpath=""):
+        import jsonpickle
+
         json_str = jsonpickle.encode(self, make_refs=False)
         if fpath:
             with open(fpath, "w") as file:
@@ -51,5 +52,7 @@ class Findings:
         if fpath:
             with open(fpath, "r") as file:
                 json_str = file.read()
+        import jsonpickle
+
         findings = jsonpickle.decode(json_str)
         return findings
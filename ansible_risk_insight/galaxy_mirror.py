@@ -0,0 +1,245 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import shutil
+import tarfile
+import tempfile
+import logging
+import yaml
+from dataclasses import dataclass, field
+
+from .models import LoadType
+from .utils import version_to_num, safe_extract_tar
+
+mirror_index_file = "index.json"
+mirror_collection_dir = "collections"
+mirror_role_dir = "roles"
+galaxy_download_url_prefix = "https://galaxy.ansible.com/download/"
+
+version_operators = [">=", "<=", "!=", "==", ">", "<", "="]
+
+
+def match_version(version: str, spec: str):
+    if spec is None or spec in ["", "*"]:
+        return True
+    ver_num = version_to_num(version)
+    for clause in str(spec).split(","):
+        clause = clause.strip()
+        op = "=="
+        for _op in version_operators:
+            if clause.startswith(_op):
+                op = _op
+                clause = clause[len(_op) :].strip()
+                break
+        if clause == "*":
+            continue
+        target = version_to_num(clause)
+        if op in ["==", "="] and version != clause and ver_num != target:
+            return False
+        if op == "!=" and (version == clause or ver_num == target):
+            return False
+        if op == ">=" and ver_num < target:
+            return False
+        if op == "<=" and ver_num > target:
+            return False
+        if op == ">" and ver_num <= target:
+            return False
+        if op == "<" and ver_num >= target:
+            return False
+    return True
+
+
+# a local stand-in of Galaxy for offline scans.
+# the mirror dir has collection tarballs like "collections/<ns>-<name>-<version>.tar.gz" and role tarballs
+# like "roles/<role name>/<version>.tar.gz", and optionally "index.json" like below. if it is not found, the tarballs are scanned to make it.
+#   {
+#     "collections": {"<ns>.<name>": {"<version>": {"file": "collections/<ns>-<name>-<version>.tar.gz",
+#                                                   "download_url": "...", "dependencies": {"<ns>.<name>": "<spec>"}}}},
+#     "roles": {"<role name>": {"<version>": {"file": "roles/<role name>/<version>.tar.gz", "download_url": "..."}}}
+#   }
+# download_collection() and download_role() write the same files and log messages as ansible-galaxy,
+# so that the metadata of the downloaded content is the same as the online one
+@dataclass
+class GalaxyMirror(object):
+    mirror_dir: str = ""
+    index: dict = field(default_factory=dict)
+
+    def __post_init__(self):
+        if not os.path.isdir(self.mirror_dir):
+            raise ValueError("mirror dir {} is not found".format(self.mirror_dir))
+        index_path = os.path.join(self.mirror_dir, mirror_index_file)
+        if os.path.exists(index_path):
+            with open(index_path, "r") as f:
+                self.index = json.load(f)
+        else:
+            self.index = self.make_index()
+
+    def make_index(self):
+        index = {"collections": {}, "roles": {}}
+        col_dir = os.path.join(self.mirror_dir, mirror_collection_dir)
+        if os.path.isdir(col_dir):
+            for filename in sorted(os.listdir(col_dir)):
+                if not filename.endswith(".tar.gz"):
+                    continue
+                try:
+                    with tarfile.open(name=os.path.join(col_dir, filename), mode="r") as tar:
+                        manifest = json.load(tar.extractfile("MANIFEST.json"))
+                except Exception:
+                    logging.warning("failed to read MANIFEST.json in {}".format(filename))
+                    continue
+                info = manifest.get("collection_info", {})
+                name = "{}.{}".format(info.get("namespace", ""), info.get("name", ""))
+                index["collections"].setdefault(name, {})[info.get("version", "")] = {
+                    "file": os.path.join(mirror_collection_dir, filename),
+                    "download_url": galaxy_download_url_prefix + filename,
+                    "dependencies": info.get("dependencies", {}) or {},
+                }
+        role_dir = os.path.join(self.mirror_dir, mirror_role_dir)
+        if os.path.isdir(role_dir):
+            for name in sorted(os.listdir(role_dir)):
+                if not os.path.isdir(os.path.join(role_dir, name)):
+                    continue
+                for filename in sorted(os.listdir(os.path.join(role_dir, name))):
+                    if not filename.endswith(".tar.gz"):
+                        continue
+                    version = filename[: -len(".tar.gz")]
+                    # the file name is "<version>.tar.gz" like GitHub archives, so the version can be read from the url
+                    index["roles"].setdefault(name, {})[version] = {
+                        "file": os.path.join(mirror_role_dir, name, filename),
+                        "download_url": "file://{}".format(os.path.abspath(os.path.join(role_dir, name, filename))),
+                    }
+        return index
+
+    # returns (version, entry) of the latest version which matches the spec
+    def find(self, type, name, spec=""):
+        type_key = "collections" if type == LoadType.COLLECTION else "roles"
+        versions = self.index.get(type_key, {}).get(name, {})
+        candidates = [v for v in versions if match_version(v, spec)]
+        if len(candidates) == 0:
+            return "", None
+        version = sorted(candidates, key=version_to_num)[-1]
+        return version, versions[version]
+
+    # returns the path of the mirrored file for the download url
+    def find_file_by_url(self, url):
+        for type_key in ["collections", "roles"]:
+            for versions in self.index.get(type_key, {}).values():
+                for entry in versions.values():
+                    if entry.get("download_url", "") == url:
+                        return os.path.join(self.mirror_dir, entry["file"])
+        return ""
+
+    # resolve the collection and its dependencies and put the tarballs to output_dir
+    # like `ansible-galaxy collection download`, then return the log message
+    def download_collection(self, name, output_dir, version=""):
+        os.makedirs(output_dir, exist_ok=True)
+        resolved = {}
+        queue = [(name, version)]
+        while len(queue) > 0:
+            _name, _spec = queue.pop(0)
+            if _name in resolved:
+                continue
+            _version, entry = self.find(LoadType.COLLECTION, _name, _spec)
+            if entry is None:
+                logging.warning("{}:{} is not found in the mirror {}".format(_name, _spec, self.mirror_dir))
+                continue
+            resolved[_name] = (_version, entry)
+            for dep_name, dep_spec in entry.get("dependencies", {}).items():
+                queue.append((dep_name, dep_spec))
+
+        lines = []
+        requirements = []
+        for _name, (_version, entry) in resolved.items():
+            filename = entry["download_url"].split("/")[-1]
+            dst = os.path.join(output_dir, filename)
+            if not os.path.exists(dst):
+                shutil.copy2(os.path.join(self.mirror_dir, entry["file"]), dst)
+            lines.append("Downloading collection '{}:{}' to '{}'".format(_name, _version, dst))
+            lines.append("Downloading {} to {}".format(entry["download_url"], output_dir))
+            requirements.append({"name": filename, "version": _version})
+        with open(os.path.join(output_dir, "requirements.yml"), "w") as f:
+            yaml.safe_dump({"collections": requirements}, f)
+        return "\n".join(lines) + "\n"
+
+    # extract the role and its dependencies into output_dir like `ansible-galaxy role install`,
+    # then return the log message
+    def download_role(self, name, output_dir, version=""):
+        lines = []
+        installed = set()
+        queue = [(name, version)]
+        while len(queue) > 0:
+            _name, _version = queue.pop(0)
+            if _name in installed:
+                continue
+            installed.add(_name)
+            _version, entry = self.find(LoadType.ROLE, _name, _version or "")
+            if entry is None:
+                lines.append("- {} was NOT installed successfully: not found in the mirror".format(_name))
+                continue
+            role_dir = os.path.join(output_dir, _name)
+            if os.path.exists(role_dir):
+                lines.append("- {} ({}) is already installed, skipping.".format(_name, _version))
+            else:
+                extract_role_archive(os.path.join(self.mirror_dir, entry["file"]), role_dir)
+                lines.append("- downloading role from {}".format(entry["download_url"]))
+                lines.append("- extracting {} to {}".format(_name, role_dir))
+                lines.append("- {} ({}) was installed successfully".format(_name, _version))
+            for dep in get_role_dependencies(role_dir):
+                queue.append(dep)
+        return "\n".join(lines) + "\n"
+
+
+# role archives (e.g. GitHub archives) usually have a top directory like "<repo>-<version>/"
+def extract_role_archive(archive_path, role_dir):
+    parent_dir = os.path.dirname(role_dir)
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir)
+    try:
+        safe_extract_tar(archive_path, tmp_dir)
+        entries = os.listdir(tmp_dir)
+        src_dir = tmp_dir
+        if len(entries) == 1 and os.path.isdir(os.path.join(tmp_dir, entries[0])):
+            src_dir = os.path.join(tmp_dir, entries[0])
+        os.replace(src_dir, role_dir)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def get_role_dependencies(role_dir):
+    dependencies = []
+    for meta_file in ["meta/main.yml", "meta/main.yaml"]:
+        meta_path = os.path.join(role_dir, meta_file)
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            with open(meta_path, "r") as f:
+                meta = yaml.safe_load(f)
+        except Exception:
+            logging.warning("failed to load {}".format(meta_path))
+            return dependencies
+        if not isinstance(meta, dict):
+            return dependencies
+        for dep in meta.get("dependencies", []) or []:
+            if isinstance(dep, str):
+                dependencies.append((dep, ""))
+            elif isinstance(dep, dict):
+                dep_name = dep.get("role", dep.get("name", dep.get("src", "")))
+                if dep_name:
+                    dependencies.append((dep_name, dep.get("version", "")))
+        break
+    return dependencies
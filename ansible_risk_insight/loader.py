@@ -17,8 +17,7 @@
 import os
 import pathlib
 import json
-import git
-import pkg_resources
+import functools
 from .models import LoadType
 
 collection_manifest_json = "MANIFEST.json"
@@ -48,17 +47,21 @@ def trim_suffix(txt, suffix_patterns=[]):
     return txt
 
 
+# the version does not change in a process, so it is computed only once
+@functools.lru_cache(maxsize=None)
 def get_loader_version():
     version = ""
     # try to get version from the installed executable
     try:
-        version = pkg_resources.require("ansible-risk-insight")[0].version
+        version = _get_installed_version("ansible-risk-insight")
     except Exception:
         pass
     if version != "":
         return version
     # try to get version from commit ID in source code repository
     try:
+        import git
+
         script_dir = pathlib.Path(__file__).parent.resolve()
         repo = git.Repo(path=script_dir, search_parent_directories=True)
         sha = repo.head.object.hexsha
@@ -68,6 +71,17 @@ def get_loader_version():
     return version
 
 
+# importlib.metadata is much faster to import than pkg_resources, but it is not available in python 3.7
+def _get_installed_version(dist_name):
+    try:
+        from importlib.metadata import version
+    except ImportError:
+        import pkg_resources
+
+        return pkg_resources.require(dist_name)[0].version
+    return version(dist_name)
+
+
 def get_target_name(target_type, target_path):
     target_name = ""
     if target_type == LoadType.PROJECT:
@@ -14,13 +14,16 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import datetime
 import json
 import logging
 import os
 import re
+import threading
 import yaml
 from .safe_glob import safe_glob
+from . import vfs
 from .models import (
     ExecutableType,
     Inventory,
@@ -57,6 +60,12 @@ collection_info_dir_re = re.compile(r"^[a-z0-9_]+\.[a-z0-9_]+-[0-9]+\.[0-9]+\.[0
 
 string_module_options_re = re.compile(r"[a-z0-9]+=(?:[^ ]*{{ [^ ]+ }}[^ ]*|[^ ])+")
 
+# the objects loaded from a mounted git commit are cached by the git object id of the role dir or the playbook file,
+# so that an unchanged role or playbook is loaded only once while scanning many commits of a repository
+git_object_cache_size = 1024
+_git_object_cache = {}
+_git_object_cache_lock = threading.Lock()
+
 loop_task_option_names = [
     "loop",
     "with_list",
@@ -151,19 +160,19 @@ def load_repository(
 
 def load_installed_collections(installed_collections_path):
     search_path = installed_collections_path
-    if installed_collections_path == "" or not os.path.exists(search_path):
+    if installed_collections_path == "" or not vfs.exists(search_path):
         return []
-    if os.path.exists(os.path.join(search_path, "ansible_collections")):
+    if vfs.exists(os.path.join(search_path, "ansible_collections")):
         search_path = os.path.join(search_path, "ansible_collections")
-    dirs = os.listdir(search_path)
+    dirs = vfs.listdir(search_path)
     basedir = os.path.dirname(os.path.normpath(installed_collections_path))
     collections = []
     for d in dirs:
         if collection_info_dir_re.match(d):
             continue
-        if not os.path.exists(os.path.join(search_path, d)):
+        if not vfs.exists(os.path.join(search_path, d)):
             continue
-        subdirs = os.listdir(os.path.join(search_path, d))
+        subdirs = vfs.listdir(os.path.join(search_path, d))
         for sd in subdirs:
             collection_path = os.path.join(search_path, d, sd)
             try:
@@ -177,9 +186,9 @@ def load_installed_collections(installed_collections_path):
 def load_inventory(path, basedir=""):
     invObj = Inventory()
     fullpath = ""
-    if os.path.exists(path) and path != "" and path != ".":
+    if vfs.exists(path) and path != "" and path != ".":
         fullpath = path
-    if os.path.exists(os.path.join(basedir, path)):
+    if vfs.exists(os.path.join(basedir, path)):
         fullpath = os.path.normpath(os.path.join(basedir, path))
     if fullpath == "":
         raise ValueError("file not found")
@@ -211,13 +220,13 @@ def load_inventory(path, basedir=""):
         # TODO: parse it as INI file
         pass
     elif file_ext == ".yml" or file_ext == ".yaml":
-        with open(fullpath, "r") as file:
+        with vfs.open(fullpath, "r") as file:
             try:
                 data = yaml.safe_load(file)
             except Exception as e:
                 logging.error("failed to load this yaml file (inventory); {}".format(e.args[0]))
     elif file_ext == ".json":
-        with open(fullpath, "r") as file:
+        with vfs.open(fullpath, "r") as file:
             try:
                 data = json.load(file)
             except Exception as e:
@@ -228,7 +237,7 @@ def load_inventory(path, basedir=""):
 
 def load_inventories(path, basedir=""):
 
-    if not os.path.exists(path):
+    if not vfs.exists(path):
         return []
     inventories = []
     inventory_file_paths = search_inventory_files(path)
@@ -454,9 +463,9 @@ def load_roleinplay(
 def load_playbook(path, role_name="", collection_name="", basedir=""):
     pbObj = Playbook()
     fullpath = ""
-    if os.path.exists(path) and path != "" and path != ".":
+    if vfs.exists(path) and path != "" and path != ".":
         fullpath = path
-    if os.path.exists(os.path.join(basedir, path)):
+    if vfs.exists(os.path.join(basedir, path)):
         fullpath = os.path.normpath(os.path.join(basedir, path))
     if fullpath == "":
         raise ValueError("file not found")
@@ -473,7 +482,7 @@ def load_playbook(path, role_name="", collection_name="", basedir=""):
     pbObj.set_key()
     data = None
     if fullpath != "":
-        with open(fullpath, "r") as file:
+        with vfs.open(fullpath, "r") as file:
             try:
                 data = yaml.safe_load(file)
             except Exception as e:
@@ -525,7 +534,7 @@ def load_playbooks(path, basedir="", load_children=True):
                 continue
             p = None
             try:
-                p = load_playbook(fpath, basedir=basedir)
+                p = load_with_git_object_cache(load_playbook, fpath, basedir=basedir)
             except PlaybookFormatError as e:
                 logging.debug("this file is not in a playbook format, maybe not a" " playbook file: {}".format(e.args[0]))
                 continue
@@ -552,9 +561,9 @@ def load_role(
 ):
     roleObj = Role()
     fullpath = ""
-    if os.path.exists(path) and path != "" and path != ".":
+    if vfs.exists(path) and path != "" and path != ".":
         fullpath = path
-    if os.path.exists(os.path.join(basedir, path)):
+    if vfs.exists(os.path.join(basedir, path)):
         fullpath = os.path.normpath(os.path.join(basedir, path))
     if fullpath == "":
         raise ValueError(f"directory not found: {path}")
@@ -571,8 +580,8 @@ def load_role(
         tasks_dir_path = os.path.join(fullpath, "tasks")
         handlers_dir_path = os.path.join(fullpath, "handlers")
         includes_dir_path = os.path.join(fullpath, "includes")
-    if os.path.exists(meta_file_path):
-        with open(meta_file_path, "r") as file:
+    if vfs.exists(meta_file_path):
+        with vfs.open(meta_file_path, "r") as file:
             try:
                 roleObj.metadata = yaml.safe_load(file)
             except Exception as e:
@@ -583,8 +592,8 @@ def load_role(
                 roleObj.dependency["collections"] = roleObj.metadata.get("collections", [])
 
     requirements_yml_path = os.path.join(fullpath, "requirements.yml")
-    if os.path.exists(requirements_yml_path):
-        with open(requirements_yml_path, "r") as file:
+    if vfs.exists(requirements_yml_path):
+        with vfs.open(requirements_yml_path, "r") as file:
             try:
                 roleObj.requirements = yaml.safe_load(file)
             except Exception as e:
@@ -611,7 +620,7 @@ def load_role(
     roleObj.fqcn = fqcn
     roleObj.set_key()
 
-    if os.path.exists(os.path.join(fullpath, "playbooks")):
+    if vfs.exists(os.path.join(fullpath, "playbooks")):
         playbook_files = safe_glob(fullpath + "/playbooks/**/*.yml", recursive=True)
         playbooks = []
         for f in playbook_files:
@@ -636,7 +645,7 @@ def load_role(
             playbooks = sorted(playbooks)
         roleObj.playbooks = playbooks
 
-    if os.path.exists(defaults_dir_path):
+    if vfs.exists(defaults_dir_path):
         patterns = [
             defaults_dir_path + "/**/*.yml",
             defaults_dir_path + "/**/*.yaml",
@@ -644,7 +653,7 @@ def load_role(
         defaults_yaml_files = safe_glob(patterns, recursive=True)
         default_variables = {}
         for fpath in defaults_yaml_files:
-            with open(fpath, "r") as file:
+            with vfs.open(fpath, "r") as file:
                 try:
                     vars_in_yaml = yaml.safe_load(file)
                     if vars_in_yaml is None:
@@ -656,12 +665,12 @@ def load_role(
                     logging.error("failed to load this yaml file to raed default" " variables; {}".format(e.args[0]))
         roleObj.default_variables = default_variables
 
-    if os.path.exists(vars_dir_path):
+    if vfs.exists(vars_dir_path):
         patterns = [vars_dir_path + "/**/*.yml", vars_dir_path + "/**/*.yaml"]
         vars_yaml_files = safe_glob(patterns, recursive=True)
         variables = {}
         for fpath in vars_yaml_files:
-            with open(fpath, "r") as file:
+            with vfs.open(fpath, "r") as file:
                 try:
                     vars_in_yaml = yaml.safe_load(file)
                     if vars_in_yaml is None:
@@ -696,14 +705,14 @@ def load_role(
 
     patterns = [tasks_dir_path + "/**/*.yml", tasks_dir_path + "/**/*.yaml"]
     # ansible.network collection has this type of another taskfile directory
-    if os.path.exists(includes_dir_path):
+    if vfs.exists(includes_dir_path):
         patterns.extend(
             [
                 includes_dir_path + "/**/*.yml",
                 includes_dir_path + "/**/*.yaml",
             ]
         )
-    if os.path.exists(handlers_dir_path):
+    if vfs.exists(handlers_dir_path):
         patterns.extend(
             [
                 handlers_dir_path + "/**/*.yml",
@@ -734,24 +743,26 @@ def load_role(
     return roleObj
 
 
-def load_roles(path, basedir="", load_children=True):
+def find_role_dirs(path):
     if path == "":
         return []
     roles_patterns = ["roles", "playbooks/roles", "playbook/roles"]
     roles_dir_path = ""
     for r_p in roles_patterns:
         candidate = os.path.join(path, r_p)
-        if os.path.exists(candidate):
+        if vfs.exists(candidate):
             roles_dir_path = candidate
             break
     if roles_dir_path == "":
         return []
-    dirs = os.listdir(roles_dir_path)
+    return [os.path.join(roles_dir_path, dir_name) for dir_name in vfs.listdir(roles_dir_path)]
+
+
+def load_roles(path, basedir="", load_children=True):
     roles = []
-    for dir_name in dirs:
-        role_dir = os.path.join(roles_dir_path, dir_name)
+    for role_dir in find_role_dirs(path):
         try:
-            r = load_role(role_dir, basedir=basedir)
+            r = load_with_git_object_cache(load_role, role_dir, basedir=basedir)
         except Exception:
             logging.exception("error while loading the role at {}".format(role_dir))
         if load_children:
@@ -766,8 +777,8 @@ def load_roles(path, basedir="", load_children=True):
 def load_requirements(path):
     requirements = {}
     requirements_yml_path = os.path.join(path, "requirements.yml")
-    if os.path.exists(requirements_yml_path):
-        with open(requirements_yml_path, "r") as file:
+    if vfs.exists(requirements_yml_path):
+        with vfs.open(requirements_yml_path, "r") as file:
             try:
                 requirements = yaml.safe_load(file)
             except Exception as e:
@@ -777,9 +788,9 @@ def load_requirements(path):
 
 def load_installed_roles(installed_roles_path):
     search_path = installed_roles_path
-    if installed_roles_path == "" or not os.path.exists(search_path):
+    if installed_roles_path == "" or not vfs.exists(search_path):
         return []
-    dirs = os.listdir(search_path)
+    dirs = vfs.listdir(search_path)
     roles = []
     basedir = os.path.dirname(os.path.normpath(installed_roles_path))
     for d in dirs:
@@ -851,7 +862,7 @@ def load_module(module_file_path, collection_name="", role_name="", basedir=""):
 def load_modules(path, basedir="", collection_name="", load_children=True):
     if path == "":
         return []
-    if not os.path.exists(path):
+    if not vfs.exists(path):
         return []
     module_files = search_module_files(path)
 
@@ -892,9 +903,9 @@ def load_task(
 
     taskObj = Task()
     fullpath = ""
-    if os.path.exists(path) and path != "" and path != ".":
+    if vfs.exists(path) and path != "" and path != ".":
         fullpath = path
-    if os.path.exists(os.path.join(basedir, path)):
+    if vfs.exists(os.path.join(basedir, path)):
         fullpath = os.path.normpath(os.path.join(basedir, path))
     if fullpath == "":
         raise ValueError("file not found")
@@ -1027,9 +1038,9 @@ def load_taskfile(path, role_name="", collection_name="", basedir=""):
     tfObj = TaskFile()
 
     fullpath = ""
-    if os.path.exists(path) and path != "" and path != ".":
+    if vfs.exists(path) and path != "" and path != ".":
         fullpath = path
-    if os.path.exists(os.path.join(basedir, path)):
+    if vfs.exists(os.path.join(basedir, path)):
         fullpath = os.path.normpath(os.path.join(basedir, path))
     if fullpath == "":
         raise ValueError("file not found")
@@ -1079,7 +1090,7 @@ def load_taskfile(path, role_name="", collection_name="", basedir=""):
 # playbooks possibly include/import task files around the playbook file
 # we search this type of isolated taskfile in `playbooks` and `tasks` dir
 def load_taskfiles(path, basedir="", load_children=True):
-    if not os.path.exists(path):
+    if not vfs.exists(path):
         return []
 
     taskfile_paths = search_taskfiles_for_playbooks(path)
@@ -1104,9 +1115,9 @@ def load_taskfiles(path, basedir="", load_children=True):
 def load_collection(collection_dir, basedir="", load_children=True):
     colObj = Collection()
     fullpath = ""
-    if os.path.exists(collection_dir):
+    if vfs.exists(collection_dir):
         fullpath = collection_dir
-    if os.path.exists(os.path.join(basedir, collection_dir)):
+    if vfs.exists(os.path.join(basedir, collection_dir)):
         fullpath = os.path.join(basedir, collection_dir)
     if fullpath == "":
         raise ValueError("directory not found")
@@ -1116,21 +1127,21 @@ def load_collection(collection_dir, basedir="", load_children=True):
     collection_name = "{}.{}".format(parts[-2], parts[-1])
 
     manifest_file_path = os.path.join(fullpath, "MANIFEST.json")
-    if os.path.exists(manifest_file_path):
-        with open(manifest_file_path, "r") as file:
+    if vfs.exists(manifest_file_path):
+        with vfs.open(manifest_file_path, "r") as file:
             colObj.metadata = json.load(file)
 
         if colObj.metadata is not None and isinstance(colObj.metadata, dict):
             colObj.dependency["collections"] = colObj.metadata.get("dependencies", {})
 
     files_file_path = os.path.join(fullpath, "FILES.json")
-    if os.path.exists(files_file_path):
-        with open(files_file_path, "r") as file:
+    if vfs.exists(files_file_path):
+        with vfs.open(files_file_path, "r") as file:
             colObj.files = json.load(file)
 
     requirements_yml_path = os.path.join(fullpath, "requirements.yml")
-    if os.path.exists(requirements_yml_path):
-        with open(requirements_yml_path, "r") as file:
+    if vfs.exists(requirements_yml_path):
+        with vfs.open(requirements_yml_path, "r") as file:
             try:
                 colObj.requirements = yaml.safe_load(file)
             except Exception as e:
@@ -1206,6 +1217,55 @@ def load_collection(collection_dir, basedir="", load_children=True):
     return colObj
 
 
+archive_mount_root = "/ari-archive"
+
+
+# load a collection from the tar.gz without extracting it. the archive is mounted on
+# <archive_mount_root>/<archive filename>/ansible_collections/<namespace>/<name>
+def load_collection_from_archive(archive_path, load_children=True):
+    archive_root = os.path.join(archive_mount_root, os.path.basename(archive_path))
+    fs = vfs.ArchiveFS(archive_path, archive_root)
+    try:
+        with fs.open(os.path.join(archive_root, "MANIFEST.json"), "r") as file:
+            manifest = json.load(file)
+    except Exception:
+        fs.close()
+        raise ValueError("MANIFEST.json is not found in {}".format(archive_path))
+    collection_info = manifest.get("collection_info", {})
+    collection_dir = os.path.join(archive_root, "ansible_collections", collection_info.get("namespace", ""), collection_info.get("name", ""))
+    fs.mount_point = collection_dir
+    with vfs.mount(fs):
+        return load_collection(collection_dir=collection_dir, basedir=collection_dir, load_children=load_children)
+
+
+git_mount_root = "/ari-git"
+
+
+# load a project at the commit from the git object database without checkout. the commit is mounted on
+# <git_mount_root>/<repository dir name>, which is the same for all the commits of the repository
+def load_repository_from_commit(repo_path, commit="HEAD", load_children=True):
+    mount_point = os.path.join(git_mount_root, os.path.basename(os.path.abspath(repo_path)))
+    with vfs.use_git_commit(repo_path, commit, mount_point):
+        return load_repository(path=mount_point, basedir=mount_point, load_children=load_children)
+
+
+def load_with_git_object_cache(loader, path, **kwargs):
+    object_hash = vfs.object_hash(path)
+    if object_hash == "":
+        return loader(path, **kwargs)
+    key = (loader.__name__, object_hash, os.path.normpath(path), json.dumps(kwargs, sort_keys=True))
+    with _git_object_cache_lock:
+        obj = _git_object_cache.get(key, None)
+    if obj is None:
+        obj = loader(path, **kwargs)
+        with _git_object_cache_lock:
+            _git_object_cache[key] = obj
+            while len(_git_object_cache) > git_object_cache_size:
+                _git_object_cache.pop(next(iter(_git_object_cache)))
+    # the loaded objects may be updated by the caller
+    return copy.deepcopy(obj)
+
+
 def load_object(loadObj):
     target_type = loadObj.target_type
     path = loadObj.path
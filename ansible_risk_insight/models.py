@@ -19,8 +19,9 @@ from typing import List
 
 # from copy import deepcopy
 import json
-import jsonpickle
 import logging
+import weakref
+from . import vfs
 from .keyutil import (
     set_collection_key,
     set_module_key,
@@ -52,10 +53,15 @@ class JSONSerializable(object):
     def dump(self):
         return self.to_json()
 
+    # jsonpickle is imported on use because it is slow to import and not needed by every command
     def to_json(self):
+        import jsonpickle
+
         return jsonpickle.encode(self, make_refs=False)
 
     def from_json(self, json_str):
+        import jsonpickle
+
         loaded = jsonpickle.decode(json_str)
         self.__dict__.update(loaded.__dict__)
 
@@ -127,6 +133,8 @@ class ObjectList(JSONSerializable):
         return self.to_json(fpath=fpath)
 
     def to_json(self, fpath=""):
+        import jsonpickle
+
         lines = [jsonpickle.encode(obj, make_refs=False) for obj in self.items]
         json_str = "\n".join(lines)
         if fpath != "":
@@ -134,9 +142,13 @@ class ObjectList(JSONSerializable):
         return json_str
 
     def to_one_line_json(self):
+        import jsonpickle
+
         return jsonpickle.encode(self.items, make_refs=False)
 
     def from_json(self, json_str="", fpath=""):
+        import jsonpickle
+
         if fpath != "":
             json_str = open(fpath, "r").read()
         lines = json_str.splitlines()
@@ -313,6 +325,8 @@ class VariableAnnotation(Annotation):
     resolved_module_options: dict = field(default_factory=dict)
     resolved_variables: list = field(default_factory=list)
     mutable_vars_per_mo: dict = field(default_factory=dict)
+    # e.g. {"total": 1000, "deduplicated": 10, "truncated": 890} for a loop task
+    loop_summary: dict = field(default_factory=dict)
 
 
 @dataclass
@@ -363,7 +377,8 @@ class Task(Object, Resolvable):
         elif task_name == "" and module_options is None:
             return
         found_line_num = -1
-        lines = open(fullpath, "r").read().splitlines()
+        with vfs.open(fullpath, "r") as file:
+            lines = file.read().splitlines()
         for i, line in enumerate(lines):
             if task_name in line:
                 found_line_num = i
@@ -461,6 +476,11 @@ class Task(Object, Resolvable):
         return None
 
 
+# annotation indices of TaskCalls keyed by id(taskcall). they are kept outside of the instances
+# so that the serialized TaskCalls are not changed, and removed when the TaskCall is garbage collected
+_annotation_indices = {}
+
+
 @dataclass
 class TaskCall(CallObject):
     type: str = "taskcall"
@@ -469,13 +489,36 @@ class TaskCall(CallObject):
     annotations: List[Annotation] = field(default_factory=list)
 
     def get_annotation_by_type(self, type_str=""):
-        matched = [an for an in self.annotations if an.type == type_str]
-        return matched
+        by_type, _ = self._get_annotation_index()
+        return list(by_type.get(type_str, []))
 
     def get_annotation_by_type_and_attr(self, type_str="", key="", val=None):
+        if key == "category":
+            _, by_category = self._get_annotation_index()
+            return list(by_category.get((type_str, val), []))
         matched = [an for an in self.annotations if hasattr(an, "type") and an.type == type_str and getattr(an, key, None) == val]
         return matched
 
+    # the index is built lazily and rebuilt when the annotation list is replaced or extended
+    def _get_annotation_index(self):
+        index_key = (id(self.annotations), len(self.annotations))
+        cached = _annotation_indices.get(id(self), None)
+        if cached is not None and cached[0] == index_key:
+            return cached[1], cached[2]
+        by_type = {}
+        by_category = {}
+        for an in self.annotations:
+            an_type = getattr(an, "type", None)
+            if an_type is None:
+                continue
+            by_type.setdefault(an_type, []).append(an)
+            if hasattr(an, "category"):
+                by_category.setdefault((an_type, an.category), []).append(an)
+        if cached is None:
+            weakref.finalize(self, _annotation_indices.pop, id(self), None)
+        _annotation_indices[id(self)] = (index_key, by_type, by_category)
+        return by_type, by_category
+
 
 @dataclass
 class TaskFile(Object, Resolvable):
@@ -29,7 +29,10 @@ from .models import (
     Task,
     TaskFile,
 )
+from . import vfs
+from .finder import search_module_files
 from .model_loader import (
+    find_role_dirs,
     load_collection,
     load_module,
     load_playbook,
@@ -306,6 +309,86 @@ class Parser:
         open(mapping_path, "w").write(ld.dump())
 
 
+definition_types = ["collections", "projects", "roles", "taskfiles", "modules", "playbooks", "plays", "tasks"]
+
+
+# definitions of a dependency (collection or role) which are parsed on demand.
+# the modules and the keys of the roles are made from the file index without parsing any yaml file,
+# and a role is parsed only when TreeLoader requests its key for the first time.
+# `definitions` has the objects loaded so far, in the same format as the one of Parser.run()
+class LazyDefinitions(object):
+    def __init__(self, target_type, target_name, path):
+        if target_type not in [LoadType.COLLECTION, LoadType.ROLE]:
+            raise ValueError("unsupported type for lazy definitions: {}".format(target_type))
+        self.target_type = target_type
+        self.target_name = target_name
+        self.path = path
+        self.collection_name = target_name if target_type == LoadType.COLLECTION else ""
+        self.definitions = {type_key: [] for type_key in definition_types}
+        # role key --> (role dir, role name); removed when the role is parsed
+        self.role_dirs = {}
+        # roles which have only name, fqcn and key, used for resolving role names
+        self.role_stubs = []
+        self._make_index()
+
+    def _make_index(self):
+        role_name = self.target_name if self.target_type == LoadType.ROLE else ""
+        for module_file_path in search_module_files(self.path):
+            try:
+                m = load_module(module_file_path, collection_name=self.collection_name, role_name=role_name, basedir=self.path)
+            except Exception:
+                logging.exception("error while loading the module at {}".format(module_file_path))
+                continue
+            self.definitions["modules"].append(m)
+
+        if self.target_type == LoadType.ROLE:
+            role_dirs = [(self.path, self.target_name)]
+        else:
+            role_dirs = [(role_dir, "") for role_dir in find_role_dirs(self.path) if vfs.isdir(role_dir)]
+        for role_dir, name in role_dirs:
+            stub = Role()
+            stub.name = name or os.path.basename(os.path.normpath(role_dir))
+            stub.collection = self.collection_name
+            stub.fqcn = "{}.{}".format(self.collection_name, stub.name) if self.collection_name else stub.name
+            stub.defined_in = os.path.relpath(role_dir, self.path) if role_dir != self.path else ""
+            stub.set_key()
+            self.role_dirs[stub.key] = (role_dir, name)
+            self.role_stubs.append(stub)
+
+    def has_key(self, key):
+        return key in self.role_dirs
+
+    # parse the role of the key, and return the loaded objects per type
+    def load(self, key):
+        loaded = {type_key: [] for type_key in definition_types}
+        if key not in self.role_dirs:
+            return loaded
+        role_dir, name = self.role_dirs.pop(key)
+        try:
+            r = load_role(path=role_dir, name=name, collection_name=self.collection_name, basedir=self.path)
+        except Exception:
+            logging.exception("error while loading the role at {}".format(role_dir))
+            return loaded
+        loaded["taskfiles"] = r.taskfiles
+        # the modules in the role dir are already in the index
+        indexed_module_keys = set([m.key for m in self.definitions["modules"]])
+        loaded["modules"] = [m for m in r.modules if m.key not in indexed_module_keys]
+        loaded["playbooks"] = r.playbooks
+        loaded["plays"] = [play for p in r.playbooks for play in p.plays]
+        tasks = [t for tf in r.taskfiles for t in tf.tasks]
+        for play in loaded["plays"]:
+            tasks.extend(play.pre_tasks)
+            tasks.extend(play.tasks)
+            tasks.extend(play.post_tasks)
+        loaded["tasks"] = tasks
+        loaded["roles"] = [r]
+        for type_key, objs in loaded.items():
+            loaded[type_key] = [obj.children_to_key() for obj in objs]
+            self.definitions[type_key].extend(loaded[type_key])
+        logging.debug("parsed the role {} on demand".format(r.fqcn))
+        return loaded
+
+
 def _dump_object_list(obj_list, output_path):
     tmp_obj_list = copy.deepcopy(obj_list)
     lines = []
@@ -15,14 +15,18 @@
 # limitations under the License.
 
 import argparse
+import bisect
 import os
 import logging
-from typing import List
+from typing import Iterable
 
 from .models import TaskCallsInTree
 from .keyutil import detect_type, key_delimiter
 from .analyzer import load_taskcalls_in_trees
+from .annotators.risk_annotator_base import RISK_ANNOTATION_TYPE
+from .stats import ExecutionStats
 from . import rules
+from .rules.base import _severity_level_mapping
 
 
 def key2name(key: str):
@@ -33,13 +37,152 @@ def key2name(key: str):
         return key.split(key_delimiter)[-1]
 
 
-def load_rules():
+# rule instances are shared by all the scans in the process, so the rules must not
+# keep any state in them; per-scan configuration is passed to check() as kwargs
+_rule_instances = {}
+
+
+def _get_rule_instance(class_name: str):
+    rule = _rule_instances.get(class_name, None)
+    if rule is None:
+        rule = getattr(rules, class_name)()
+        _rule_instances[class_name] = rule
+    return rule
+
+
+# returns the rules to run. `rule_names` (a rule name or a class name) replaces
+# the rules enabled by default, and `skip_rules`, `min_severity` and `tags` narrow them down
+def load_rules(rule_names: list = None, skip_rules: list = None, min_severity: str = "", tags: list = None):
+    all_rules = [_get_rule_instance(class_name) for class_name in rules.__all__]
+
+    known_names = set([r.name for r in all_rules] + rules.__all__)
+    for name in (rule_names or []) + (skip_rules or []):
+        if name not in known_names:
+            raise ValueError("unknown rule: {}".format(name))
+    severity_threshold = 0
+    if min_severity != "":
+        if min_severity not in _severity_level_mapping:
+            raise ValueError("unknown severity for min_severity: {}".format(min_severity))
+        severity_threshold = _severity_level_mapping[min_severity]
+
     _rules = []
-    for rule in rules.__all__:
-        _rules.append(getattr(rules, rule)())
+    for rule in all_rules:
+        names = [rule.name, type(rule).__name__]
+        if rule_names:
+            if not any([n in rule_names for n in names]):
+                continue
+        elif not rule.enabled:
+            continue
+        if skip_rules and any([n in skip_rules for n in names]):
+            continue
+        if _severity_level_mapping.get(rule.severity, 0) < severity_threshold:
+            continue
+        if tags and not set(tags) & set(rule.tags):
+            continue
+        _rules.append(rule)
     return _rules
 
 
+# returns the risk annotation categories that the rules need.
+# None means all the categories are needed, and an empty set means no annotator needs to run
+def get_required_categories(_rules: list):
+    categories = set()
+    for rule in _rules:
+        if not rule.uses_annotations:
+            continue
+        if len(rule.categories) == 0:
+            return None
+        categories.update(rule.categories)
+    return categories
+
+
+# walk the taskcalls once and make a mapping from a risk annotation category
+# to the indices of the taskcalls which have it
+def make_category_index(taskcalls: list):
+    category_index = {}
+    for i, taskcall in enumerate(taskcalls):
+        for anno in taskcall.annotations:
+            if getattr(anno, "type", "") != RISK_ANNOTATION_TYPE:
+                continue
+            category = getattr(anno, "category", "")
+            indices = category_index.setdefault(category, [])
+            if len(indices) == 0 or indices[-1] != i:
+                indices.append(i)
+    return category_index
+
+
+# returns the taskcalls which the rule subscribes to, in the original order
+def get_subscribed_taskcalls(rule, taskcalls: list, category_index: dict, begin: int = 0, end: int = -1):
+    if end < 0:
+        end = len(taskcalls)
+    if len(rule.categories) == 0:
+        return taskcalls[begin:end]
+    indices = set()
+    for category in rule.categories:
+        category_indices = category_index.get(category, [])
+        indices.update(category_indices[bisect.bisect_left(category_indices, begin) : bisect.bisect_left(category_indices, end)])
+    return [taskcalls[i] for i in sorted(indices)]
+
+
+# split taskcalls into contiguous segments (begin, end, fingerprint).
+# a segment of the taskcalls in the same role has a fingerprint made from
+# the task specs and the risk annotations, and it is None for the other segments.
+# the risk annotations of identical taskcalls are shared objects (see analyze()),
+# so the ids of them are enough here. the fingerprint is valid only while detect() is running
+def make_role_segments(taskcalls: list):
+    segments = []
+    begin = 0
+    for i in range(1, len(taskcalls) + 1):
+        if i < len(taskcalls) and taskcalls[i].spec.role == taskcalls[begin].spec.role:
+            continue
+        role = taskcalls[begin].spec.role
+        fingerprint = None
+        if role != "":
+            fingerprint = (role,) + tuple(
+                (
+                    tc.spec.key,
+                    tuple(id(an) for an in tc.annotations if getattr(an, "type", "") == RISK_ANNOTATION_TYPE),
+                )
+                for tc in taskcalls[begin:i]
+            )
+        segments.append((begin, i, fingerprint))
+        begin = i
+    return segments
+
+
+def _check(rule, taskcalls: list, extra_check_args: dict, stats: ExecutionStats = None):
+    if stats is None:
+        return rule.check(taskcalls, **extra_check_args)
+    return stats.measure(rule.name, rule.check, taskcalls, hit_func=lambda r: r[0], **extra_check_args)
+
+
+def check_rule(rule, taskcalls: list, category_index: dict, segments: list, rule_cache: dict, extra_check_args: dict, stats: ExecutionStats = None):
+    not_matched = (False, [], "")
+    has_role_segment = any([fp is not None for (_, _, fp) in segments])
+    if not rule.compositional or not has_role_segment:
+        target_taskcalls = get_subscribed_taskcalls(rule, taskcalls, category_index)
+        if len(rule.categories) > 0 and len(target_taskcalls) == 0:
+            return not_matched
+        return _check(rule, target_taskcalls, extra_check_args, stats)
+
+    results = []
+    for begin, end, fingerprint in segments:
+        cache_key = None
+        if fingerprint is not None:
+            cache_key = (rule.name, fingerprint)
+            if cache_key in rule_cache:
+                results.append(rule_cache[cache_key])
+                continue
+        target_taskcalls = get_subscribed_taskcalls(rule, taskcalls, category_index, begin, end)
+        result = not_matched
+        if len(rule.categories) == 0 or len(target_taskcalls) > 0:
+            result = _check(rule, target_taskcalls, extra_check_args, stats)
+        if cache_key is not None:
+            rule_cache[cache_key] = result
+        results.append(result)
+    return rule.compose(results)
+
+
 def make_subject_str(playbook_num: int, role_num: int):
     subject = ""
     if playbook_num > 0 and role_num > 0:
@@ -51,12 +194,29 @@ def make_subject_str(playbook_num: int, role_num: int):
     return subject
 
 
-def detect(taskcalls_in_trees: List[TaskCallsInTree], collection_name: str = ""):
-    rules = load_rules()
+# if `fail_on` is a severity (e.g. "high"), only the rules at or above it are checked,
+# the trees are checked from the smallest one and detect() stops at the first match.
+# the result is set to data_report["gate"]
+def detect(
+    taskcalls_in_trees: Iterable[TaskCallsInTree],
+    collection_name: str = "",
+    stats: ExecutionStats = None,
+    fail_on: str = "",
+    rules: list = None,
+):
+    if rules is None:
+        rules = load_rules()
     extra_check_args = {}
     if collection_name != "":
         extra_check_args["collection_name"] = collection_name
 
+    severity_threshold = 0
+    if fail_on != "":
+        if fail_on not in _severity_level_mapping:
+            raise ValueError("unknown severity for fail_on: {}".format(fail_on))
+        severity_threshold = _severity_level_mapping[fail_on]
+    gate = {"fail_on": fail_on, "failed": False}
+
     report_num = 1
 
     playbook_count = {"total": 0, "risk_found": 0}
@@ -65,8 +225,15 @@ def detect(taskcalls_in_trees: List[TaskCallsInTree], collection_name: str = "")
     data_report = {"summary": {}, "details": []}
     role_to_playbook_mappings = {}
     risk_found_playbooks = set()
+    # results of compositional rules for role subtrees
+    rule_cache = {}
 
-    num = len(taskcalls_in_trees)
+    # `taskcalls_in_trees` can be an iterator which resolves and analyzes the trees on demand,
+    # then the trees are checked in the given order and the rest is not consumed after the gate fails
+    num = len(taskcalls_in_trees) if isinstance(taskcalls_in_trees, list) else "?"
+    if severity_threshold > 0 and isinstance(taskcalls_in_trees, list):
+        # cheapest trees first
+        taskcalls_in_trees = sorted(taskcalls_in_trees, key=lambda t: len(getattr(t, "taskcalls", [])))
     for i, taskcalls_in_tree in enumerate(taskcalls_in_trees):
         if not isinstance(taskcalls_in_tree, TaskCallsInTree):
             continue
@@ -92,6 +259,8 @@ def detect(taskcalls_in_trees: List[TaskCallsInTree], collection_name: str = "")
 
         do_report = False
         taskcalls = taskcalls_in_tree.taskcalls
+        category_index = make_category_index(taskcalls)
+        segments = make_role_segments(taskcalls)
         result_dict = {}
         rule_dict = {}
         rule_count = {
@@ -101,18 +270,29 @@ def detect(taskcalls_in_trees: List[TaskCallsInTree], collection_name: str = "")
         }
         for rule in rules:
             rule_dict[rule.name] = rule
-            if not rule.enabled:
+            if _severity_level_mapping.get(rule.severity, 0) < severity_threshold:
                 continue
             rule_count["total"] += 1
             if not rule.is_target(type=tree_root_type, name=tree_root_name):
                 continue
             rule_count["rule_applied"] += 1
             rule_name = rule.name
-            matched, _, message = rule.check(taskcalls, **extra_check_args)
+            matched, _, message = check_rule(rule, taskcalls, category_index, segments, rule_cache, extra_check_args, stats)
             if matched:
                 rule_count["risk_found"] += 1
                 do_report = True
                 result_dict[rule_name] = message
+                if severity_threshold > 0:
+                    gate.update(
+                        {
+                            "failed": True,
+                            "rule": rule_name,
+                            "severity": rule.severity,
+                            "type": tree_root_type,
+                            "name": tree_root_name,
+                        }
+                    )
+                    break
         result_list = [
             {
                 "rule": {
@@ -143,6 +323,11 @@ def detect(taskcalls_in_trees: List[TaskCallsInTree], collection_name: str = "")
             else:
                 role_count["risk_found"] += 1
         logging.debug("detect() {}/{} done".format(i + 1, num))
+        if gate["failed"]:
+            break
+
+    if fail_on != "":
+        data_report["gate"] = gate
 
     if playbook_count["total"] > 0:
         data_report["summary"]["playbooks"] = {
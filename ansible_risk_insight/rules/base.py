@@ -48,6 +48,8 @@ class Tag:
     DEBUG = "debug"
 
 
+# a rule instance is created once and shared by all the scans in the process (see load_rules()),
+# so check() must not change the attributes of the instance
 class Rule(object):
     name: str = ""
     enabled: bool = False
@@ -56,9 +58,32 @@ class Rule(object):
     tags: list = []
     separate_report: bool = False
     all_ok_message: str = ""
+    # risk annotation categories this rule checks (e.g. AnnotatorCategory.INBOUND)
+    # if set, check() receives only the taskcalls that have a risk annotation of these categories
+    # and it is not called when there is no such taskcall. if empty, check() receives all the taskcalls
+    categories: list = []
+    # if False, check() uses only the task specs, so no annotator needs to run for this rule
+    uses_annotations: bool = True
+    # if True, the result for a series of taskcalls must be equal to compose() of
+    # the results for its contiguous parts; check() must depend only on the spec and
+    # the risk annotations of each taskcall. Then the results for role subtrees are
+    # cached and reused for all the trees which contain the same role subtree
+    compositional: bool = False
 
     def is_target(self, type: str, name: str) -> bool:
         raise ValueError("this is a base class method")
 
     def check(self, taskcalls: List[TaskCall], **kwargs):
         raise ValueError("this is a base class method")
+
+    # compose the results of check() for contiguous parts of taskcalls
+    def compose(self, results: list):
+        matched_taskcalls = []
+        messages = []
+        for (_, _matched_taskcalls, _message) in results:
+            matched_taskcalls.extend(_matched_taskcalls)
+            if _message != "":
+                messages.append(_message)
+        matched = len(matched_taskcalls) > 0
+        message = "\n".join(messages)
+        return matched, matched_taskcalls, message
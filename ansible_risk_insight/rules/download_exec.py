@@ -29,6 +29,7 @@ class DownloadExecRule(Rule):
     version: str = "v0.0.1"
     severity: Severity = Severity.HIGH
     tags: list = [Tag.NETWORK, Tag.COMMAND]
+    categories: list = [AnnotatorCategory.INBOUND, AnnotatorCategory.CMD_EXEC]
 
     def is_target(self, type: str, name: str) -> bool:
         return True
@@ -59,9 +60,15 @@ class DownloadExecRule(Rule):
                     for _d in dst:
                         download_files_and_tasks.append((_d, taskcall, mutable_src_vars))
         # check if the downloaded files are executed in "cmd_exec" tasks
+        # all the downloaded files are compiled into a prefix matcher,
+        # so each command line is scanned once regardless of the number of the files
+        matcher = _PrefixMatcher()
+        for i, (downloaded_file, _, _) in enumerate(download_files_and_tasks):
+            if isinstance(downloaded_file, str) and downloaded_file != "":
+                matcher.add(downloaded_file, i)
         matched_taskcalls = []
         message = ""
-        found = []
+        found = set()
         exec_count = 0
         for taskcall in taskcalls:
             exec_annos = taskcall.get_annotation_by_type_and_attr(RISK_ANNOTATION_TYPE, "category", AnnotatorCategory.CMD_EXEC)
@@ -73,25 +80,24 @@ class DownloadExecRule(Rule):
                 cmd_str = exec_data.data.get("cmd", "")
                 if isinstance(cmd_str, list):
                     cmd_str = " ".join(cmd_str)
-                for i, (
-                    downloaded_file,
-                    download_taskcall,
-                    download_mutable_src_vars,
-                ) in enumerate(download_files_and_tasks):
+                if not isinstance(cmd_str, str):
+                    continue
+                executed = _find_executed(cmd_str, matcher)
+                for i in sorted(executed):
                     if i in found:
                         continue
-                    if _is_executed(cmd_str, downloaded_file):
-                        matched_taskcalls.append((download_taskcall, taskcall))
-                        found.append(i)
-                        message += "- Download block: {}, line: {}\n".format(
-                            download_taskcall.spec.defined_in,
-                            _make_line_num_expr(download_taskcall.spec.line_num_in_file),
-                        )
-                        message += "  Exec block: {}, line: {}\n".format(
-                            taskcall.spec.defined_in,
-                            _make_line_num_expr(taskcall.spec.line_num_in_file),
-                        )
-                        message += "  Mutable Variables: {}\n".format(download_mutable_src_vars)
+                    _, download_taskcall, download_mutable_src_vars = download_files_and_tasks[i]
+                    matched_taskcalls.append((download_taskcall, taskcall))
+                    found.add(i)
+                    message += "- Download block: {}, line: {}\n".format(
+                        download_taskcall.spec.defined_in,
+                        _make_line_num_expr(download_taskcall.spec.line_num_in_file),
+                    )
+                    message += "  Exec block: {}, line: {}\n".format(
+                        taskcall.spec.defined_in,
+                        _make_line_num_expr(taskcall.spec.line_num_in_file),
+                    )
+                    message += "  Mutable Variables: {}\n".format(download_mutable_src_vars)
         matched = len(matched_taskcalls) > 0
         message = message[:-1] if message.endswith("\n") else message
         return matched, matched_taskcalls, message
@@ -104,22 +110,63 @@ def _make_line_num_expr(line_num_parts: list):
     return line_num_expr
 
 
-def _is_executed(cmd_str, target):
-    lines = cmd_str.splitlines()
-    found = False
-    for line in lines:
-        if target not in line:
-            continue
-        if line.startswith(target):
-            found = True
-        if _is_primary_command_target(line, target):
-            found = True
-        if found:
+# a character trie of the downloaded files to find all the files
+# which are prefixes of a string in a single scan of the string
+class _PrefixMatcher(object):
+    def __init__(self):
+        self.root = {}
+
+    def add(self, target, value):
+        node = self.root
+        for c in target:
+            node = node.setdefault(c, {})
+        node.setdefault(None, []).append(value)
+
+    def find_prefixes(self, txt):
+        found = []
+        node = self.root
+        for c in txt:
+            node = node.get(c, None)
+            if node is None:
+                break
+            found.extend(node.get(None, []))
+        return found
+
+
+# returns the values of all targets which are executed in cmd_str; a target is executed
+# if a line starts with it, or it is at the primary position of a command line
+def _find_executed(cmd_str, matcher):
+    executed = set()
+    if len(matcher.root) == 0:
+        return executed
+    for line in cmd_str.splitlines():
+        executed.update(matcher.find_prefixes(line))
+        for p in _primary_command_parts(line):
+            executed.update(matcher.find_prefixes(p))
+    return executed
+
+
+# returns the parts of the line at the primary position (the program itself or the first argument after options)
+def _primary_command_parts(line):
+    parts = _split_command_line(line)
+    primary_parts = []
+    current_index = 0
+    for p in parts:
+        if current_index == 0:
+            program = p if "/" not in p else p.split("/")[-1]
+            # filter out some specific non-exec patterns
+            if program in non_execution_programs:
+                break
+        if current_index > 1:
             break
-    return found
+        primary_parts.append(p)
+        if p.startswith("-"):
+            continue
+        current_index += 1
+    return primary_parts
 
 
-def _is_primary_command_target(line, target):
+def _split_command_line(line):
     parts = []
     is_in_variable = False
     concat_p = ""
@@ -132,21 +179,4 @@ def _is_primary_command_target(line, target):
         if not is_in_variable:
             parts.append(concat_p)
             concat_p = ""
-    current_index = 0
-    found_index = -1
-    for p in parts:
-        if current_index == 0:
-            program = p if "/" not in p else p.split("/")[-1]
-            # filter out some specific non-exec patterns
-            if program in non_execution_programs:
-                break
-        if p.startswith(target):
-            found_index = current_index
-            break
-        if p.startswith("-"):
-            continue
-        current_index += 1
-    # "<target.sh> option1 option2" => found_index == 0
-    # python -u <target.py> ==> found_index == 1
-    is_primay_target = found_index >= 0 and found_index <= 1
-    return is_primay_target
+    return parts
@@ -25,6 +25,7 @@ class ExternalDependencyRule(Rule):
     version: str = "v0.0.1"
     severity: Severity = Severity.LOW
     tags: list = [Tag.DEPENDENCY]
+    uses_annotations: bool = False
 
     allow_list: list = []
     separate_report: bool = True
@@ -36,12 +37,12 @@ class ExternalDependencyRule(Rule):
     # IN: tasks with "analyzed_data" (i.e. output from analyzer.py)
     # OUT: matched: bool, matched_tasks: list[task | tuple[task]], message: str
     def check(self, taskcalls: List[TaskCall], **kwargs):
+        # the rule instance is shared across scans, so the per-scan allow list is made here
+        allow_list = set(self.allow_list)
         collection_name = kwargs.get("collection_name", "")
         if collection_name != "":
-            self.allow_list.append(collection_name)
-        allow_list = kwargs.get("allow_list", [])
-        if len(allow_list) > 0:
-            self.allow_list.extend(allow_list)
+            allow_list.add(collection_name)
+        allow_list.update(kwargs.get("allow_list", []))
         matched_taskcalls = []
         message = ""
         external_dependencies = []
@@ -59,7 +60,7 @@ class ExternalDependencyRule(Rule):
             parts = resolved_name.split(".")
             if len(parts) >= 2:
                 collection_name = "{}.{}".format(parts[0], parts[1])
-                if collection_name in self.allow_list:
+                if collection_name in allow_list:
                     continue
                 if collection_name not in external_dependencies:
                     external_dependencies.append(collection_name)
@@ -26,6 +26,9 @@ class InboundTransferRule(Rule):
     version: str = "v0.0.1"
     severity: Severity = Severity.MEDIUM
     tags: list = [Tag.NETWORK]
+    categories: list = [AnnotatorCategory.INBOUND]
+
+    compositional: bool = True
 
     def is_target(self, type: str, name: str) -> bool:
         return True
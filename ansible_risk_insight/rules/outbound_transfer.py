@@ -26,6 +26,9 @@ class OutboundTransferRule(Rule):
     version: str = "v0.0.1"
     severity: Severity = Severity.MEDIUM
     tags: list = [Tag.NETWORK]
+    categories: list = [AnnotatorCategory.OUTBOUND]
+
+    compositional: bool = True
 
     def is_target(self, type: str, name: str) -> bool:
         return True
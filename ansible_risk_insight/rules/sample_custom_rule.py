@@ -25,6 +25,7 @@ class SampleCustomRule(Rule):
     version: str = "v0.0.1"
     severity: Severity = Severity.VERY_LOW
     tags: list = [Tag.DEBUG]
+    uses_annotations: bool = False
 
     def is_target(self, type: str, name: str) -> bool:
         return True
@@ -18,6 +18,8 @@ import os
 import sys
 import re
 
+from . import vfs
+
 
 # glob.glob() may cause infinite loop when there is symlink loop
 # safe_glob() support the case by `followlink=False` option as default
@@ -48,7 +50,7 @@ def safe_glob(patterns, root_dir="", recursive=True, followlinks=False):
 
         # if recusive, use os.walk to search files recursively
         if recursive:
-            for dirpath, folders, files in os.walk(root_dir_for_this_pattern, followlinks=followlinks):
+            for dirpath, folders, files in vfs.walk(root_dir_for_this_pattern, followlinks=followlinks):
                 for file in files:
                     fpath = os.path.join(dirpath, file)
                     fpath = os.path.normpath(fpath)
@@ -59,7 +61,7 @@ def safe_glob(patterns, root_dir="", recursive=True, followlinks=False):
         else:
             # otherwise, just use os.listdir to avoid
             # unnecessary loading time of os.walk
-            files = os.listdir(root_dir_for_this_pattern)
+            files = vfs.listdir(root_dir_for_this_pattern)
             for file in files:
                 fpath = os.path.join(root_dir, file)
                 fpath = os.path.normpath(fpath)
@@ -21,7 +21,6 @@ import shutil
 import json
 import tempfile
 import logging
-import jsonpickle
 from dataclasses import dataclass, field
 
 from .models import (
@@ -34,16 +33,21 @@ from .loader import (
     get_loader_version,
     get_target_name,
 )
-from .parser import Parser
+from .parser import Parser, LazyDefinitions
+from . import vfs
 from .model_loader import load_object, find_playbook_role_module
 from .tree import TreeLoader
 from .annotators.variable_resolver import resolve_variables
+from .context import default_loop_expansion_limit
 from .analyzer import analyze
-from .risk_detector import detect
+from .risk_detector import detect, load_rules, get_required_categories
+from .rules.base import _severity_level_mapping
 from .dependency_dir_preparator import (
     DependencyDirPreparator,
+    default_download_workers,
 )
 from .findings import Findings
+from .stats import ExecutionStats, stats_to_display
 from .risk_assessment_model import RAMClient
 from .utils import (
     is_url,
@@ -52,12 +56,37 @@ from .utils import (
     escape_local_path,
     summarize_findings,
     summarize_findings_data,
+    gate_to_display,
+    place_tree,
+    default_placement_mode,
+    default_clone_depth,
 )
 
 
+# a bad value of an integer env variable falls back to the default instead of breaking the import
+def get_int_env(name, default):
+    value = os.environ.get(name, "")
+    if value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        logging.warning("{} must be an integer, but got {}; use the default value {}".format(name, value, default))
+        return default
+
+
 class Config:
     data_dir: str = os.environ.get("ARI_DATA_DIR", os.path.join("/tmp", "ari-data"))
     log_level: str = os.environ.get("ARI_LOG_LEVEL", "info").lower()
+    loop_expansion_limit: int = get_int_env("ARI_LOOP_EXPANSION_LIMIT", default_loop_expansion_limit)
+    download_workers: int = get_int_env("ARI_DOWNLOAD_WORKERS", default_download_workers)
+    mirror_dir: str = os.environ.get("ARI_OFFLINE_MIRROR", "")
+    placement_mode: str = os.environ.get("ARI_PLACEMENT_MODE", default_placement_mode)
+    clone_depth: int = get_int_env("ARI_CLONE_DEPTH", default_clone_depth)
+    sparse_checkout: bool = os.environ.get("ARI_SPARSE_CHECKOUT", "false").lower() in ["true", "yes", "1"]
+    git_mirror_enabled: bool = os.environ.get("ARI_GIT_MIRROR", "true").lower() in ["true", "yes", "1"]
+    dependency_cache_enabled: bool = os.environ.get("ARI_DEPENDENCY_CACHE", "true").lower() in ["true", "yes", "1"]
+    lazy_definitions_enabled: bool = os.environ.get("ARI_LAZY_DEFINITIONS", "true").lower() in ["true", "yes", "1"]
 
 
 collection_manifest_json = "MANIFEST.json"
@@ -131,10 +160,28 @@ class ARIScanner(object):
     hash: str = ""
 
     source_repository: str = ""
+    # scan the project at this commit (sha or ref) without checking it out
+    git_commit: str = ""
+    # the git dir which has the commit and the sha of it; set by prepare_dependencies()
+    git_commit_dir: str = ""
+    git_commit_sha: str = ""
+    # offline mode; resolve dependencies from this local Galaxy mirror
+    mirror_dir: str = ""
     out_dir: str = ""
     show_all: bool = False
     pretty: bool = False
     silent: bool = False
+    rule_stats: bool = False
+    # CI gating mode: stop at the first finding at or above this severity
+    fail_on: str = ""
+    # rule selection; `rules` overrides the default enabled rules
+    rules: list = field(default_factory=list)
+    skip_rules: list = field(default_factory=list)
+    min_severity: str = ""
+    rule_tags: list = field(default_factory=list)
+    _rules: list = None
+
+    annotator_stats: ExecutionStats = None
 
     extra_requirements: list = field(default_factory=list)
     resolve_failures: dict = field(default_factory=dict)
@@ -207,6 +254,8 @@ class ARIScanner(object):
             raise ValueError("Unsupported type: {}".format(self.type))
 
         self.ram_client = RAMClient(root_dir=self.root_dir)
+        # validate the rule selection before the scan
+        self.get_rules()
 
     def prepare_dependencies(self, root_install=True):
         # Install the target if needed
@@ -224,6 +273,15 @@ class ARIScanner(object):
             target_path_mappings=self.__path_mappings,
             do_save=self.do_save,
             tmp_install_dir=self.tmp_install_dir,
+            download_workers=config.download_workers,
+            mirror_dir=self.mirror_dir or config.mirror_dir,
+            dependency_cache_enabled=config.dependency_cache_enabled,
+            placement_mode=config.placement_mode,
+            clone_depth=config.clone_depth,
+            sparse_checkout=config.sparse_checkout,
+            git_mirror_enabled=config.git_mirror_enabled,
+            git_commit=self.git_commit,
+            silent=self.silent,
         )
         dep_dirs = ddp.prepare_dir(
             root_install=root_install, is_src_installed=self.is_src_installed(), cache_enabled=True, cache_dir=os.path.join(self.root_dir, "archives")
@@ -234,14 +292,28 @@ class ARIScanner(object):
         self.hash = ddp.metadata.hash
         self.download_url = ddp.metadata.download_url
         self.loaded_dependency_dirs = dep_dirs
+        self.git_commit_dir = ddp.git_commit_dir
+        self.git_commit_sha = ddp.git_commit_sha
 
         return target_path, dep_dirs
 
     def load(self, prepare_dependencies=False):
-
+        # the dependencies are found in the commit by DependencyDirPreparator, so prepare them before mounting it
         if prepare_dependencies:
             self.prepare_dependencies()
-
+        if self.git_commit:
+            if not self.git_commit_sha:
+                raise ValueError("the commit {} is not resolved; call prepare_dependencies() before load()".format(self.git_commit))
+            # the project files are read from the commit in the git object database instead of the working tree
+            with vfs.use_git_commit(self.git_commit_dir, self.git_commit_sha, self.target_path) as fs:
+                if not self.version:
+                    self.version = fs.commit.hexsha
+                if not self.hash:
+                    self.hash = fs.commit.tree.hexsha
+                return self._load()
+        return self._load()
+
+    def _load(self):
         ext_list = []
         ext_list.extend(
             [
@@ -288,6 +360,7 @@ class ARIScanner(object):
                     dependency_dir=self.dependency_dir,
                     do_save=self.do_save,
                     source_repository=self.source_repository,
+                    mirror_dir=self.mirror_dir,
                     silent=True,
                 )
                 # use prepared dep dirs
@@ -326,22 +399,37 @@ class ARIScanner(object):
         self.set_trees()
         if not self.silent:
             logging.debug("set_trees() done")
-        self.set_resolved()
-        if not self.silent:
-            logging.debug("set_resolved() done")
-        self.set_analyzed()
-        if not self.silent:
-            logging.debug("set_analyzed() done")
-        self.set_report()
-        if not self.silent:
-            logging.debug("set_report() done")
+        if self.fail_on:
+            # resolve, analyze and detect run tree by tree, and stop at the first finding
+            self.set_report(self.iter_analyzed_trees())
+            if not self.silent:
+                logging.debug("set_report() done for {} tree(s)".format(len(self.taskcalls_in_trees)))
+        else:
+            self.set_resolved()
+            if not self.silent:
+                logging.debug("set_resolved() done")
+            self.set_analyzed()
+            if not self.silent:
+                logging.debug("set_analyzed() done")
+            self.set_report()
+            if not self.silent:
+                logging.debug("set_report() done")
         dep_num, ext_counts, root_counts = self.count_definitions()
         if not self.silent:
             print("# of dependencies:", dep_num)
             # print("ext definitions:", ext_counts)
             # print("root definitions:", root_counts)
 
-        if len(self.extra_requirements) == 0:
+        if self.fail_on:
+            # the findings are partial in this mode, so they are not registered to RAM
+            if self.out_dir is not None and self.out_dir != "":
+                self.save_findings(out_dir=self.out_dir)
+            if not self.silent:
+                print(gate_to_display(self.findings.report.get("gate", {})))
+            return
+
+        # the findings of selected rules are partial, so they are not registered to RAM
+        if len(self.extra_requirements) == 0 and not self.has_rule_selection():
             self.register_findings_to_db()
 
         if self.out_dir is not None and self.out_dir != "":
@@ -353,6 +441,9 @@ class ARIScanner(object):
             summary = summarize_findings(self.findings, self.show_all)
             print(summary)
 
+        if self.rule_stats:
+            print(stats_to_display(self.findings.metadata.get("stats", {})))
+
         if self.pretty:
             if not self.silent:
                 print(json.dumps(self.findings.simple(), indent=2))
@@ -518,11 +609,32 @@ class ARIScanner(object):
     def get_trees(self):
         return self.trees, self.node_objects
 
+    # in the --fail-on mode, the rules below the threshold are not loaded at all, so that the annotators
+    # and the variable resolution which only those rules need are skipped too
+    def get_rules(self):
+        if self._rules is None:
+            min_severity = self.min_severity
+            if self.fail_on:
+                if self.fail_on not in _severity_level_mapping:
+                    raise ValueError("unknown severity for fail_on: {}".format(self.fail_on))
+                if _severity_level_mapping[self.fail_on] > _severity_level_mapping.get(min_severity, 0):
+                    min_severity = self.fail_on
+            self._rules = load_rules(self.rules, self.skip_rules, min_severity, self.rule_tags)
+        return self._rules
+
+    def has_rule_selection(self):
+        return len(self.rules) > 0 or len(self.skip_rules) > 0 or self.min_severity != "" or len(self.rule_tags) > 0
+
     def set_resolved(self):
-        taskcalls_in_trees = resolve(self.trees, self.additional)
+        # variable annotations are used only by the annotators
+        categories = get_required_categories(self.get_rules())
+        with_variables = categories is None or len(categories) > 0
+        taskcalls_in_trees = resolve(self.trees, self.additional, config.loop_expansion_limit, with_variables)
         self.taskcalls_in_trees = taskcalls_in_trees
 
         if self.do_save:
+            import jsonpickle
+
             root_def_dir = self.__path_mappings["root_definitions"]
             tasks_in_t_path = os.path.join(root_def_dir, "tasks_in_trees.json")
             tasks_in_t_lines = []
@@ -537,10 +649,14 @@ class ARIScanner(object):
         return self.taskcalls_in_trees
 
     def set_analyzed(self):
-        taskcalls_in_trees = analyze(self.taskcalls_in_trees)
+        self.annotator_stats = ExecutionStats()
+        categories = get_required_categories(self.get_rules())
+        taskcalls_in_trees = analyze(self.taskcalls_in_trees, stats=self.annotator_stats, categories=categories)
         self.taskcalls_in_trees = taskcalls_in_trees
 
         if self.do_save:
+            import jsonpickle
+
             root_def_dir = self.__path_mappings["root_definitions"]
             tasks_in_t_a_path = os.path.join(root_def_dir, "tasks_in_trees_with_analysis.json")
             tasks_in_t_a_lines = []
@@ -555,7 +671,23 @@ class ARIScanner(object):
     def get_analyzed(self):
         return self.taskcalls_in_trees
 
-    def set_report(self):
+    # yields the resolved and analyzed trees one by one from the smallest tree, for the --fail-on mode.
+    # the trees after the first failing one are neither resolved nor analyzed
+    def iter_analyzed_trees(self):
+        self.taskcalls_in_trees = []
+        self.annotator_stats = ExecutionStats()
+        categories = get_required_categories(self.get_rules())
+        with_variables = categories is None or len(categories) > 0
+        annotation_cache = {}
+        for _tree in sorted(self.trees, key=lambda t: len(getattr(t, "items", []))):
+            taskcalls_in_trees = resolve([_tree], self.additional, config.loop_expansion_limit, with_variables)
+            taskcalls_in_trees = analyze(taskcalls_in_trees, stats=self.annotator_stats, categories=categories, annotation_cache=annotation_cache)
+            self.taskcalls_in_trees.extend(taskcalls_in_trees)
+            yield from taskcalls_in_trees
+
+    def set_report(self, taskcalls_in_trees=None):
+        if taskcalls_in_trees is None:
+            taskcalls_in_trees = self.taskcalls_in_trees
         coll_type = LoadType.COLLECTION
         coll_name = self.name if self.type == coll_type else ""
         target_name = self.name
@@ -563,7 +695,15 @@ class ARIScanner(object):
             target_name = self.collection_name
         if self.role_name:
             target_name = self.role_name
-        data_report = detect(self.taskcalls_in_trees, collection_name=coll_name)
+        rule_stats = ExecutionStats()
+        data_report = detect(
+            taskcalls_in_trees,
+            collection_name=coll_name,
+            stats=rule_stats,
+            fail_on=self.fail_on,
+            rules=self.get_rules(),
+        )
+        annotator_stats = self.annotator_stats if self.annotator_stats is not None else ExecutionStats()
         metadata = {
             "type": self.type,
             "name": target_name,
@@ -572,6 +712,12 @@ class ARIScanner(object):
             "download_url": self.download_url,
             "hash": self.hash,
         }
+        # the timings differ in every scan, so they are saved only when requested
+        if self.rule_stats:
+            metadata["stats"] = {
+                "annotators": annotator_stats.summary(),
+                "rules": rule_stats.summary(),
+            }
         dependencies = self.loaded_dependency_dirs
 
         summary_txt = summarize_findings_data(
@@ -662,10 +808,30 @@ class ARIScanner(object):
         return loaded
 
     def load_definition_ext(self, target_type, target_name, target_path):
-        ld = self.create_load_file(target_type, target_name, target_path)
+        key = "{}-{}".format(target_type, target_name)
         use_cache = True
-        output_dir = self.get_definition_path(ld.target_type, ld.target_name)
-        if use_cache and os.path.exists(os.path.join(output_dir, "mappings.json")):
+        output_dir = self.get_definition_path(target_type, target_name)
+        has_cache = use_cache and os.path.exists(os.path.join(output_dir, "mappings.json"))
+        if not has_cache and config.lazy_definitions_enabled and target_type in [LoadType.COLLECTION, LoadType.ROLE]:
+            # parse only the definitions which are reachable from the root; see TreeLoader.get_object()
+            if not os.path.exists(target_path):
+                raise ValueError("No such file or directory: {}".format(target_path))
+            lazy = LazyDefinitions(target_type, target_name, target_path)
+            mappings = Load(
+                target_name=target_name,
+                target_type=target_type,
+                path=target_path,
+                loader_version=get_loader_version(),
+            )
+            self.ext_definitions[key] = {
+                "definitions": lazy.definitions,
+                "mappings": mappings,
+                "lazy": lazy,
+            }
+            return
+
+        ld = self.create_load_file(target_type, target_name, target_path)
+        if has_cache:
             if not self.silent:
                 logging.debug("use cache from {}".format(output_dir))
             definitions, mappings = Parser.restore_definition_objects(output_dir)
@@ -678,7 +844,6 @@ class ARIScanner(object):
                     os.makedirs(output_dir, exist_ok=True)
                 Parser.dump_definition_objects(output_dir, definitions, mappings)
 
-        key = "{}-{}".format(target_type, target_name)
         self.ext_definitions[key] = {
             "definitions": definitions,
             "mappings": mappings,
@@ -752,9 +917,12 @@ class ARIScanner(object):
                     raise ValueError("src {} is not directory".format(src))
                 if dst == "" or ".." in dst:
                     raise ValueError("dst {} is invalid".format(dst))
-                os.system("cp -r {}/ {}/".format(src, dst))
+                # same as `cp -r <src>/ <dst>/`
+                if os.path.exists(dst):
+                    dst = os.path.join(dst, os.path.basename(os.path.normpath(src)))
+                place_tree(src, dst, config.placement_mode)
 
-            # use cp instead of shutil.copytree to avoid symlink reference loop
+            # place_tree() keeps symlinks as they are to avoid symlink reference loop
             copytree(p1, p2)
 
         with open(path2, "w") as f2:
@@ -787,6 +955,11 @@ class ARIScanner(object):
         with open(map2, "w") as f2:
             json.dump(js2, f2)
 
+    def is_gate_failed(self):
+        if self.findings is None:
+            return False
+        return self.findings.report.get("gate", {}).get("failed", False)
+
     def register_findings_to_db(self):
         self.ram_client.register(self.findings)
 
@@ -804,7 +977,7 @@ def tree(root_definitions, ext_definitions, ram_client=None):
     return trees, additional, tl.extra_requirements, tl.resolve_failures
 
 
-def resolve(trees, additional):
+def resolve(trees, additional, loop_expansion_limit=default_loop_expansion_limit, with_variables=True):
     taskcalls_in_trees = []
     for tree in trees:
         if not isinstance(tree, ObjectList):
@@ -812,7 +985,7 @@ def resolve(trees, additional):
         if len(tree.items) == 0:
             continue
         root_key = tree.items[0].spec.key
-        taskcalls = resolve_variables(tree, additional)
+        taskcalls = resolve_variables(tree, additional, loop_expansion_limit, with_variables)
         d = TaskCallsInTree(
             root_key=root_key,
             taskcalls=taskcalls,
@@ -0,0 +1,92 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import time
+import math
+from dataclasses import dataclass, field
+
+
+@dataclass
+class CallStats:
+    name: str = ""
+    count: int = 0
+    hit: int = 0
+    total_time: float = 0.0
+    durations: list = field(default_factory=list)
+
+    def record(self, duration: float, hit: bool):
+        self.count += 1
+        if hit:
+            self.hit += 1
+        self.total_time += duration
+        self.durations.append(duration)
+
+    @property
+    def p95_time(self):
+        if len(self.durations) == 0:
+            return 0.0
+        sorted_durations = sorted(self.durations)
+        index = max(math.ceil(len(sorted_durations) * 0.95) - 1, 0)
+        return sorted_durations[index]
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "hit": self.hit,
+            "total_time": round(self.total_time, 6),
+            "p95_time": round(self.p95_time, 6),
+        }
+
+
+# ExecutionStats records call counts, hit counts and elapsed time
+# of annotators or rules by their names
+@dataclass
+class ExecutionStats:
+    calls: dict = field(default_factory=dict)
+
+    def record(self, name: str, duration: float, hit: bool):
+        if name not in self.calls:
+            self.calls[name] = CallStats(name=name)
+        self.calls[name].record(duration, hit)
+
+    # usage: result = stats.measure(name, func, *args, hit_func=lambda r: bool(r))
+    def measure(self, name: str, func, *args, hit_func=None, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        duration = time.perf_counter() - start
+        hit = hit_func(result) if hit_func is not None else True
+        self.record(name, duration, hit)
+        return result
+
+    def summary(self):
+        return {name: cs.summary() for name, cs in self.calls.items()}
+
+
+def stats_to_display(stats: dict):
+    from tabulate import tabulate
+
+    lines = []
+    for kind in ["annotators", "rules"]:
+        kind_stats = stats.get(kind, {})
+        if len(kind_stats) == 0:
+            continue
+        table = [(kind.upper()[:-1], "CALLS", "HITS", "TOTAL_TIME(s)", "P95_TIME(s)")]
+        sorted_names = sorted(kind_stats, key=lambda name: kind_stats[name]["total_time"], reverse=True)
+        for name in sorted_names:
+            s = kind_stats[name]
+            table.append((name, s["count"], s["hit"], "{:.6f}".format(s["total_time"]), "{:.6f}".format(s["p95_time"])))
+        lines.append(tabulate(table))
+    return "\n".join(lines)
@@ -423,6 +423,14 @@ class TreeLoader(object):
 
         self.dicts = make_dicts(self.root_definitions, self.ext_definitions)
 
+        # ext definitions parsed on demand (parser.LazyDefinitions); the stubs of their roles are
+        # in the dicts so that role names can be resolved, and get_object() parses a role when its key is requested
+        self.lazy_definitions = [d["lazy"] for d in ext_definitions.values() if d.get("lazy", None) is not None]
+        for lazy in self.lazy_definitions:
+            for stub in lazy.role_stubs:
+                if stub.fqcn not in self.dicts["roles"]:
+                    self.dicts["roles"][stub.fqcn] = stub
+
         self.ram_client: RAMClient = ram_client
         self.var_manager: VariableManager = VariableManager()
 
@@ -534,6 +542,10 @@ class TreeLoader(object):
         if obj is not None:
             return obj
 
+        obj = self.load_lazy_definition(obj_key, type_key)
+        if obj is not None:
+            return obj
+
         if search_ram and self.ram_client:
             matched_obj = self.ram_client.get_object_by_key(obj_key)
             obj = matched_obj.get("object", None)
@@ -542,6 +554,22 @@ class TreeLoader(object):
 
         return None
 
+    def load_lazy_definition(self, obj_key, type_key):
+        for lazy in self.lazy_definitions:
+            if not lazy.has_key(obj_key):
+                continue
+            loaded = lazy.load(obj_key)
+            for _type_key, objs in loaded.items():
+                if _type_key not in self.ext_definitions:
+                    continue
+                for obj in objs:
+                    self.ext_definitions[_type_key].add(obj)
+                    if _type_key in self.dicts:
+                        obj_dict_key = obj.fqcn if hasattr(obj, "fqcn") else obj.key
+                        self.dicts[_type_key][obj_dict_key] = obj
+            return self.ext_definitions[type_key].find_by_key(obj_key)
+        return None
+
     def add_builtin_modules(self):
         obj_list = ObjectList()
         builtin_modules = init_builtin_modules()
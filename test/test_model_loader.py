@@ -0,0 +1,136 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import shutil
+import subprocess
+import tarfile
+
+import pytest
+
+from ansible_risk_insight import model_loader, vfs
+from ansible_risk_insight.model_loader import load_collection, load_collection_from_archive
+
+
+@pytest.mark.parametrize("load_children", [False, True])
+def test_load_collection_from_archive(tmp_path, load_children):
+    collection_dir = str(tmp_path / "ansible_collections" / "my" / "collection")
+    shutil.copytree("test/testdata/projects/my.collection", collection_dir)
+    os.makedirs(os.path.join(collection_dir, "plugins", "modules"))
+    with open(os.path.join(collection_dir, "plugins", "modules", "sample.py"), "w") as f:
+        f.write("# sample module\n")
+    os.makedirs(os.path.join(collection_dir, "playbooks"))
+    with open(os.path.join(collection_dir, "playbooks", "site.yml"), "w") as f:
+        f.write("- hosts: all\n  roles:\n    - sample-role-1\n")
+    targz = str(tmp_path / "my-collection-1.2.3.tar.gz")
+    with tarfile.open(targz, "w:gz") as tar:
+        for name in sorted(os.listdir(collection_dir)):
+            tar.add(os.path.join(collection_dir, name), arcname=name)
+
+    expected = load_collection(collection_dir=collection_dir, basedir=collection_dir, load_children=load_children)
+    actual = load_collection_from_archive(targz, load_children=load_children)
+    assert actual.name == expected.name == "my.collection"
+    assert actual.metadata == expected.metadata
+    for attr in ["playbooks", "roles", "modules"]:
+        expected_list = getattr(expected, attr)
+        actual_list = getattr(actual, attr)
+        assert len(actual_list) == len(expected_list) > 0
+        if load_children:
+            assert [o.key for o in actual_list] == [o.key for o in expected_list]
+        else:
+            assert actual_list == expected_list
+    # the archive is unmounted after loading
+    assert vfs.get_fs(os.path.join("/ari-archive", "my-collection-1.2.3.tar.gz")) is vfs.local_fs
+
+
+def _git(cwd, *args):
+    proc = subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.strip()
+
+
+def _write_files(repo, files):
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(os.path.join(repo, name)), exist_ok=True)
+        with open(os.path.join(repo, name), "w") as f:
+            f.write(text)
+
+
+def _role_modules(repo_obj):
+    return {r.name: [t.module for tf in r.taskfiles for t in tf.tasks] for r in repo_obj.roles}
+
+
+def test_load_repository_from_commit(tmp_path):
+    repo = str(tmp_path / "repo")
+    os.makedirs(repo)
+    _git(repo, "init", "-q")
+    _write_files(
+        repo,
+        {
+            "site.yml": "- hosts: all\n  roles:\n    - r1\n",
+            "roles/r1/tasks/main.yml": "- name: r1\n  ansible.builtin.debug:\n    msg: r1\n",
+            "roles/r2/tasks/main.yml": "- name: r2\n  ansible.builtin.debug:\n    msg: r2\n",
+        },
+    )
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "first")
+    first = _git(repo, "rev-parse", "HEAD")
+    _write_files(repo, {"roles/r2/tasks/main.yml": "- name: r2\n  ansible.builtin.shell: echo r2\n"})
+    _git(repo, "commit", "-q", "-am", "second")
+    # uncommitted changes are not loaded
+    _write_files(repo, {"roles/r1/tasks/main.yml": "- name: r1\n  ansible.builtin.command: echo dirty\n"})
+
+    model_loader._git_object_cache.clear()
+    old = model_loader.load_repository_from_commit(repo, first)
+    new = model_loader.load_repository_from_commit(repo, "HEAD")
+    assert _role_modules(old) == {"r1": ["ansible.builtin.debug"], "r2": ["ansible.builtin.debug"]}
+    assert _role_modules(new) == {"r1": ["ansible.builtin.debug"], "r2": ["ansible.builtin.shell"]}
+    assert [p.defined_in for p in new.playbooks] == ["site.yml"]
+
+    # the unchanged role is loaded once
+    cached_roles = [key for key in model_loader._git_object_cache if key[0] == "load_role"]
+    assert len(cached_roles) == 3
+    assert len([key for key in cached_roles if key[2].endswith("/roles/r1")]) == 1
+    # the file access is back to the local filesystem
+    assert vfs.get_fs(os.path.join(model_loader.git_mount_root, "repo")) is vfs.local_fs
+
+
+def test_git_commit_fs_symlinks(tmp_path):
+    repo = str(tmp_path / "repo")
+    os.makedirs(repo)
+    _git(repo, "init", "-q")
+    _write_files(repo, {"roles/r1/tasks/main.yml": "- name: r1\n  ansible.builtin.debug:\n    msg: r1\n", "outside.yml": "- hosts: all\n"})
+    os.symlink("main.yml", os.path.join(repo, "roles", "r1", "tasks", "link.yml"))
+    os.symlink("link.yml", os.path.join(repo, "roles", "r1", "tasks", "nested_link.yml"))
+    os.symlink("r1", os.path.join(repo, "roles", "dir_link"))
+    os.symlink("../../../../outside.yml", os.path.join(repo, "roles", "r1", "tasks", "escape.yml"))
+    os.symlink("missing.yml", os.path.join(repo, "roles", "r1", "tasks", "broken.yml"))
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "links")
+
+    mount_point = str(tmp_path / "mnt")
+    with vfs.use_git_commit(repo, "HEAD", mount_point):
+        tasks_dir = os.path.join(mount_point, "roles", "r1", "tasks")
+        # the links to files are followed
+        assert vfs.listdir(tasks_dir) == ["link.yml", "main.yml", "nested_link.yml"]
+        with vfs.open(os.path.join(tasks_dir, "main.yml")) as f:
+            content = f.read()
+        for name in ["link.yml", "nested_link.yml"]:
+            with vfs.open(os.path.join(tasks_dir, name)) as f:
+                assert f.read() == content
+        # the other links are skipped
+        assert vfs.listdir(os.path.join(mount_point, "roles")) == ["r1"]
+        assert not vfs.exists(os.path.join(tasks_dir, "escape.yml"))
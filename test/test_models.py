@@ -0,0 +1,42 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import jsonpickle
+
+from ansible_risk_insight.models import RiskAnnotation, Task, TaskCall, VariableAnnotation
+
+
+def test_taskcall_annotation_index():
+    taskcall = TaskCall.from_spec(Task(key="task sample"), None)
+    taskcall.annotations.append(VariableAnnotation(type="variable_annotation"))
+    assert len(taskcall.get_annotation_by_type("variable_annotation")) == 1
+    assert taskcall.get_annotation_by_type_and_attr("risk_annotation", "category", "inbound_transfer") == []
+
+    # appending annotations invalidates the index
+    taskcall.annotations.append(RiskAnnotation(type="risk_annotation", category="inbound_transfer"))
+    taskcall.annotations.append(RiskAnnotation(type="risk_annotation", category="cmd_exec"))
+    assert len(taskcall.get_annotation_by_type("risk_annotation")) == 2
+    inbound = taskcall.get_annotation_by_type_and_attr("risk_annotation", "category", "inbound_transfer")
+    assert len(inbound) == 1 and inbound[0].category == "inbound_transfer"
+
+    # the index is not serialized, and it is rebuilt after loading
+    json_str = jsonpickle.encode(taskcall, make_refs=False)
+    assert "_annotation_index" not in json_str
+    # the serialized format is the same as the one of a TaskCall without the index
+    assert json_str == jsonpickle.encode(TaskCall(**{k: v for k, v in taskcall.__dict__.items()}), make_refs=False)
+    assert "py/state" not in json_str
+    loaded = jsonpickle.decode(json_str)
+    assert len(loaded.get_annotation_by_type_and_attr("risk_annotation", "category", "cmd_exec")) == 1
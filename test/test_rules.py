@@ -0,0 +1,164 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from ansible_risk_insight.annotators.risk_annotator_base import AnnotatorCategory, RISK_ANNOTATION_TYPE
+from ansible_risk_insight.models import ExecutableType, RiskAnnotation, Task, TaskCall
+from ansible_risk_insight.analyzer import load_annotators
+from ansible_risk_insight.risk_detector import check_rule, get_required_categories, load_rules, make_category_index, make_role_segments
+from ansible_risk_insight.rules.download_exec import _PrefixMatcher, _find_executed, _split_command_line, non_execution_programs
+from ansible_risk_insight.rules.inbound_transfer import InboundTransferRule
+
+
+# the original per-target check which the prefix matcher must agree with
+def _is_executed(cmd_str, target):
+    lines = cmd_str.splitlines()
+    found = False
+    for line in lines:
+        if target not in line:
+            continue
+        if line.startswith(target):
+            found = True
+        if _is_primary_command_target(line, target):
+            found = True
+        if found:
+            break
+    return found
+
+
+def _is_primary_command_target(line, target):
+    parts = _split_command_line(line)
+    current_index = 0
+    found_index = -1
+    for p in parts:
+        if current_index == 0:
+            program = p if "/" not in p else p.split("/")[-1]
+            # filter out some specific non-exec patterns
+            if program in non_execution_programs:
+                break
+        if p.startswith(target):
+            found_index = current_index
+            break
+        if p.startswith("-"):
+            continue
+        current_index += 1
+    # "<target.sh> option1 option2" => found_index == 0
+    # python -u <target.py> ==> found_index == 1
+    is_primay_target = found_index >= 0 and found_index <= 1
+    return is_primay_target
+
+
+targets = ["/tmp/install.sh", "/tmp/install", "install.py", "{{ work_dir }}/setup.sh", "/opt/app.tar.gz"]
+
+
+@pytest.mark.parametrize(
+    "cmd_str",
+    [
+        "/tmp/install.sh --force",
+        "bash /tmp/install.sh",
+        "bash -x /tmp/install.sh",
+        "python -u install.py",
+        "sudo python install.py",
+        "tar xzf /opt/app.tar.gz",
+        "/usr/bin/tar xzf /opt/app.tar.gz",
+        "sh {{ work_dir }}/setup.sh arg",
+        "chmod +x /tmp/install.sh\n/tmp/install.sh",
+        "echo /tmp/install",
+        "cd /tmp && ./install.sh",
+        "",
+    ],
+)
+def test_download_exec_matcher(cmd_str):
+    matcher = _PrefixMatcher()
+    for i, target in enumerate(targets):
+        matcher.add(target, i)
+    expected = set(i for i, target in enumerate(targets) if _is_executed(cmd_str, target))
+    assert _find_executed(cmd_str, matcher) == expected
+
+
+def _inbound_taskcall(name, role):
+    task = Task(key="task {}".format(name), name=name, role=role)
+    taskcall = TaskCall.from_spec(task, None)
+    anno = RiskAnnotation(type=RISK_ANNOTATION_TYPE, category=AnnotatorCategory.INBOUND)
+    anno.data = {"dest": "/tmp/{}".format(name), "undetermined_src": True, "mutable_src_vars": ["url"]}
+    taskcall.annotations.append(anno)
+    return taskcall
+
+
+def test_compositional_rule_cache():
+    rule = InboundTransferRule()
+    role_taskcalls = [_inbound_taskcall("t{}".format(i), "sample_role") for i in range(3)]
+    playbook_taskcalls = [_inbound_taskcall("p0", "")] + role_taskcalls + [_inbound_taskcall("p1", "")]
+    rule_cache = {}
+    for taskcalls in [role_taskcalls, playbook_taskcalls]:
+        category_index = make_category_index(taskcalls)
+        segments = make_role_segments(taskcalls)
+        matched, _, message = check_rule(rule, taskcalls, category_index, segments, rule_cache, {})
+        expected_matched, _, expected_message = rule.check(taskcalls)
+        assert matched == expected_matched
+        assert message == expected_message
+    # the role segment is checked once and reused for the playbook
+    assert len(rule_cache) == 1
+
+
+default_rules = ["DownloadExecRule", "InboundTransferRule", "OutboundTransferRule"]
+INBOUND = AnnotatorCategory.INBOUND
+OUTBOUND = AnnotatorCategory.OUTBOUND
+
+
+@pytest.mark.parametrize(
+    "options, selected_rules, categories",
+    [
+        ({}, default_rules, {INBOUND, AnnotatorCategory.CMD_EXEC, OUTBOUND}),
+        ({"rule_names": ["InboundTransfer"]}, ["InboundTransferRule"], {INBOUND}),
+        ({"rule_names": ["ExternalDependencyRule", "SampleCustomRule"]}, ["ExternalDependencyRule", "SampleCustomRule"], set()),
+        ({"skip_rules": ["Download & Exec"], "min_severity": "medium"}, ["InboundTransferRule", "OutboundTransferRule"], {INBOUND, OUTBOUND}),
+        ({"rule_names": ["SampleCustomRule", "InboundTransfer"], "tags": ["debug"]}, ["SampleCustomRule"], set()),
+    ],
+)
+def test_rule_selection(options, selected_rules, categories):
+    rules = load_rules(**options)
+    assert sorted([type(r).__name__ for r in rules]) == selected_rules
+    assert get_required_categories(rules) == categories
+    # the selection does not change the default rules
+    assert [type(r).__name__ for r in load_rules()] == default_rules
+    annotator_names = [ax.name for ax in load_annotators(categories)]
+    assert ("ansible.builtin" in annotator_names) == (len(categories) > 0)
+
+
+def test_rule_selection_unknown_rule():
+    with pytest.raises(ValueError):
+        load_rules(rule_names=["NoSuchRule"])
+
+
+def _module_taskcall(name, resolved_name):
+    task = Task(key="task {}".format(name), name=name, executable_type=ExecutableType.MODULE_TYPE, resolved_name=resolved_name)
+    return TaskCall.from_spec(task, None)
+
+
+def test_rule_instances_are_stateless():
+    rule = load_rules(rule_names=["ExternalDependency"])[0]
+    # the same instance is reused across scans
+    assert load_rules(rule_names=["ExternalDependency"])[0] is rule
+    taskcalls = [_module_taskcall("a", "community.general.ufw"), _module_taskcall("b", "community.mongodb.mongodb_user")]
+
+    matched, _, message = rule.check(taskcalls, collection_name="community.general")
+    assert matched and message == "['community.mongodb']"
+    # the collection name of the previous scan is not kept
+    matched, _, message = rule.check(taskcalls, collection_name="community.mongodb")
+    assert matched and message == "['community.general']"
+    assert rule.allow_list == []
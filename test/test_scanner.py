@@ -14,9 +14,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
+import io
+import json
+import os
+import subprocess
+import tarfile
+
 import pytest
 
-from ansible_risk_insight.scanner import ARIScanner, config
+from ansible_risk_insight.risk_detector import detect, get_required_categories, get_subscribed_taskcalls, load_rules, make_category_index
+from ansible_risk_insight.scanner import ARIScanner, config, get_int_env
 from ansible_risk_insight.rules.download_exec import DownloadExecRule
 
 
@@ -45,6 +53,8 @@ def test_scanner_with_collection(type, name):
 @pytest.mark.parametrize("type, name", [("role", "test/testdata/roles/test_role")])
 def test_scanner_with_role(type, name):
     s = _scan(type, name)
+    # the timings are saved only with rule_stats
+    assert "stats" not in s.findings.metadata
     risk_found_role_count = s.findings.report.get("summary", {}).get("roles", {}).get("risk_found", -1)
     assert risk_found_role_count > 0
     details = s.findings.report.get("details", [])
@@ -64,3 +74,181 @@ def _scan(type, name):
     s.prepare_dependencies()
     s.load()
     return s
+
+
+@pytest.mark.parametrize(
+    "type, name, fail_on, failed",
+    [
+        ("role", "test/testdata/roles/test_role", "high", True),
+        ("role", "test/testdata/roles/test_role", "very_high", False),
+    ],
+)
+def test_scanner_fail_on(type, name, fail_on, failed):
+    s = ARIScanner(
+        type=type,
+        name=name,
+        root_dir=config.data_dir,
+        fail_on=fail_on,
+    )
+    s.prepare_dependencies()
+    s.load()
+    assert s.is_gate_failed() == failed
+
+
+def _git(cwd, *args):
+    proc = subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.strip()
+
+
+def _commit(repo, files, removed=[]):
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(os.path.join(repo, name)), exist_ok=True)
+        with open(os.path.join(repo, name), "w") as f:
+            f.write(text)
+    for name in removed:
+        os.remove(os.path.join(repo, name))
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "update")
+    return _git(repo, "rev-parse", "HEAD")
+
+
+def test_scanner_with_git_commit(tmp_path):
+    mirror_dir = str(tmp_path / "mirror")
+    os.makedirs(os.path.join(mirror_dir, "collections"))
+    manifest = {"collection_info": {"namespace": "ns", "name": "a", "version": "1.0.0", "dependencies": {}}}
+    with tarfile.open(os.path.join(mirror_dir, "collections", "ns-a-1.0.0.tar.gz"), "w:gz") as tar:
+        data = json.dumps(manifest).encode()
+        info = tarfile.TarInfo(name="MANIFEST.json")
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+
+    repo = str(tmp_path / "repo")
+    os.makedirs(repo)
+    _git(repo, "init", "-q")
+    first = _commit(
+        repo,
+        {
+            "requirements.yml": "collections:\n  - name: ns.a\n",
+            "site.yml": "- hosts: all\n  tasks:\n    - name: old\n      ansible.builtin.debug:\n        msg: old\n",
+        },
+    )
+    _commit(repo, {"site.yml": "- hosts: all\n  tasks:\n    - name: new\n      ansible.builtin.shell: echo new\n"}, removed=["requirements.yml"])
+    # the first commit is not in the depth-1 clone
+    clone = str(tmp_path / "clone")
+    _git(str(tmp_path), "clone", "-q", "--depth", "1", "file://{}".format(repo), clone)
+
+    s = ARIScanner(
+        type="project",
+        name=clone,
+        root_dir=str(tmp_path / "data"),
+        mirror_dir=mirror_dir,
+        git_commit=first,
+        without_ram=True,
+        silent=True,
+    )
+    clone_refs = _git(clone, "show-ref")
+    s.prepare_dependencies()
+    s.load()
+    # both the dependencies and the playbooks are read from the commit
+    assert [dep["name"] for dep in s.loaded_dependency_dirs] == ["ns.a"]
+    assert s.version == first
+    tasks = s.root_definitions["definitions"]["tasks"]
+    assert [t.module for t in tasks] == ["ansible.builtin.debug"]
+    # the commit is fetched into a private mirror, and the clone is not changed
+    assert s.git_commit_dir.startswith(str(tmp_path / "data"))
+    assert _git(clone, "show-ref") == clone_refs
+    assert _git(clone, "rev-parse", "--is-shallow-repository") == "true"
+
+    # a branch of the origin which is not in the clone
+    _git(repo, "branch", "old", first)
+    s = ARIScanner(
+        type="project",
+        name=clone,
+        root_dir=str(tmp_path / "data"),
+        mirror_dir=mirror_dir,
+        git_commit="old",
+        without_ram=True,
+        silent=True,
+    )
+    s.prepare_dependencies()
+    s.load()
+    assert s.version == first
+    assert _git(clone, "show-ref") == clone_refs
+
+    s = ARIScanner(type="project", name=repo, root_dir=str(tmp_path / "data"), git_commit="no-such-commit", without_ram=True, silent=True)
+    with pytest.raises(ValueError):
+        s.prepare_dependencies()
+
+
+@pytest.mark.parametrize(
+    "fail_on, min_severity, selected_rules",
+    [
+        ("high", "", ["DownloadExecRule"]),
+        ("medium", "high", ["DownloadExecRule"]),
+        ("medium", "", ["DownloadExecRule", "InboundTransferRule", "OutboundTransferRule"]),
+        ("very_high", "", []),
+    ],
+)
+def test_fail_on_prunes_rules(tmp_path, fail_on, min_severity, selected_rules):
+    s = ARIScanner(type="role", name="test/testdata/roles/test_role", root_dir=str(tmp_path), fail_on=fail_on, min_severity=min_severity)
+    rules = s.get_rules()
+    assert sorted([type(r).__name__ for r in rules]) == selected_rules
+    # the annotators for the skipped rules do not run
+    expected_categories = get_required_categories(load_rules(rule_names=selected_rules)) if selected_rules else set()
+    assert get_required_categories(rules) == expected_categories
+
+
+def test_category_dispatch(tmp_path):
+    s = ARIScanner(type="role", name="test/testdata/roles/test_role", root_dir=str(tmp_path))
+    s.prepare_dependencies()
+    s.load()
+    rules = load_rules()
+    # the same rules without the categories check all the taskcalls
+    full_scan_rules = []
+    for rule in rules:
+        full_scan_rule = copy.copy(rule)
+        full_scan_rule.categories = []
+        full_scan_rules.append(full_scan_rule)
+    taskcalls = [tc for tree in s.taskcalls_in_trees for tc in tree.taskcalls]
+    category_index = make_category_index(taskcalls)
+    # some taskcalls are skipped by the dispatch on the test data
+    assert any([len(get_subscribed_taskcalls(rule, taskcalls, category_index)) < len(taskcalls) for rule in rules])
+
+    report = detect(s.taskcalls_in_trees, rules=rules)
+    full_scan_report = detect(s.taskcalls_in_trees, rules=full_scan_rules)
+    assert len(report["details"]) > 0
+    assert report == full_scan_report
+
+
+def test_fail_on_stops_tree_by_tree(tmp_path):
+    project = str(tmp_path / "project")
+    safe_tasks = "".join(["    - debug:\n        msg: {}\n".format(i) for i in range(20)])
+    files = {
+        "roles/installer/tasks/main.yml": '- get_url:\n    url: "{{ url }}"\n    dest: /tmp/install.sh\n- command: /tmp/install.sh\n',
+        "roles/installer/defaults/main.yml": "url: https://example.com/install.sh\n",
+        "risky.yml": "- hosts: all\n  roles:\n    - installer\n",
+        "safe1.yml": "- hosts: all\n  tasks:\n" + safe_tasks,
+        "safe2.yml": "- hosts: all\n  tasks:\n" + safe_tasks,
+    }
+    for name, content in files.items():
+        os.makedirs(os.path.dirname(os.path.join(project, name)), exist_ok=True)
+        with open(os.path.join(project, name), "w") as f:
+            f.write(content)
+
+    s = ARIScanner(type="project", name=project, root_dir=str(tmp_path / "data"), fail_on="high", without_ram=True, silent=True)
+    s.prepare_dependencies()
+    s.load()
+    assert s.is_gate_failed()
+    assert len(s.trees) == 4
+    # the trees after the failing role are neither resolved nor analyzed
+    assert [t.root_key for t in s.taskcalls_in_trees] == ["role role:installer"]
+
+
+def test_get_int_env(monkeypatch):
+    monkeypatch.setenv("ARI_LOOP_EXPANSION_LIMIT", "50")
+    assert get_int_env("ARI_LOOP_EXPANSION_LIMIT", 100) == 50
+    monkeypatch.setenv("ARI_LOOP_EXPANSION_LIMIT", "unlimited")
+    assert get_int_env("ARI_LOOP_EXPANSION_LIMIT", 100) == 100
+    monkeypatch.delenv("ARI_LOOP_EXPANSION_LIMIT")
+    assert get_int_env("ARI_LOOP_EXPANSION_LIMIT", 100) == 100
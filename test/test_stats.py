@@ -0,0 +1,35 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from ansible_risk_insight.stats import ExecutionStats, stats_to_display
+
+
+def test_execution_stats():
+    stats = ExecutionStats()
+    assert stats.measure("double", lambda x: x * 2, 3) == 6
+    assert stats.measure("empty", lambda: [], hit_func=lambda r: len(r) > 0) == []
+    for i in range(1, 21):
+        stats.record("sample", i / 100, hit=i % 2 == 0)
+
+    summary = stats.summary()
+    assert summary["double"]["count"] == 1 and summary["double"]["hit"] == 1
+    assert summary["empty"]["count"] == 1 and summary["empty"]["hit"] == 0
+    assert summary["sample"] == {"count": 20, "hit": 10, "total_time": 2.1, "p95_time": 0.19}
+
+    lines = stats_to_display({"rules": summary, "annotators": {}}).splitlines()
+    assert lines[1].split()[:3] == ["RULE", "CALLS", "HITS"]
+    # sorted by the total time
+    assert lines[2].split()[:3] == ["sample", "20", "10"]
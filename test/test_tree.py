@@ -0,0 +1,63 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+from ansible_risk_insight.models import Load, LoadType
+from ansible_risk_insight.parser import Parser, LazyDefinitions
+from ansible_risk_insight.tree import TreeLoader
+
+
+def _write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_lazy_definitions(tmp_path):
+    collection_dir = str(tmp_path / "my.collection")
+    _write(os.path.join(collection_dir, "plugins", "modules", "sample.py"), "# sample module\n")
+    _write(os.path.join(collection_dir, "roles", "used", "tasks", "main.yml"), "- name: used task\n  my.collection.sample:\n    opt: 1\n")
+    _write(os.path.join(collection_dir, "roles", "unused", "tasks", "main.yml"), "- name: unused task\n  debug:\n    msg: hi\n")
+
+    playbook_path = str(tmp_path / "site.yml")
+    _write(playbook_path, "- hosts: all\n  roles:\n    - my.collection.used\n")
+    root_load = Load(target_name=playbook_path, target_type=LoadType.PLAYBOOK, path=playbook_path)
+    root_load.playbooks = [playbook_path]
+    definitions, mappings = Parser().run(load_data=root_load)
+    root_definitions = {"definitions": definitions, "mappings": mappings}
+
+    lazy = LazyDefinitions(LoadType.COLLECTION, "my.collection", collection_dir)
+    # only the module index and the role stubs are made at first
+    assert [m.fqcn for m in lazy.definitions["modules"]] == ["my.collection.sample"]
+    assert lazy.definitions["roles"] == []
+    assert sorted([r.fqcn for r in lazy.role_stubs]) == ["my.collection.unused", "my.collection.used"]
+
+    ext_definitions = {
+        "collection-my.collection": {
+            "definitions": lazy.definitions,
+            "mappings": Load(target_name="my.collection", target_type=LoadType.COLLECTION, path=collection_dir),
+            "lazy": lazy,
+        }
+    }
+    tl = TreeLoader(root_definitions, ext_definitions)
+    trees, _ = tl.run()
+
+    assert [r.fqcn for r in lazy.definitions["roles"]] == ["my.collection.used"]
+    assert [tf.defined_in for tf in lazy.definitions["taskfiles"]] == ["roles/used/tasks/main.yml"]
+    keys = [obj.spec.key for obj in trees[0].items]
+    assert lazy.definitions["roles"][0].key in keys
+    assert lazy.definitions["modules"][0].key in keys
@@ -0,0 +1,152 @@
+# -*- mode:python; coding:utf-8 -*-
+
+# Copyright (c) 2022 IBM Corp. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import json
+import os
+import stat
+import subprocess
+import tarfile
+
+import pytest
+
+from ansible_risk_insight.utils import install_collection_from_targz, install_github_target, place_tree
+
+
+def _add_file(tar, name, data: bytes):
+    info = tarfile.TarInfo(name=name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _make_collection_targz(path):
+    manifest = {"collection_info": {"namespace": "ns", "name": "col", "version": "1.0.0"}}
+    with tarfile.open(path, "w:gz") as tar:
+        _add_file(tar, "MANIFEST.json", json.dumps(manifest).encode())
+        _add_file(tar, "plugins/modules/sample.py", b"# module")
+        _add_file(tar, "roles/r/tasks/main.yml", b"- debug:\n")
+        _add_file(tar, "README.md", b"readme")
+        _add_file(tar, "../escaped.txt", b"evil")
+        link = tarfile.TarInfo(name="passwd")
+        link.type = tarfile.SYMTYPE
+        link.linkname = "/etc/passwd"
+        tar.addfile(link)
+
+
+@pytest.mark.parametrize("ansible_files_only", [False, True])
+def test_install_collection_from_targz(tmp_path, ansible_files_only):
+    targz = str(tmp_path / "ns-col-1.0.0.tar.gz")
+    _make_collection_targz(targz)
+    cache_dir = str(tmp_path / "extracted")
+
+    dst1 = install_collection_from_targz(targz, str(tmp_path / "out1"), cache_dir, ansible_files_only)
+    dst2 = install_collection_from_targz(targz, str(tmp_path / "out2"), cache_dir, ansible_files_only)
+    assert dst1 == str(tmp_path / "out1" / "ansible_collections" / "ns" / "col")
+    for dst in [dst1, dst2]:
+        assert os.path.exists(os.path.join(dst, "plugins", "modules", "sample.py"))
+        assert os.path.exists(os.path.join(dst, "roles", "r", "tasks", "main.yml"))
+        assert os.path.exists(os.path.join(dst, "README.md")) != ansible_files_only
+        assert not os.path.lexists(os.path.join(dst, "passwd"))
+    assert not os.path.exists(str(tmp_path / "out1" / "ansible_collections" / "ns" / "escaped.txt"))
+    # extracted once and shared with hardlinks
+    assert len(os.listdir(cache_dir)) == 1
+    assert os.path.samefile(os.path.join(dst1, "MANIFEST.json"), os.path.join(dst2, "MANIFEST.json"))
+    # the shared files are read-only so that a write to an installed file does not change the cache
+    for root, _, files in os.walk(dst1):
+        for name in files:
+            assert os.stat(os.path.join(root, name)).st_mode & (stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH) == 0
+    # the installed collection can still be replaced
+    os.remove(os.path.join(dst1, "MANIFEST.json"))
+    dst1 = install_collection_from_targz(targz, str(tmp_path / "out1"), cache_dir, ansible_files_only)
+    assert os.path.samefile(os.path.join(dst1, "MANIFEST.json"), os.path.join(dst2, "MANIFEST.json"))
+
+
+@pytest.mark.parametrize("mode", ["hardlink", "reflink", "copy"])
+def test_place_tree(tmp_path, mode):
+    src = tmp_path / "src"
+    (src / "role" / "tasks").mkdir(parents=True)
+    (src / "role" / "tasks" / "main.yml").write_text("- debug:\n")
+    (src / "role" / ".hidden").write_text("nested hidden file")
+    (src / ".git").mkdir()
+    os.symlink("role", str(src / "role_link"))
+    dst = tmp_path / "dst"
+    (dst / "role" / "tasks").mkdir(parents=True)
+    (dst / "role" / "tasks" / "main.yml").write_text("old")
+
+    place_tree(str(src), str(dst), mode, skip_hidden=True)
+    placed = dst / "role" / "tasks" / "main.yml"
+    assert placed.read_text() == "- debug:\n"
+    assert (dst / "role" / ".hidden").exists()
+    assert not (dst / ".git").exists()
+    assert os.readlink(str(dst / "role_link")) == "role"
+    is_same_file = os.stat(str(placed)).st_ino == os.stat(str(src / "role" / "tasks" / "main.yml")).st_ino
+    assert is_same_file == (mode == "hardlink")
+
+    with pytest.raises(ValueError):
+        place_tree(str(src), str(dst), "symlink")
+
+
+def _git(cwd, *args):
+    proc = subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com"] + list(args), cwd=cwd, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stderr
+    return proc.stdout.strip()
+
+
+def _commit(repo, files):
+    for name, text in files.items():
+        os.makedirs(os.path.dirname(os.path.join(repo, name)), exist_ok=True)
+        with open(os.path.join(repo, name), "w") as f:
+            f.write(text)
+    _git(repo, "add", "-A")
+    _git(repo, "commit", "-q", "-m", "update")
+
+
+def test_install_github_target(tmp_path):
+    repo = str(tmp_path / "repo")
+    os.makedirs(repo)
+    _git(repo, "init", "-q")
+    _commit(repo, {"site.yml": "- hosts: all\n", "docs/manual.md": "old"})
+    _commit(repo, {"roles/r/tasks/main.yml": "- debug:\n", "group_vars/all.yml": "a: 1\n", "docs/manual.md": "new"})
+    url = "file://{}".format(repo)
+    mirror_cache_dir = str(tmp_path / "mirrors")
+
+    full = str(tmp_path / "full")
+    install_github_target(url, full, depth=0)
+    assert _git(full, "rev-list", "--count", "HEAD") == "2"
+
+    sparse = str(tmp_path / "sparse")
+    install_github_target(url, sparse, sparse=True, mirror_cache_dir=mirror_cache_dir)
+    assert _git(sparse, "rev-list", "--count", "HEAD") == "1"
+    assert _git(sparse, "remote", "get-url", "origin") == url
+    for name in ["site.yml", "roles/r/tasks/main.yml", "group_vars/all.yml"]:
+        assert os.path.exists(os.path.join(sparse, name))
+    assert not os.path.exists(os.path.join(sparse, "docs", "manual.md"))
+
+    # the mirror is updated in the next clone
+    _commit(repo, {"playbooks/new.yml": "- hosts: all\n"})
+    shallow = str(tmp_path / "shallow")
+    install_github_target(url, shallow, mirror_cache_dir=mirror_cache_dir)
+    assert len(os.listdir(mirror_cache_dir)) == 2  # the mirror and its lock file
+    assert os.path.exists(os.path.join(shallow, "playbooks", "new.yml"))
+    assert os.path.exists(os.path.join(shallow, "docs", "manual.md"))
+    assert _git(shallow, "rev-list", "--count", "HEAD") == "1"
+
+    # the mirror has only the default branch, and it is as shallow as the clone
+    _git(repo, "branch", "other")
+    install_github_target(url, str(tmp_path / "shallow2"), mirror_cache_dir=mirror_cache_dir)
+    mirror_dir = [os.path.join(mirror_cache_dir, name) for name in os.listdir(mirror_cache_dir) if name.endswith(".git")][0]
+    assert _git(mirror_dir, "for-each-ref", "--format=%(refname)") == "refs/heads/{}".format(_git(repo, "symbolic-ref", "--short", "HEAD"))
+    assert _git(mirror_dir, "rev-list", "--count", "HEAD") == "1"